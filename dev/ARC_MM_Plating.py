@@ -45,13 +45,12 @@ def run(protocol: protocol_api.ProtocolContext):
 
     ARC_wells = [num for num in list if (num % 8 != 2) or (num < 64)]  # remove wells C9-C12 from list: #66, 74, 82, and 90
 
-    for i in range(number_of_plates):
-
-        p300.distribute(
-            volume,
-            rack['A1'],
-            [plateDict[str(i+1)].wells()[wellIndex] for wellIndex in ARC_wells],
-            disposal_volume = 10
-        )
+    # one continuous distribute across all plates - same tube, same tip
+    p300.distribute(
+        volume,
+        rack['A1'],
+        [plateDict[str(i+1)].wells()[wellIndex] for i in range(number_of_plates) for wellIndex in ARC_wells],
+        disposal_volume = 10
+    )
 
     protocol.home()
@@ -0,0 +1,10 @@
+'''
+Offline planning tools for the Opentrons protocols in this repository.
+
+These modules run on a lab computer (not on the robot) and are used to plan, check and
+benchmark protocols before they are uploaded. Run them from the `dev` folder, e.g.:
+
+    python -m planning.dilution
+
+See README.md in this folder for an overview of each tool.
+'''
@@ -0,0 +1,158 @@
+'''
+Protocol analysis benchmark
+
+Times how long the Opentrons simulator takes to analyze each protocol - i.e. the wait an
+operator sees in the app every time a protocol is uploaded or a parameter is changed.
+Every measurement runs in a fresh Python process, so that the protocol's own imports
+(pandas, for example) are counted the way they are on the robot. The Opentrons package
+itself is imported before the timer starts, since it is always loaded on the robot.
+
+With --baseline, each protocol is also timed as it was at an earlier git revision,
+giving a before/after table.
+
+Usage (from the dev folder; requires the `opentrons` package):
+
+    python -m planning.analysis_bench
+    python -m planning.analysis_bench --baseline HEAD~1 --repeat 5
+    python -m planning.analysis_bench "../protocols/Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py"
+'''
+
+import argparse
+import json
+import os
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[2]
+LABWARE_ROOT = REPO_ROOT / 'labware_definitions'
+
+
+def labware_dirs() -> list:
+    '''All folders under labware_definitions that contain labware JSON files
+    (the simulator does not search sub-folders itself).'''
+    return sorted({str(path.parent) for path in LABWARE_ROOT.rglob('*.json')})
+
+
+def find_protocols(root: pathlib.Path = REPO_ROOT / 'protocols') -> list:
+    '''Every protocol file (a .py file defining `run`) under root.'''
+    return sorted(path for path in root.rglob('*.py')
+                  if 'def run(' in path.read_text(encoding='utf-8', errors='ignore'))
+
+
+def _short_error(error: Exception, limit: int = 200) -> str:
+    '''One-line summary of a simulation error (engine errors wrap the useful message in a "detail" field).'''
+    text = str(error)
+    detail = re.search(r"detail='([^']*)'", text)
+    if detail:
+        text = detail.group(1)
+    text = text.splitlines()[0] if text else type(error).__name__
+    return text[:limit]
+
+
+def _worker(path: str) -> None:
+    '''Run in a subprocess: time a single analysis of one protocol and print the result as JSON.'''
+    import io
+    import logging
+    import time
+    logging.disable(logging.CRITICAL)
+    from opentrons import simulate  # loaded on the robot already - not part of the timing
+
+    result = {'status': 'ok', 'seconds': None, 'commands': None, 'error': ''}
+    with open(path, 'rb') as protocol_file:
+        contents = protocol_file.read()
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()  # the simulator prints setup messages
+    try:
+        start = time.perf_counter()
+        commands, _ = simulate.simulate(io.BytesIO(contents), os.path.basename(path),
+                                        custom_labware_paths=labware_dirs())
+        result['seconds'] = time.perf_counter() - start
+        result['commands'] = len(commands)
+    except Exception as error:
+        result['status'] = 'error'
+        result['error'] = _short_error(error)
+    finally:
+        sys.stdout = stdout
+    print(json.dumps(result))
+
+
+def time_analysis(path, repeat: int = 3) -> dict:
+    '''Median analysis time of one protocol file over `repeat` fresh processes.'''
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-m', 'planning.analysis_bench', '--worker', str(pathlib.Path(path).resolve())],
+                              capture_output=True, text=True, cwd=pathlib.Path(__file__).resolve().parents[1])
+        lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+        if not lines:
+            return {'status': 'error', 'seconds': None, 'commands': None,
+                    'error': (proc.stderr.strip().splitlines() or ['no output'])[-1]}
+        runs.append(json.loads(lines[-1]))
+        if runs[-1]['status'] != 'ok':
+            return runs[-1]
+    result = dict(runs[-1])
+    result['seconds'] = statistics.median(run['seconds'] for run in runs)
+    return result
+
+
+def file_at_revision(path: pathlib.Path, revision: str, directory: str):
+    '''Write the version of path at a git revision into directory (same file name); None if it did not exist.'''
+    relative = path.resolve().relative_to(REPO_ROOT).as_posix()
+    proc = subprocess.run(['git', 'show', f'{revision}:{relative}'], capture_output=True, cwd=REPO_ROOT)
+    if proc.returncode != 0:
+        return None
+    old_path = pathlib.Path(directory) / path.name
+    old_path.write_bytes(proc.stdout)
+    return old_path
+
+
+def _format_seconds(result) -> str:
+    if result is None:
+        return '-'
+    if result['status'] != 'ok':
+        return 'error'
+    return f"{result['seconds'] * 1000:.0f} ms"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark Opentrons analysis time for each protocol.')
+    parser.add_argument('protocols', nargs='*', help='protocol files (default: everything under protocols/)')
+    parser.add_argument('--baseline', help='git revision to compare against (e.g. HEAD~1)')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh processes per protocol (median is reported)')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        _worker(args.worker)
+        return 0
+
+    paths = [pathlib.Path(p) for p in args.protocols] or find_protocols()
+    errors = []
+    print(f"{'protocol':<60} {'before':>10} {'after':>10} {'change':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for path in paths:
+            after = time_analysis(path, args.repeat)
+            before = None
+            if args.baseline:
+                old_path = file_at_revision(path, args.baseline, directory)
+                before = time_analysis(old_path, args.repeat) if old_path else None
+
+            change = ''
+            if before and before['status'] == 'ok' and after['status'] == 'ok':
+                change = f"{(after['seconds'] / before['seconds'] - 1) * 100:+.0f}%"
+            print(f'{path.name:<60} {_format_seconds(before):>10} {_format_seconds(after):>10} {change:>8}')
+            for label, result in (('before', before), ('after', after)):
+                if result and result['status'] != 'ok':
+                    errors.append(f"{path.name} ({label}): {result['error']}")
+
+    for error in errors:
+        print(f'  ! {error}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+'''
+Travel heights between labware
+
+When the pipette moves from one labware to another, the robot arcs up to 10 mm above the tallest
+object on the whole deck - the tallest labware, or the fixed trash (82 mm) - whatever lies between
+the two. Moves within one labware only clear that labware (+5 mm). So a single tall item (a 1000 µL
+tip rack, a 5 mL or 25 mL tube rack) raises every plate-to-rack move of the run, even when the
+path never goes near it.
+
+This module works out, from the labware definitions (custom ones in labware_definitions/ first)
+and the deck layout of a simulated run:
+
+* the arc height the robot uses between labware (`deck_arc`), and which item sets it;
+* the lowest safe arc for each source/destination pair (`path_arc`): 10 mm above the tallest
+  item whose footprint the straight path between the two wells passes over (with `TIP_CLEARANCE`
+  either side), including the two labware themselves;
+* the Z travel each protocol run would save at the path heights, and layout suggestions:
+  which labware raise the arc above the trash's floor, and by how much that costs per run.
+
+The Python API cannot lower an arc: `minimum_z_height` can only raise it, and `force_direct`
+skips the arc - and every collision check - altogether. So path heights are not applied to the
+protocols; the report is for choosing deck layouts and labware (the arc follows the tallest item
+that is loaded, so leaving tall racks off the deck when they aren't used lowers every move).
+
+Usage (from the dev folder; requires the `opentrons` package):
+
+    python -m planning.arcs
+'''
+
+from dataclasses import dataclass
+import importlib.util
+import json
+import logging
+import math
+import re
+
+from planning.labware import LABWARE_ROOT, load_definition
+from planning.routing import PlacedLabware, slot_origin, trash_point
+
+
+ARC_MARGIN = 10.0       # mm above the highest obstacle for moves between labware (Opentrons motion planning)
+TRASH_HEIGHT = 82.0     # mm, OT-2 fixed trash (deck definition)
+TRASH_SIZE = (107.11, 165.67)
+TIP_CLEARANCE = 5.0     # mm either side of the straight path that must be clear
+Z_SPEED = 125.0         # mm/s, OT-2 default z speed
+TRASH_SLOT = 12
+
+
+@dataclass
+class Obstacle:
+    name: str
+    slot: int
+    height: float
+    box: tuple      # (x0, y0, x1, y1) footprint on the deck
+
+
+def obstacles(layout: dict) -> list:
+    '''Footprints and heights of the labware in a layout (slot -> load name), plus the fixed trash.'''
+    items = []
+    for slot, load_name in layout.items():
+        definition = load_definition(load_name)
+        x, y = slot_origin(slot)
+        dims = definition['dimensions']
+        items.append(Obstacle(load_name, slot, dims['zDimension'], (x, y, x + dims['xDimension'], y + dims['yDimension'])))
+    tx, ty = trash_point()
+    items.append(Obstacle('fixed trash', TRASH_SLOT, TRASH_HEIGHT,
+                          (tx - TRASH_SIZE[0] / 2, ty - TRASH_SIZE[1] / 2, tx + TRASH_SIZE[0] / 2, ty + TRASH_SIZE[1] / 2)))
+    return items
+
+
+def deck_arc(items: list) -> tuple:
+    '''(arc height, the item that sets it) for moves between labware.'''
+    tallest = max(items, key=lambda item: item.height)
+    return tallest.height + ARC_MARGIN, tallest
+
+
+def _crosses(a: tuple, b: tuple, box: tuple, clearance: float) -> bool:
+    x0, y0, x1, y1 = box[0] - clearance, box[1] - clearance, box[2] + clearance, box[3] + clearance
+    steps = max(1, int(math.dist(a, b) / 2))
+    for k in range(steps + 1):
+        x = a[0] + (b[0] - a[0]) * k / steps
+        y = a[1] + (b[1] - a[1]) * k / steps
+        if x0 <= x <= x1 and y0 <= y <= y1:
+            return True
+    return False
+
+
+def path_arc(items: list, a: tuple, b: tuple, slots: tuple) -> float:
+    '''Lowest safe arc between two points: ARC_MARGIN above the tallest item under the path,
+    counting the labware in the two slots themselves.'''
+    under = [item.height for item in items
+             if item.slot in slots or _crosses(a, b, item.box, TIP_CLEARANCE)]
+    return max(under) + ARC_MARGIN
+
+
+def simulate(path: str, before_run=None, **params) -> tuple:
+    '''Run a protocol in the simulator. Returns (layout: slot -> load name, command texts).
+    before_run, if given, is called with the protocol context just before the protocol's run().'''
+    from opentrons import simulate as opentrons_simulate
+    from opentrons.protocol_api._parameter_context import ParameterContext
+    from opentrons.protocols.api_support.types import APIVersion
+
+    logging.disable(logging.CRITICAL)
+    spec = importlib.util.spec_from_file_location('protocol', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    version = APIVersion.from_string(module.metadata['apiLevel'])
+    extra = {}
+    for definition_path in LABWARE_ROOT.rglob('*.json'):
+        definition = json.loads(definition_path.read_text(encoding='utf-8'))
+        extra[definition['parameters']['loadName']] = definition
+    context = opentrons_simulate.get_protocol_api(version, extra_labware=extra)
+    if hasattr(module, 'add_parameters'):
+        parameters = ParameterContext(version)
+        module.add_parameters(parameters)
+        parameters.set_parameters(params)
+        context._params = parameters.export_parameters_for_protocol()
+    if before_run:
+        before_run(context)
+    module.run(context)
+    layout = {int(slot): labware.load_name for slot, labware in context.loaded_labwares.items()
+              if int(slot) != TRASH_SLOT}
+    return layout, context.commands()
+
+
+_LOCATION = re.compile(r'(?:from|into|at|in) (?:([A-P]\d{1,2}) of )?.*? on (?:slot )?(\d+)')
+_MOVES = ('Aspirating', 'Dispensing', 'Blowing out', 'Picking up tip', 'Dropping tip', 'Mixing', 'Touching tip')
+
+
+def visits(layout: dict, commands: list) -> list:
+    '''(slot, (x, y)) of every liquid handling and tip command, in order.'''
+    placed = {slot: PlacedLabware(load_name, slot) for slot, load_name in layout.items()}
+    trash = trash_point()
+    points = []
+    for text in commands:
+        text = text.strip()
+        if not text.startswith(_MOVES):
+            continue
+        match = _LOCATION.search(text)
+        if not match:
+            continue
+        well, slot = match.group(1), int(match.group(2))
+        if slot in placed and well:
+            points.append((slot, placed[slot].point(well)))
+        elif slot == TRASH_SLOT:
+            points.append((slot, trash))
+    return points
+
+
+@dataclass
+class ArcReport:
+    moves: int              # moves between labware
+    deck_arc: float
+    tallest: Obstacle
+    saved: float            # mm of Z travel saved at path heights (up and down)
+    excess: float           # mm of Z travel the tallest item adds over the run, above the next tallest (or the trash)
+
+
+def analyse(layout: dict, commands: list) -> ArcReport:
+    items = obstacles(layout)
+    arc, tallest = deck_arc(items)
+    moves, saved = 0, 0.0
+    points = visits(layout, commands)
+    for (slot_a, a), (slot_b, b) in zip(points, points[1:]):
+        if slot_a == slot_b:
+            continue
+        moves += 1
+        saved += 2 * (arc - path_arc(items, a, b, (slot_a, slot_b)))
+    next_tallest = max(item.height for item in items if item is not tallest)
+    excess = 2 * moves * (tallest.height - max(next_tallest, TRASH_HEIGHT))
+    return ArcReport(moves, arc, tallest, saved, excess)
+
+
+if __name__ == '__main__':
+    import os
+
+    root = os.path.join(os.path.dirname(__file__), '..', '..', 'protocols')
+    runs = [
+        ('StdCurve, 1 plate, 7B10', 'Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py',
+         {'num_plates': 1, 'robot': '7B10'}),
+        ('StdCurve, 4 plates, 8B04', 'Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py',
+         {'num_plates': 4, 'robot': '8B04'}),
+        ('Custom dilution series', 'Freetown_Custom_Dilution_Series.py', {}),
+        ('LSP pools, 12 replicates', 'Freetown/Assay Development/LSP_Pools_12replicates.py', {}),
+        ('PrimerEval, 8 primers', 'Freetown/Assay Development/PrimerEval_PlatePrimers_Custom.py', {}),
+        ('Pretoria RNA aliquots', 'Pretoria/Pretoria_RNA_Aliquots_ReportableRange.py', {}),
+    ]
+    print(f"{'run':<36} {'moves':>6} {'arc (mm)':>9}  {'set by':<40} {'saved at path heights':>22}")
+    suggestions = []
+    for label, path, params in runs:
+        try:
+            layout, commands = simulate(os.path.join(root, path), **params)
+        except Exception as error:
+            print(f'{label:<36} could not simulate: {error}')
+            continue
+        report = analyse(layout, commands)
+        print(f'{label:<36} {report.moves:6d} {report.deck_arc:9.1f}  {report.tallest.name:<40} '
+              f'{report.saved:8.0f} mm, {report.saved / Z_SPEED:4.0f} s')
+        if report.excess > 0:
+            suggestions.append(f'{label}: {report.tallest.name} ({report.tallest.height:.1f} mm) raises every move between '
+                               f'labware - {report.excess:.0f} mm of Z travel, about {report.excess / Z_SPEED:.0f} s per run')
+    if suggestions:
+        print('\nLayout suggestions (the arc follows the tallest item loaded; a lower alternative, or leaving it off the deck, lowers every move):')
+        for line in suggestions:
+            print(f'  {line}')
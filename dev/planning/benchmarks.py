@@ -0,0 +1,188 @@
+'''
+Protocol benchmarks
+
+An edit to a protocol that makes it use 20 more tips, or doubles its gantry travel, shows up
+nowhere until the robot is slower. This suite simulates every protocol in protocols/ under fixed
+parameter sets - its defaults, plus the larger runs in EXTRA_CASES - and records for each:
+
+* commands, tip pick-ups, aspirations and dispenses in the run log;
+* travel (mm of z and x/y movement) and predicted duration, from the timing model in run_time.py;
+* analysis time - the wait in the app after upload, measured in a fresh process as in
+  analysis_bench.py (default parameters only; parameter changes are analyzed about as fast).
+
+The results are kept in benchmarks.json next to this module, which is committed with the
+protocols. Running the suite compares a fresh run against it and flags every metric that went up
+by more than --threshold (5% by default; analysis time has its own, wider --time-threshold since
+it depends on the machine, and changes under half a second are ignored). A benchmark that does not
+simulate is a failure too, even when the baseline recorded the same error - otherwise a protocol
+that never runs is never measured - and --write will not record one. Improvements beyond the
+threshold are listed too, as a reminder to record the new baseline with --write.
+
+Usage (from the dev folder; requires the `opentrons` package):
+
+    python -m planning.benchmarks
+    python -m planning.benchmarks --write
+    python -m planning.benchmarks --threshold 0 "../protocols/Freetown/Assay Development/PrimerEval_PlatePrimers_Custom.py"
+'''
+
+import argparse
+import io
+import json
+import os
+import pathlib
+import sys
+
+from planning.analysis_bench import REPO_ROOT, _short_error, find_protocols, time_analysis
+from planning.run_time import estimate, steps, trace
+
+
+BASELINE = pathlib.Path(__file__).resolve().parent / 'benchmarks.json'
+METRICS = ['commands', 'tips', 'aspirations', 'dispenses', 'travel_mm', 'predicted_s', 'analysis_s']
+THRESHOLD = 0.05        # fraction a metric may rise before it is flagged
+TIME_THRESHOLD = 0.25   # the same for analysis time
+TIME_FLOOR = 0.5        # s - smaller changes in analysis time are noise
+REPEAT = 3              # fresh processes per analysis timing (median)
+
+# larger runs benchmarked on top of each protocol's defaults (paths relative to protocols/)
+EXTRA_CASES = [
+    ('Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py', {'num_plates': 4}),
+    ('Freetown/Performance Evaluations - 2024/Freetown_Mastermix_Plating_96well.py', {'number_of_plates': 9}),
+    ('Freetown/Assay Development/PrimerEval_PlatePrimers_Custom.py', {'num_primers': 4}),
+]
+
+
+def case_name(path, params: dict) -> str:
+    relative = pathlib.Path(path).resolve().relative_to(REPO_ROOT).as_posix()
+    return ' '.join([relative] + [f'{name}={value}' for name, value in params.items()])
+
+
+def cases(paths: list = None) -> list:
+    '''(path, params) of every benchmark: each protocol at its defaults, then EXTRA_CASES.'''
+    paths = [pathlib.Path(path).resolve() for path in paths] if paths else find_protocols()
+    extra = [(REPO_ROOT / 'protocols' / path, params) for path, params in EXTRA_CASES]
+    return [(path, {}) for path in paths] + [(path, params) for path, params in extra if path in paths]
+
+
+def measure(path, params: dict, repeat: int = REPEAT) -> dict:
+    '''The metrics of one benchmark, or {'status': 'error', 'error': ...}.'''
+    result = {'status': 'ok'}
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()  # protocols and the simulator print as they go
+    try:
+        layout, commands, issued = trace(str(path), **params)
+        run = estimate(layout, commands, issued, steps(str(path)))
+    except Exception as error:
+        return {'status': 'error', 'error': _short_error(error)}
+    finally:
+        sys.stdout = stdout
+    texts = [text.strip() for text in commands]
+    result['commands'] = len(texts)
+    result['tips'] = sum(text.startswith('Picking up tip') for text in texts)
+    result['aspirations'] = sum(text.startswith('Aspirating') for text in texts)
+    result['dispenses'] = sum(text.startswith('Dispensing') for text in texts)
+    result['travel_mm'] = round(run.travel)
+    result['predicted_s'] = round(run.seconds, 1)
+    if not params:
+        analysis = time_analysis(path, repeat)
+        result['analysis_s'] = round(analysis['seconds'], 2) if analysis['status'] == 'ok' else None
+    return result
+
+
+def run_suite(paths: list = None, repeat: int = REPEAT) -> dict:
+    results = {}
+    for path, params in cases(paths):
+        name = case_name(path, params)
+        print(f'  {name}', file=sys.stderr)
+        results[name] = measure(path, params, repeat)
+    return results
+
+
+def load_baseline(path=BASELINE) -> dict:
+    if not pathlib.Path(path).exists():
+        return {}
+    with open(path, encoding='utf-8') as baseline_file:
+        return json.load(baseline_file)['results']
+
+
+def write_baseline(results: dict, path=BASELINE):
+    from opentrons import __version__
+    with open(path, 'w', encoding='utf-8', newline='\n') as baseline_file:
+        json.dump({'opentrons': __version__, 'results': results}, baseline_file, indent=2, ensure_ascii=False)
+        baseline_file.write('\n')
+
+
+def compare(baseline: dict, results: dict, threshold: float = THRESHOLD, time_threshold: float = TIME_THRESHOLD) -> tuple:
+    '''([regressions], [improvements]) as (benchmark, message), for the benchmarks in results.'''
+    regressions, improvements = [], []
+    for name, new in results.items():
+        old = baseline.get(name)
+        if new['status'] != 'ok':
+            stopped = old is not None and old['status'] == 'ok'
+            regressions.append((name, f'{"no longer simulates" if stopped else "does not simulate"}: {new["error"]}'))
+            continue
+        if old is None:
+            continue
+        if old['status'] != 'ok':
+            improvements.append((name, 'simulates again'))
+            continue
+        for metric in METRICS:
+            before, after = old.get(metric), new.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            limit = time_threshold if metric == 'analysis_s' else threshold
+            if metric == 'analysis_s' and abs(after - before) < TIME_FLOOR:
+                continue
+            if change > limit:
+                regressions.append((name, f'{metric} {before} -> {after} (+{change:.0%})'))
+            elif change < -limit:
+                improvements.append((name, f'{metric} {before} -> {after} ({change:.0%})'))
+    return regressions, improvements
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the protocols and compare with the recorded baseline.')
+    parser.add_argument('protocols', nargs='*', help='protocol files (default: every protocol in protocols/)')
+    parser.add_argument('--write', action='store_true', help='record the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD * 100, help='percent a metric may rise (default 5)')
+    parser.add_argument('--time-threshold', type=float, default=TIME_THRESHOLD * 100,
+                        help='percent analysis time may rise (default 25)')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='fresh processes per analysis timing (median)')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.protocols, args.repeat)
+    baseline = load_baseline()
+    if args.write:
+        errors = [name for name, result in results.items() if result['status'] != 'ok']
+        if errors:
+            print('Not recorded - these benchmarks do not simulate:')
+            for name in errors:
+                print(f'  ! {name}: {results[name]["error"]}')
+            return 1
+        # benchmarks that weren't run keep their recorded results
+        write_baseline({**baseline, **results})
+        print(f'Recorded {len(results)} benchmarks in {os.path.relpath(BASELINE)}')
+        return 0
+
+    print(f"{'benchmark':<90} " + ' '.join(f'{metric:>11}' for metric in METRICS))
+    for name, result in results.items():
+        if result['status'] != 'ok':
+            print(f'{name[:90]:<90} error: {result["error"]}')
+            continue
+        print(f'{name[:90]:<90} ' + ' '.join(f'{"-" if result.get(metric) is None else result[metric]:>11}' for metric in METRICS))
+    regressions, improvements = compare(baseline, results, args.threshold / 100, args.time_threshold / 100)
+    missing = [name for name in results if name not in baseline]
+    if missing:
+        print(f'\nNot in the baseline (record with --write): {", ".join(missing)}')
+    if improvements:
+        print('\nImprovements (record with --write):')
+        for name, message in improvements:
+            print(f'  {name}: {message}')
+    print('\nRegressions: ' + ('none' if not regressions else str(len(regressions))))
+    for name, message in regressions:
+        print(f'  ! {name}: {message}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
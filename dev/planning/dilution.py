@@ -0,0 +1,245 @@
+'''
+Vectorized dilution planning
+
+Computes RNA and diluent volumes for serial dilution series - the same table that
+`get_volumes` builds in StdCurve_Dil_Plate.py - but for many series at once, and with
+exact rational arithmetic, so that non-integer dilution steps (for example 1:2.5)
+are planned correctly instead of being floored to whole-number factors.
+
+Every volume is stored as an integer numerator array over a per-series denominator.
+All arithmetic is done on whole arrays (one row per series); the only Python loop is
+the backward pass over dilution steps, which is sequential by nature
+(each step's volume depends on how much the next step draws from it).
+
+Usage (from the dev folder):
+
+    python -m planning.dilution
+'''
+
+from dataclasses import dataclass, field
+from fractions import Fraction
+import itertools
+
+import numpy as np
+
+
+OVERAGE = 20    # µL left in each tube after all transfers out of it
+ROUND_TO = 10   # µL - prepared volumes are rounded up to a multiple of this
+
+# int64 is used whenever intermediate products stay well below this bound;
+# otherwise arrays fall back to Python integers (dtype=object), which are still exact
+_INT64_SAFE = 2**62
+
+
+def _to_fraction(value) -> Fraction:
+    '''Convert a number to a Fraction, reading floats by their decimal representation
+    (so 2.5 -> 5/2 and 0.1 -> 1/10, rather than the nearest binary fraction).'''
+    if isinstance(value, Fraction):
+        return value
+    if isinstance(value, (float, np.floating)):
+        return Fraction(repr(float(value)))
+    return Fraction(int(value)) if isinstance(value, (np.integer,)) else Fraction(value)
+
+
+def _fraction_array(values, shape) -> np.ndarray:
+    '''Broadcast values to shape, as an object array of Fractions.'''
+    arr = np.asarray(values, dtype=object)
+    arr = np.broadcast_to(arr, shape)
+    return np.frompyfunc(_to_fraction, 1, 1)(arr).astype(object)
+
+
+def _num_den(fractions: np.ndarray):
+    '''Split an object array of Fractions into numerator and denominator arrays (Python ints).'''
+    num = np.frompyfunc(lambda f: f.numerator, 1, 1)(fractions).astype(object)
+    den = np.frompyfunc(lambda f: f.denominator, 1, 1)(fractions).astype(object)
+    return num, den
+
+
+def _int_dtype(*bounds) -> type:
+    '''Use int64 if every bound (maximum absolute value of an intermediate product) fits.'''
+    return np.int64 if all(int(b) < _INT64_SAFE for b in bounds) else object
+
+
+def _ceil_div(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    '''Exact ceiling division for integer arrays (numerator and denominator > 0).'''
+    return -((-num) // den)
+
+
+def _reduce(num: np.ndarray, den: np.ndarray):
+    '''Reduce numerator/denominator arrays to lowest terms.'''
+    g = np.gcd(num, den)
+    g = np.where(g == 0, 1, g)
+    return num // g, den // g
+
+
+@dataclass
+class DilutionPlan:
+    '''Volumes for S dilution series of N steps each (arrays of shape [S, N]).
+
+    Each quantity is stored as exact numerator/denominator integer arrays;
+    use the float properties for quick inspection and `series()` for a single series
+    in the same dictionary format returned by `get_volumes`.
+    '''
+    dil_factor_num: np.ndarray
+    dil_factor_den: np.ndarray
+    adj_vol_num: np.ndarray
+    adj_vol_den: np.ndarray
+    rna_vol_num: np.ndarray
+    rna_vol_den: np.ndarray
+    dil_vol_num: np.ndarray
+    dil_vol_den: np.ndarray
+    params: dict = field(default_factory=dict)
+
+    @property
+    def shape(self) -> tuple:
+        return self.adj_vol_num.shape
+
+    @property
+    def dil_factor(self) -> np.ndarray:
+        return (self.dil_factor_num / self.dil_factor_den).astype(float)
+
+    @property
+    def adj_vol(self) -> np.ndarray:
+        return (self.adj_vol_num / self.adj_vol_den).astype(float)
+
+    @property
+    def rna_vol(self) -> np.ndarray:
+        return (self.rna_vol_num / self.rna_vol_den).astype(float)
+
+    @property
+    def dil_vol(self) -> np.ndarray:
+        return (self.dil_vol_num / self.dil_vol_den).astype(float)
+
+    @property
+    def stock_vol(self) -> np.ndarray:
+        '''Volume of undiluted stock used by each series (µL).'''
+        return self.rna_vol[:, 0]
+
+    @property
+    def total_diluent(self) -> np.ndarray:
+        '''Total diluent transferred by each series (µL).'''
+        return self.dil_vol.sum(axis=1)
+
+    def fractions(self, name: str) -> np.ndarray:
+        '''Exact values for one quantity ("dil_factor", "adj_vol", "rna_vol" or "dil_vol"),
+        as an object array of Fractions.'''
+        num = getattr(self, name + '_num')
+        den = getattr(self, name + '_den')
+        return np.frompyfunc(lambda n, d: Fraction(int(n), int(d)), 2, 1)(num, den)
+
+    def series(self, index: int = 0) -> dict:
+        '''Volumes for a single series, as {'rna': [...], 'dil': [...]} (same format as `get_volumes`).
+        Whole-number volumes are returned as ints, anything else as floats.'''
+        def simplify(f: Fraction):
+            return int(f) if f.denominator == 1 else float(f)
+        return {'rna': [simplify(f) for f in self.fractions('rna_vol')[index]],
+                'dil': [simplify(f) for f in self.fractions('dil_vol')[index]]}
+
+
+def plan_dilutions(vol_per_well, copies_per_well, wells_per_dilution, num_plates=1, excess_vol=10.0,
+                   overage=OVERAGE, round_to=ROUND_TO) -> DilutionPlan:
+    '''Plan RNA and diluent volumes for one or more serial dilution series in a single call.
+
+    copies_per_well and wells_per_dilution have shape [N] (one series) or [S, N] (S series);
+    vol_per_well, num_plates and excess_vol are scalars or arrays of shape [S].
+    Dilution factors are exact ratios of consecutive copies-per-well values.
+
+    For integer dilution factors, the result matches `get_volumes` in StdCurve_Dil_Plate.py.
+    '''
+    copies = np.asarray(copies_per_well, dtype=object)
+    if copies.ndim == 1:
+        copies = copies[np.newaxis, :]
+    num_series = max(copies.shape[0], np.size(vol_per_well), np.size(num_plates), np.size(excess_vol),
+                     np.asarray(wells_per_dilution).shape[0] if np.ndim(wells_per_dilution) == 2 else 1)
+    shape = (num_series, copies.shape[1])
+
+    # copies per well: scale each series to integers - dilution factors only depend on ratios
+    cp_num, cp_den = _num_den(_fraction_array(copies, shape))
+    cp = cp_num * (np.lcm.reduce(cp_den, axis=1)[:, np.newaxis] // cp_den)
+    if np.any(cp <= 0):
+        raise ValueError('copies per well must be positive')
+
+    # per-well volume (including excess) and overage, over a shared per-series denominator
+    per_well = _fraction_array(vol_per_well, (num_series,)) + _fraction_array(excess_vol, (num_series,))
+    pw_num, pw_den = _num_den(per_well)
+    ov_num, ov_den = _num_den(_fraction_array(overage, (num_series,)))
+    den = np.lcm(pw_den, ov_den)
+    wells = np.broadcast_to(np.asarray(wells_per_dilution, dtype=object), shape)
+    plates = np.broadcast_to(np.asarray(num_plates, dtype=object), (num_series,))
+
+    # exact volume needed for plating at each step, times den
+    exact = wells * (pw_num * (den // pw_den) * plates)[:, np.newaxis] + (ov_num * (den // ov_den))[:, np.newaxis]
+
+    dtype = _int_dtype(np.max(np.abs(exact)) * np.max(cp) * 4 * (round_to + 1), np.max(den) * np.max(cp) * round_to)
+    cp = cp.astype(dtype)
+    exact = exact.astype(dtype)
+    den = den.astype(dtype)
+
+    # backward pass: adjusted volume = plating volume + volume drawn by the next step, rounded up
+    # (stored as adj * den so that the last, unrounded step stays exact)
+    adj = np.empty(shape, dtype=dtype)
+    adj[:, -1] = exact[:, -1]
+    for i in range(shape[1] - 2, -1, -1):
+        drawn = exact[:, i] * cp[:, i] + adj[:, i + 1] * cp[:, i + 1]
+        adj[:, i] = _ceil_div(drawn, den * cp[:, i] * round_to) * round_to * den
+
+    # dilution factor of each step relative to the previous one (first step is undiluted stock)
+    cp_prev = np.concatenate([cp[:, :1], cp[:, :-1]], axis=1)
+    dens = np.broadcast_to(den[:, np.newaxis], shape)
+
+    factor = _reduce(cp_prev.copy(), cp.copy())
+    adj_vol = _reduce(adj.copy(), dens.copy())
+    rna_vol = _reduce(adj * cp, dens * cp_prev)
+    dil_vol = _reduce(adj * (cp_prev - cp), dens * cp_prev)
+
+    return DilutionPlan(*factor, *adj_vol, *rna_vol, *dil_vol)
+
+
+def sweep(copies_per_well, wells_per_dilution, overage=OVERAGE, round_to=ROUND_TO, **grid) -> DilutionPlan:
+    '''Plan every combination of a parameter grid in a single vectorized call.
+
+    copies_per_well may be a single series [N] or several alternative series [K, N].
+    grid holds lists of values for vol_per_well, num_plates and/or excess_vol, e.g.:
+
+        sweep(copies, wells, vol_per_well=[10], num_plates=[1, 2, 3, 4], excess_vol=[0, 5])
+
+    The returned plan has one row per combination; `plan.params` maps each parameter
+    (plus "series", the index into copies_per_well) to its value in each row.
+    '''
+    copies = np.asarray(copies_per_well, dtype=object)
+    if copies.ndim == 1:
+        copies = copies[np.newaxis, :]
+    unknown = set(grid) - {'vol_per_well', 'num_plates', 'excess_vol'}
+    if unknown:
+        raise TypeError(f'cannot sweep over {sorted(unknown)}')
+
+    grid.setdefault('vol_per_well', [10.0])
+    grid.setdefault('num_plates', [1])
+    grid.setdefault('excess_vol', [10.0])
+    names = ['series'] + list(grid)
+    combos = list(itertools.product(range(copies.shape[0]), *grid.values()))
+    params = {name: np.array([combo[i] for combo in combos], dtype=object) for i, name in enumerate(names)}
+
+    wells = np.asarray(wells_per_dilution, dtype=object)
+    if wells.ndim == 2:
+        wells = wells[params['series'].astype(int)]
+
+    plan = plan_dilutions(params['vol_per_well'], copies[params['series'].astype(int)], wells,
+                          num_plates=params['num_plates'], excess_vol=params['excess_vol'],
+                          overage=overage, round_to=round_to)
+    plan.params = params
+    return plan
+
+
+if __name__ == '__main__':
+    # standard curve from StdCurve_Dil_Plate.py, for 1-4 plates
+    copies_per_well =    [1*10**7, 1*10**6, 1*10**5, 1*10**4, 1000, 200, 100, 20, 10, 5]
+    wells_per_dilution = [      3,       3,       3,       3,    6,   6,   8,  8,  8, 8]
+
+    plan = sweep(copies_per_well, wells_per_dilution, vol_per_well=[10], num_plates=[1, 2, 3, 4], excess_vol=[0, 5])
+    for row in range(plan.shape[0]):
+        vols = plan.series(row)
+        print(f"plates={plan.params['num_plates'][row]} excess={plan.params['excess_vol'][row]}: "
+              f"stock {plan.stock_vol[row]:g} µL, diluent {plan.total_diluent[row]:g} µL")
+        print(f"  rna: {vols['rna']}")
+        print(f"  dil: {vols['dil']}")
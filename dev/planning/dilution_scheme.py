@@ -0,0 +1,293 @@
+'''
+Reagent-minimizing dilution scheme optimizer
+
+Given the stock concentration, the target concentrations to be plated (with replicate counts)
+and the pipettes installed on the robot (the same range dictionaries used by `choose_pipette`),
+builds a serial dilution scheme that uses the least RNA stock - and, for equal stock, the least
+diluent - while keeping every transfer at or above the smallest accurate pipetting volume.
+
+Each tube in the scheme is diluted from the tube before it, so the result can be pasted
+straight into the "csv_raw" table of Freetown_RNA_Dil_ReportableRange_v2.py or
+Freetown_Custom_Dilution_Series.py (see `DilutionScheme.to_csv`).
+
+Where a dilution factor would call for a transfer below the pipette minimum, the optimizer
+compares two fixes and keeps whichever draws less from the tube above:
+ - making more of the lower tube, so the transfer becomes large enough, or
+ - inserting intermediate dilution steps (geometrically spaced, rounded to 3 significant figures).
+Targets given with 0 replicates are treated as optional intermediate steps: they are kept
+only if they reduce reagent use, and merged away otherwise.
+
+Usage (from the dev folder):
+
+    python -m planning.dilution_scheme
+'''
+
+from dataclasses import dataclass, field
+from fractions import Fraction
+import itertools
+import math
+
+
+OVERAGE = 20            # µL left in each tube after all transfers out of it
+ROUND_TO = 10           # µL - prepared tube volumes are rounded up to a multiple of this
+MIN_TRANSFER = 1.0      # µL - smallest volume pipetted accurately, even if a pipette range allows less
+TUBE_CAPACITY = 1500    # µL - 1.5 mL tubes
+MAX_INSERTED = 4        # most intermediate steps inserted between two tubes
+MAX_OPTIONAL = 8        # optional steps per segment considered exhaustively (all subsets)
+
+
+def _fraction(value) -> Fraction:
+    '''Exact Fraction from a number, reading floats by their decimal representation.'''
+    return Fraction(repr(value)) if isinstance(value, float) else Fraction(value)
+
+
+def _round_up(vol: Fraction, step) -> Fraction:
+    '''Round a volume up to a multiple of step.'''
+    step = _fraction(step)
+    return math.ceil(vol / step) * step
+
+
+def _nice(conc: Fraction) -> Fraction:
+    '''Round an intermediate concentration to 3 significant figures.'''
+    return Fraction(f'{float(conc):.3g}')
+
+
+@dataclass
+class Step:
+    '''One tube of the scheme. Tube 0 is the stock; tube n is diluted from tube n-1.'''
+    tube: int
+    conc: Fraction
+    rna_vol: Fraction
+    dil_vol: Fraction
+    replicates: int = 0
+    intermediate: bool = False
+
+    @property
+    def total_vol(self) -> Fraction:
+        return self.rna_vol + self.dil_vol
+
+    @property
+    def dil_factor(self) -> Fraction:
+        return self.total_vol / self.rna_vol
+
+
+@dataclass
+class DilutionScheme:
+    '''Result of `optimize_scheme`: tubes in dilution order plus reagent totals (µL).'''
+    stock_conc: Fraction
+    steps: list
+    stock_vol: Fraction                             # stock drawn for dilutions + stock plating + dead volume
+    merged: list = field(default_factory=list)      # optional steps that were left out
+
+    @property
+    def stock_drawn(self) -> Fraction:
+        '''Stock transferred into the first dilution.'''
+        return self.steps[0].rna_vol
+
+    @property
+    def total_diluent(self) -> Fraction:
+        return sum((step.dil_vol for step in self.steps), Fraction(0))
+
+    @property
+    def inserted(self) -> list:
+        return [step for step in self.steps if step.intermediate]
+
+    def to_csv(self) -> str:
+        '''Rows "dilution number, RNA volume, diluent volume" in the csv_raw format used by the dilution protocols.'''
+        def fmt(vol):
+            return f'{float(vol):g}'
+        return ''.join(f'{step.tube},{fmt(step.rna_vol)},{fmt(step.dil_vol)}\n' for step in self.steps)
+
+    def table(self) -> str:
+        '''Printable summary of the scheme.'''
+        lines = [f"{'tube':>4} {'conc':>10} {'factor':>8} {'rna':>8} {'diluent':>8} {'reps':>5}"]
+        lines.append(f"{0:>4} {float(self.stock_conc):>10.3g} {'stock':>8} {float(self.stock_vol):>8.4g}")
+        for step in self.steps:
+            note = '  (intermediate)' if step.intermediate else ''
+            lines.append(f'{step.tube:>4} {float(step.conc):>10.3g} {float(step.dil_factor):>8.4g} '
+                         f'{float(step.rna_vol):>8.4g} {float(step.dil_vol):>8.4g} {step.replicates:>5}{note}')
+        lines.append(f'stock {float(self.stock_vol):g} µL, diluent {float(self.total_diluent):g} µL')
+        return '\n'.join(lines)
+
+
+class _Planner:
+    '''Volume rules shared by every candidate scheme.'''
+
+    def __init__(self, min_transfer, tube_capacity, overage, round_to, max_inserted):
+        self.min_transfer = min_transfer
+        self.tube_capacity = tube_capacity
+        self.overage = overage
+        self.round_to = round_to
+        self.max_inserted = max_inserted
+
+    def fill(self, conc: Fraction, total: Fraction, parent_conc: Fraction):
+        '''Smallest tube volume >= total whose RNA and diluent transfers from parent_conc
+        are both pipettable; None if the tube would overflow.'''
+        total = _round_up(total, self.round_to)
+        ratio = conc / parent_conc
+        if total * ratio < self.min_transfer:
+            total = _round_up(self.min_transfer / ratio, self.round_to)
+        if ratio < 1 and 0 < total * (1 - ratio) < self.min_transfer:
+            total = _round_up(self.min_transfer / (1 - ratio), self.round_to)
+        return total if total <= self.tube_capacity else None
+
+    def link(self, conc: Fraction, total: Fraction, parent_conc: Fraction):
+        '''Best way to make a tube (conc, at least total µL) from a tube at parent_conc:
+        either directly, or through 1..max_inserted intermediate tubes.
+
+        Returns (volume drawn from parent, tubes bottom-up as (conc, total, intermediate)), or None.
+        '''
+        best = None
+        for inserted in range(self.max_inserted + 1):
+            ratio = (parent_conc / conc) ** (1 / (inserted + 1))
+            concs = [conc] + [_nice(conc * Fraction(ratio ** i)) for i in range(1, inserted + 1)]
+            if any(not (lo < hi) for lo, hi in zip(concs, concs[1:] + [parent_conc])):
+                continue
+
+            tubes = []
+            need = total
+            for lo, hi in zip(concs, concs[1:] + [parent_conc]):
+                filled = self.fill(lo, need, hi)
+                if filled is None:
+                    break
+                tubes.append((lo, filled, len(tubes) > 0))
+                need = self.overage + filled * lo / hi
+            else:
+                drawn = tubes[-1][1] * tubes[-1][0] / parent_conc
+                diluent = sum(t * (1 - c / p) for (c, t, _), p in zip(tubes, concs[1:] + [parent_conc]))
+                key = (drawn, diluent, len(tubes))
+                if best is None or key < best[0]:
+                    best = (key, tubes)
+        return None if best is None else (best[0][0], best[1])
+
+
+def optimize_scheme(stock_conc, targets, pipettes, vol_per_well=10, num_plates=1, excess_vol=0,
+                    stock_replicates=0, min_transfer=MIN_TRANSFER, tube_capacity=TUBE_CAPACITY,
+                    overage=OVERAGE, round_to=ROUND_TO, max_inserted=MAX_INSERTED) -> DilutionScheme:
+    '''Build the serial dilution scheme that uses the least stock (then the least diluent).
+
+    targets: list of (concentration, replicates) in any order; replicates = 0 marks an optional
+    intermediate step. Concentrations are in the same units as stock_conc.
+    pipettes: list of pipette range dicts as used by `choose_pipette`, e.g.
+    [{'pipette': p300, 'min': 20.0, 'max': 200.0}, {'pipette': p20, 'min': 0.0, 'max': 20.0}].
+    The smallest transfer allowed is the larger of min_transfer and the smallest pipette minimum.
+    '''
+    stock_conc = _fraction(stock_conc)
+    levels = sorted(((_fraction(conc), int(reps)) for conc, reps in targets), reverse=True)
+    concs = [conc for conc, _ in levels]
+    if len(set(concs)) != len(concs):
+        raise ValueError('target concentrations must be distinct')
+    if not concs or concs[0] >= stock_conc or concs[-1] <= 0:
+        raise ValueError('target concentrations must be positive and below the stock concentration')
+    if not pipettes:
+        raise ValueError('at least one pipette range is required')
+
+    smallest = max(_fraction(min_transfer), min(_fraction(p['min']) for p in pipettes))
+    planner = _Planner(smallest, _fraction(tube_capacity), _fraction(overage), _fraction(round_to), max_inserted)
+    per_well = (_fraction(vol_per_well) + _fraction(excess_vol)) * num_plates
+
+    # optional steps below the last plated concentration are never needed
+    required = [i for i, (_, reps) in enumerate(levels) if reps > 0]
+    if not required:
+        raise ValueError('at least one target needs replicates > 0')
+    merged = [conc for conc, _ in levels[required[-1] + 1:]]
+
+    # work upwards from the most dilute plated tube; each segment ends at the next plated tube (or the stock)
+    chain = []  # (conc, total, replicates, intermediate), bottom-up
+    lower = required[-1]
+    total = levels[lower][1] * per_well + planner.overage
+    bounds = list(reversed(required[:-1])) + [None]
+    for upper in bounds:
+        upper_conc = stock_conc if upper is None else levels[upper][0]
+        optional = levels[(upper + 1 if upper is not None else 0):lower]
+
+        best = None
+        if len(optional) <= MAX_OPTIONAL:
+            subsets = itertools.chain.from_iterable(itertools.combinations(optional, n) for n in range(len(optional) + 1))
+        else:
+            subsets = [(), tuple(optional)]
+        for subset in subsets:
+            result = _plan_segment(planner, levels[lower], total, list(reversed(subset)), upper_conc)
+            if result is not None and (best is None or result[0] < best[0]):
+                best = result + (subset,)
+        if best is None:
+            raise ValueError(f'no feasible scheme between {float(upper_conc):g} and {float(levels[lower][0]):g} '
+                             f'(tube capacity {float(tube_capacity):g} µL)')
+
+        (drawn, _, _), tubes, subset = best
+        chain.extend(tubes)
+        merged.extend(conc for conc, _ in optional if (conc, 0) not in subset)
+        if upper is not None:
+            total = levels[upper][1] * per_well + planner.overage + drawn
+        lower = upper
+
+    stock_vol = drawn + stock_replicates * per_well + planner.overage
+
+    steps = []
+    parents = [tube[0] for tube in reversed(chain)]
+    for n, ((conc, tube_total, reps, intermediate), parent) in enumerate(zip(reversed(chain), [stock_conc] + parents), start=1):
+        rna = tube_total * conc / parent
+        steps.append(Step(n, conc, rna, tube_total - rna, reps, intermediate))
+    kept = {step.conc for step in steps}
+    return DilutionScheme(stock_conc, steps, stock_vol, sorted((c for c in merged if c not in kept), reverse=True))
+
+
+def _plan_segment(planner: _Planner, lower, lower_total, kept, upper_conc):
+    '''Tubes from the plated tube `lower` up to (not including) the tube at upper_conc,
+    keeping the optional steps in `kept` (bottom-up). Returns ((drawn, diluent, tubes), tubes) or None.'''
+    conc, reps = lower
+    chain = []
+    need = lower_total
+    members = [(conc, reps)] + list(kept)
+    for (member_conc, member_reps), parent_conc in zip(members, [c for c, _ in kept] + [upper_conc]):
+        result = planner.link(member_conc, need, parent_conc)
+        if result is None:
+            return None
+        drawn, tubes = result
+        for tube_conc, tube_total, intermediate in tubes:
+            chain.append((tube_conc, tube_total, 0 if intermediate else member_reps, intermediate or member_reps == 0))
+        need = planner.overage + drawn
+
+    parents = [tube[0] for tube in chain[1:]] + [upper_conc]
+    diluent = sum(tube_total * (1 - tube_conc / parent) for (tube_conc, tube_total, _, _), parent in zip(chain, parents))
+    return (drawn, diluent, len(chain)), chain
+
+
+def concentrations_from_csv(csv_raw: str, stock_conc) -> list:
+    '''Concentration of each tube in an existing csv_raw table ("dilution number, RNA volume, diluent volume").'''
+    concs = []
+    conc = _fraction(stock_conc)
+    for line in csv_raw.strip().splitlines():
+        _, rna, dil = (_fraction(float(value)) for value in line.split(','))
+        conc = conc * rna / (rna + dil)
+        concs.append(conc)
+    return concs
+
+
+if __name__ == '__main__':
+    # Freetown reportable range (Freetown_RNA_Dil_ReportableRange_v2.py): 2.5E+6 cp/µL stock, 10 µL per well, 3 plates
+    csv_raw = '''1,50,200
+2,50,200
+3,50,200
+4,50,200
+5,50,200
+6,50,200
+7,105,420
+8,375,375
+9,375,375
+10,375,375
+11,375,375
+12,375,375
+13,375,375
+'''
+    replicates = [4, 4, 4, 4, 4, 4, 4, 4, 8, 8, 12, 12, 12]
+    concs = concentrations_from_csv(csv_raw, 2.5e6)
+    rows = [[float(v) for v in line.split(',')] for line in csv_raw.strip().splitlines()]
+    print(f'current table: stock into dilution 1 {rows[0][1]:g} µL, diluent {sum(row[2] for row in rows):g} µL')
+
+    for label, pipettes in (('p300 + p1000', [{'min': 20.0, 'max': 200.0}, {'min': 200.0, 'max': 1000.0}]),
+                            ('p20 + p300', [{'min': 0.0, 'max': 20.0}, {'min': 20.0, 'max': 200.0}])):
+        scheme = optimize_scheme(2.5e6, list(zip(concs, replicates)), pipettes, vol_per_well=10, num_plates=3,
+                                 stock_replicates=4)
+        print(f'\noptimized ({label}): stock into dilution 1 {float(scheme.stock_drawn):g} µL')
+        print(scheme.table())
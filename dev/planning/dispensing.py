@@ -0,0 +1,147 @@
+'''
+Multi-dispense packing
+
+`InstrumentContext.distribute` (the legacy transfer engine) fills the tip with as many dispenses
+as fit after the disposal volume, blows the disposal volume out over the trash after every
+aspiration, and goes back to the source for the next one. Over a long run of small dispenses
+(e.g. 1.5 µL primers into a 384-well plate) the disposal volume is thrown away once per trip,
+and every trip takes a detour to the trash.
+
+`plan_dispenses` treats disposal and conditioning volume as a budget instead:
+
+* the disposal volume is aspirated once, stays in the tip for the whole run and is blown out
+  at the end - it is there to keep the last dispense of each trip as accurate as the others,
+  and that job does not use it up;
+* an optional conditioning volume is aspirated with each trip and dispensed straight back
+  into the source, so the first dispense of a trip sees the same plunger backlash as the rest;
+* each aspiration is packed with dispenses up to the tip's working capacity, in the order the
+  destinations are given (see `routing.py` for ordering them).
+
+The plating protocols carry a compact copy (`plan_dispenses` and `multi_dispense`, kept in
+multi_dispense.py), which issues the exact aspirate/dispense/blowout sequence planned here.
+
+Usage (from the dev folder):
+
+    python -m planning.dispensing
+'''
+
+from dataclasses import dataclass, field
+
+from planning.routing import distance, distribute_travel, path_length, trash_point
+
+
+@dataclass
+class Trip:
+    '''One aspiration and the dispenses it covers.'''
+    aspirate: float                 # µL drawn from the source
+    dispenses: list                 # indices into the destination list
+    conditioning: float = 0.0       # µL dispensed back into the source before the first destination
+
+
+@dataclass
+class DispensePlan:
+    trips: list = field(default_factory=list)
+    disposal_volume: float = 0.0    # µL blown out at the end (once per plan)
+
+    @property
+    def aspirated(self) -> float:
+        '''Total volume drawn from the source, including what goes back or to waste.'''
+        return sum(trip.aspirate for trip in self.trips)
+
+    def waste(self, blowouts: int = 1) -> float:
+        return self.disposal_volume * blowouts
+
+
+def plan_dispenses(volumes: list, capacity: float, disposal_volume: float,
+                   conditioning_volume: float = 0.0) -> DispensePlan:
+    '''Pack dispenses (µL per destination, in order) into as few aspirations as possible.'''
+    room = capacity - disposal_volume - conditioning_volume
+    if any(vol > room + 1e-9 for vol in volumes):
+        raise ValueError(f'a {max(volumes)} µL dispense does not fit in {capacity} µL '
+                         f'with {disposal_volume} µL disposal and {conditioning_volume} µL conditioning volume')
+    groups = [[]]
+    filled = 0.0
+    for i, vol in enumerate(volumes):
+        if filled + vol > room + 1e-9:
+            groups.append([])
+            filled = 0.0
+        groups[-1].append(i)
+        filled += vol
+    trips = []
+    for n, group in enumerate(groups):
+        aspirate = sum(volumes[i] for i in group) + conditioning_volume + (disposal_volume if n == 0 else 0.0)
+        trips.append(Trip(aspirate, group, conditioning_volume))
+    return DispensePlan(trips, disposal_volume)
+
+
+def legacy_plan(volumes: list, capacity: float, disposal_volume: float) -> DispensePlan:
+    '''What `distribute` does: the same packing, but a fresh disposal volume with every aspiration
+    (blown out over the trash after each trip).'''
+    plan = plan_dispenses(volumes, capacity, disposal_volume)
+    for trip in plan.trips:
+        trip.aspirate = sum(volumes[i] for i in trip.dispenses) + disposal_volume
+    return plan
+
+
+def engine_travel(source: tuple, points: list, plan: DispensePlan, trash: tuple = None) -> float:
+    '''Gantry travel (mm) of a packed plan: every trip returns to the source, one blowout over the trash at the end.'''
+    trash = trash or trash_point()
+    total = 0.0
+    for trip in plan.trips:
+        total += path_length([source] + [points[i] for i in trip.dispenses] + [source])
+    return total - distance(points[plan.trips[-1].dispenses[-1]], source) + distance(points[plan.trips[-1].dispenses[-1]], trash)
+
+
+def compare(label: str, source: tuple, points: list, volume: float, capacity: float, disposal_volume: float,
+            conditioning_volume: float = 0.0):
+    volumes = [volume] * len(points)
+    old = legacy_plan(volumes, capacity, disposal_volume)
+    new = plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume)
+    old_travel = distribute_travel(source, points, len(old.trips[0].dispenses))
+    new_travel = engine_travel(source, points, new)
+    return (label, len(old.trips), len(new.trips), old.waste(len(old.trips)), new.waste(),
+            old_travel, new_travel)
+
+
+if __name__ == '__main__':
+    from planning.pipettes import PIPETTES
+    from planning.routing import GANTRY_SPEED, PlacedLabware
+
+    plate384 = 'appliedbiosystemsmicroamp_384_wellplate_40ul'
+    tube_rack = 'opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap'
+    p20, p300 = PIPETTES['p20_single_gen2'], PIPETTES['p300_single_gen2']
+    plate = PlacedLabware(plate384, 2)
+
+    rows = []
+    # PrimerEval_PlatePrimers_Custom.py, 8 primers: 1.5 µL, p20, disposal = pipette minimum
+    primers = PlacedLabware(tube_rack, 5)
+    num_primers = 8
+    for i in range(num_primers):
+        wells = list(range(i, num_primers*48, 16)) + list(range(num_primers + i, num_primers*49, 16))
+        rows.append(compare(f'PrimerEval forward {i + 1}', primers.point(i), [plate.point(w) for w in wells],
+                            1.5, p20['max'], p20['min']))
+    for i in range(num_primers):
+        wells = (list(range(i*48, i*48 + 2*num_primers)) + list(range(i*48 + 16, i*48 + 2*num_primers + 16))
+                 + list(range(i*48 + 32, i*48 + 2*num_primers + 32)))
+        rows.append(compare(f'PrimerEval reverse {i + 1}', primers.point(i + 8), [plate.point(w) for w in wells],
+                            1.5, p20['max'], p20['min']))
+
+    # LSP_Pools_12replicates.py: 10 µL, p300 with 200 µL tips, 10 µL disposal
+    rack = PlacedLabware(tube_rack, 4)
+    tube_number = 0
+    for section_rows in range(3):
+        for section_columns in range(2):
+            tube_number += 1
+            wells = [section_rows*5 + section_columns*192 + col*16 + row for col in range(12) for row in range(5)]
+            rows.append(compare(f'LSP master mix {tube_number}', rack.point(f'A{tube_number}'),
+                                [plate.point(w) for w in wells], 10, p300['max'], 10))
+
+    print(f"{'step':<22} {'trips':>9} {'disposal waste (µL)':>20} {'travel (mm)':>16}")
+    for label, old_trips, new_trips, old_waste, new_waste, old_travel, new_travel in rows:
+        print(f'{label:<22} {old_trips:>4} -> {new_trips:<2} {old_waste:>9.1f} -> {new_waste:<6.1f} '
+              f'{old_travel:>7.0f} -> {new_travel:<7.0f}')
+    for name in ('PrimerEval', 'LSP'):
+        selected = [row for row in rows if row[0].startswith(name)]
+        waste = sum(row[3] - row[4] for row in selected)
+        travel = sum(row[5] - row[6] for row in selected)
+        print(f'{name}: saves {waste:.1f} µL of reagent and {travel:.0f} mm of travel (about {travel / GANTRY_SPEED:.0f} s)')
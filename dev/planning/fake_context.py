@@ -0,0 +1,499 @@
+'''
+Fake protocol context
+
+Every check that goes through the Opentrons simulator pays for the protocol engine: a second or
+more per run, which rules out trying thousands of parameter combinations or volume tables.
+`FakeContext` is a small in-process stand-in for the parts of the Python API the protocols here
+use - `load_labware`, `load_instrument`, labware `wells()`/`rows()`/`columns()`/names, well
+`top()`/`bottom()`, `define_liquid`/`load_liquid`, `params`, and the pipette's `pick_up_tip`,
+`aspirate`, `dispense`, `blow_out`, `touch_tip`, `mix`, `transfer` and `distribute` - that runs a
+protocol's `run()` directly and records each command as one row of a compact log
+(op, mount, slot, well, volume; `log()` gives it as a NumPy structured array).
+
+It checks what a fuzzer should catch: running out of tips, aspirating without a tip or more
+than the tip holds, dispensing more than is in the tip, parameter values outside their choices or
+range, and `define_liquid` below API 2.14. `transfer` and `distribute` follow the legacy planning
+rules closely enough for the counts of tips, aspirations and dispenses to match the simulator for
+the protocols here (the module's check compares them) - touch tip and air gap are logged but not
+planned further, and options the fake doesn't know are accepted and ignored.
+
+Usage (from the dev folder; requires the `opentrons` package to load the protocols, which import
+`protocol_api` for their type hints):
+
+    python -m planning.fake_context
+    python -m planning.fake_context "../protocols/Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py"
+
+From Python:
+
+    module = load_protocol(path)
+    context = run_protocol(module, {'num_plates': 4})
+    context.counts()['pick_up_tip'], context.log()
+'''
+
+from collections import namedtuple
+from functools import lru_cache
+import math
+import sys
+
+import numpy as np
+
+from planning.labware import load_definition
+from planning.pipettes import PIPETTES
+from planning.routing import slot_origin
+from planning.simulation_sweep import _load as load_protocol
+
+
+OPS = ('pick_up_tip', 'drop_tip', 'aspirate', 'dispense', 'blow_out', 'touch_tip', 'air_gap', 'mix',
+       'delay', 'pause', 'comment', 'home')
+OP = {name: code for code, name in enumerate(OPS)}
+MOUNTS = {None: 0, 'left': 1, 'right': 2}
+LOG_DTYPE = np.dtype([('op', 'u1'), ('mount', 'u1'), ('slot', 'u1'), ('well', 'i2'), ('volume', 'f4')])
+TRASH_SLOT = 12
+
+Point = namedtuple('Point', 'x y z')
+_slot_origin = lru_cache(maxsize=None)(slot_origin)
+
+
+@lru_cache(maxsize=None)
+def _layout(load_name: str) -> tuple:
+    '''(well names in wells() order, rows as lists of names, {name: well info}) of a labware definition.'''
+    definition = load_definition(load_name.lower())    # load names are case-insensitive in the API
+    order = [name for column in definition['ordering'] for name in column]
+    letters = sorted({name[0] for name in order})
+    rows = [[name for name in order if name[0] == letter] for letter in letters]
+    return order, rows, definition['wells']
+
+
+def _point(well, reference: str, z: float) -> Point:
+    info = _layout(well.parent.load_name)[2][well.well_name]
+    x, y = _slot_origin(well.parent.slot)
+    height = {'bottom': 0.0, 'center': info['depth'] / 2, 'top': info['depth']}[reference]
+    return Point(x + info['x'], y + info['y'], info['z'] + height + z)
+
+
+class Location:
+    '''A point relative to a well (well.top(), well.bottom()).'''
+
+    __slots__ = ('well', 'reference', 'z')
+
+    def __init__(self, well, reference: str, z: float):
+        self.well, self.reference, self.z = well, reference, z
+
+    @property
+    def labware(self):
+        return self.well
+
+    @property
+    def point(self) -> Point:
+        '''Deck coordinates, from the labware definition placed on the deck.'''
+        return _point(self.well, self.reference, self.z)
+
+
+class Liquid:
+    def __init__(self, name: str, description: str = None, display_color: str = None):
+        self.name, self.description, self.display_color = name, description, display_color
+
+
+class Well:
+    __slots__ = ('parent', 'index', 'well_name', 'max_volume', 'depth', 'diameter', 'liquid')
+
+    def __init__(self, parent, index: int, name: str, info: dict):
+        self.parent, self.index, self.well_name = parent, index, name
+        self.max_volume, self.depth, self.diameter = info['totalLiquidVolume'], info['depth'], info.get('diameter')
+        self.liquid = None
+
+    def top(self, z: float = 0.0) -> Location:
+        return Location(self, 'top', z)
+
+    def bottom(self, z: float = 0.0) -> Location:
+        return Location(self, 'bottom', z)
+
+    def center(self) -> Location:
+        return Location(self, 'center', 0.0)
+
+    def load_liquid(self, liquid: Liquid, volume: float):
+        self.liquid = (liquid, volume)
+
+    def __repr__(self):
+        return f'{self.well_name} of {self.parent.load_name} on slot {self.parent.slot}'
+
+
+class Labware:
+    def __init__(self, load_name: str, slot: int, label: str = None):
+        self.load_name, self.slot, self.name = load_name, slot, label or load_name
+        order, rows, info = _layout(load_name)
+        self._wells = [Well(self, index, name, info[name]) for index, name in enumerate(order)]
+        self._by_name = {well.well_name: well for well in self._wells}
+        self._rows = [[self._by_name[name] for name in row] for row in rows]
+        self._columns = [list(column) for column in zip(*self._rows)] if rows and all(
+            len(row) == len(rows[0]) for row in rows) else [self._wells]
+        self.next_tip = 0
+
+    def wells(self) -> list:
+        return list(self._wells)
+
+    def wells_by_name(self) -> dict:
+        return dict(self._by_name)
+
+    def rows(self) -> list:
+        return [list(row) for row in self._rows]
+
+    def columns(self) -> list:
+        return [list(column) for column in self._columns]
+
+    def __getitem__(self, name: str) -> Well:
+        return self._by_name[name]
+
+
+class FlowRates:
+    def __init__(self, aspirate: float, dispense: float, blow_out: float):
+        self.aspirate, self.dispense, self.blow_out = aspirate, dispense, blow_out
+
+
+class Clearance:
+    def __init__(self):
+        self.aspirate, self.dispense = 1.0, 1.0
+
+
+def _well(location):
+    '''The well of a location, a well, or a labware (its first well, as for the fixed trash).'''
+    if isinstance(location, Location):
+        return location.well
+    return location._wells[0] if isinstance(location, Labware) else location
+
+
+def _as_list(locations) -> list:
+    '''Locations as a flat list (transfer and distribute accept nested lists, e.g. plate.rows()[0:2]).'''
+    if not isinstance(locations, (list, tuple)):
+        return [locations]
+    return [location for item in locations for location in _as_list(item)]
+
+
+class Instrument:
+    def __init__(self, context, name: str, mount: str, tip_racks: list):
+        spec = PIPETTES[name]
+        self.context, self.name, self.mount, self.tip_racks = context, name, mount, list(tip_racks or [])
+        self.min_volume, self.max_volume, self.channels = spec['min'], float(name[1:].split('_')[0]), spec['channels']
+        self.flow_rate = FlowRates(spec['aspirate'], spec['dispense'], spec['blow_out'])
+        self.well_bottom_clearance = Clearance()
+        self.has_tip, self.current_volume, self.tip_volume = False, 0.0, 0.0
+        self.location = None
+
+    def _log(self, op: str, location=None, volume: float = 0.0):
+        if location is not None:
+            self.location = location
+        well = _well(self.location if location is None else location)
+        self.context.log_rows.append((OP[op], MOUNTS[self.mount], well.parent.slot if well is not None else 0,
+                                      well.index if well is not None else -1, volume))
+
+    def pick_up_tip(self, location=None):
+        if self.has_tip:
+            raise RuntimeError(f'{self.name} on the {self.mount} mount already has a tip')
+        if location is None:
+            location = self._next_tip()
+        self.has_tip, self.current_volume = True, 0.0
+        self.tip_volume = _well(location).max_volume
+        self._log('pick_up_tip', location)
+        return self
+
+    def _next_tip(self) -> Well:
+        for rack in self.tip_racks:
+            if self.channels > 1 and rack.next_tip % 8:
+                rack.next_tip += 8 - rack.next_tip % 8
+            if rack.next_tip + self.channels <= len(rack._wells):
+                tip = rack._wells[rack.next_tip]
+                rack.next_tip += self.channels
+                return tip
+        raise RuntimeError(f'out of tips for {self.name} on the {self.mount} mount')
+
+    def drop_tip(self, location=None):
+        if not self.has_tip:
+            raise RuntimeError(f'{self.name} on the {self.mount} mount has no tip to drop')
+        self.has_tip = False
+        self._log('drop_tip', location if location is not None else self.context.fixed_trash['A1'])
+        return self
+
+    def return_tip(self):
+        return self.drop_tip()
+
+    def aspirate(self, volume: float = None, location=None, rate: float = 1.0):
+        if not self.has_tip:
+            raise RuntimeError(f'{self.name} on the {self.mount} mount cannot aspirate without a tip')
+        capacity = min(self.max_volume, self.tip_volume)
+        volume = capacity - self.current_volume if volume is None else volume
+        if self.current_volume + volume > capacity + 1e-9:
+            raise ValueError(f'cannot aspirate {volume} µL: {self.current_volume} µL already in a {capacity:g} µL tip')
+        self.current_volume += volume
+        self._log('aspirate', location, volume)
+        return self
+
+    def dispense(self, volume: float = None, location=None, rate: float = 1.0, push_out: float = None):
+        volume = self.current_volume if volume is None else volume
+        if volume > self.current_volume + 1e-9:
+            raise ValueError(f'cannot dispense {volume} µL: only {self.current_volume} µL in the tip')
+        self.current_volume -= volume
+        self._log('dispense', location, volume)
+        return self
+
+    def blow_out(self, location=None):
+        self.current_volume = 0.0
+        self._log('blow_out', location)
+        return self
+
+    def touch_tip(self, location=None, radius: float = 1.0, v_offset: float = -1.0, speed: float = 60.0):
+        self._log('touch_tip', location)
+        return self
+
+    def air_gap(self, volume: float = None, height: float = None):
+        self._log('air_gap', None, volume or 0.0)
+        return self
+
+    def move_to(self, location, **kwargs):
+        self.location = location
+        return self
+
+    def mix(self, repetitions: int = 1, volume: float = None, location=None, rate: float = 1.0):
+        volume = min(self.max_volume, self.tip_volume) if volume is None else volume
+        self._log('mix', location, volume)
+        for _ in range(repetitions):
+            self.aspirate(volume, location, rate)
+            self.dispense(volume, location, rate)
+        return self
+
+    def _tip_for(self, new_tip: str):
+        if new_tip == 'always' and self.has_tip:
+            self.drop_tip()
+        if not self.has_tip:
+            if new_tip == 'never':
+                raise RuntimeError(f"{self.name} on the {self.mount} mount has no tip (new_tip='never')")
+            self.pick_up_tip()
+
+    def transfer(self, volume, source, dest, new_tip: str = 'once', trash: bool = True, touch_tip: bool = False,
+                 blow_out: bool = False, mix_before: tuple = None, mix_after: tuple = None, air_gap: float = 0,
+                 **kwargs):
+        '''Legacy transfer: one aspirate and dispense per source/destination pair, split into equal
+        parts when the volume is more than the tip holds.'''
+        new_tip = new_tip.lower()
+        sources, dests = _as_list(source), _as_list(dest)
+        if len(sources) != len(dests) and 1 not in (len(sources), len(dests)):
+            raise ValueError(f'cannot pair {len(sources)} sources with {len(dests)} destinations')
+        pairs = max(len(sources), len(dests))
+        sources, dests = sources * (pairs // len(sources)), dests * (pairs // len(dests))
+        volumes = list(volume) if isinstance(volume, (list, tuple)) else [volume] * pairs
+        capacity = min(self.max_volume, self.tip_volume or self.max_volume) - air_gap
+        for src, dst, vol in zip(sources, dests, volumes):
+            if vol <= 0:
+                continue
+            parts = math.ceil(vol / capacity - 1e-9)
+            for _ in range(parts):
+                self._tip_for(new_tip)
+                if mix_before:
+                    self.mix(mix_before[0], mix_before[1], src)
+                self.aspirate(vol / parts, src)
+                if air_gap:
+                    self.air_gap(air_gap)
+                if touch_tip:
+                    self.touch_tip()
+                self.dispense(self.current_volume, dst)
+                if mix_after:
+                    self.mix(mix_after[0], mix_after[1], dst)
+                if blow_out:
+                    self.blow_out()
+                if touch_tip:
+                    self.touch_tip()
+        if new_tip != 'never' and self.has_tip:
+            self.drop_tip() if trash else self.return_tip()
+        return self
+
+    def distribute(self, volume, source, dest, new_tip: str = 'once', trash: bool = True, touch_tip: bool = False,
+                   disposal_volume: float = None, mix_before: tuple = None, air_gap: float = 0, **kwargs):
+        '''Legacy distribute: as many dispenses per aspiration as fit the tip with the disposal volume,
+        which is blown out over the trash after each aspiration.'''
+        new_tip = new_tip.lower()
+        dests = _as_list(dest)
+        volumes = list(volume) if isinstance(volume, (list, tuple)) else [volume] * len(dests)
+        disposal = self.min_volume if disposal_volume is None else disposal_volume
+        self._tip_for('never' if new_tip == 'never' else 'once')
+        capacity = min(self.max_volume, self.tip_volume) - disposal - air_gap
+        trips, trip = [], []
+        for dst, vol in zip(dests, volumes):
+            if vol <= 0:
+                continue
+            if trip and sum(v for _, v in trip) + vol > capacity + 1e-9:
+                trips.append(trip)
+                trip = []
+            trip.append((dst, vol))
+        trips += [trip] if trip else []
+        for n, trip in enumerate(trips):
+            if n and new_tip == 'always':
+                self._tip_for('always')
+            if mix_before:
+                self.mix(mix_before[0], mix_before[1], source)
+            self.aspirate(sum(v for _, v in trip) + disposal, source)
+            if touch_tip:
+                self.touch_tip()
+            for dst, vol in trip:
+                self.dispense(vol, dst)
+            if disposal:
+                self.blow_out(self.context.fixed_trash['A1'])
+        if new_tip != 'never' and self.has_tip:
+            self.drop_tip() if trash else self.return_tip()
+        return self
+
+
+class Parameters:
+    '''Runtime parameter definitions (add_parameters) and their values.'''
+
+    def __init__(self):
+        self.definitions = {}
+
+    def _add(self, variable_name: str, default, choices=None, minimum=None, maximum=None, **kwargs):
+        allowed = [choice['value'] for choice in choices] if choices else None
+        self.definitions[variable_name] = (default, allowed, minimum, maximum)
+
+    add_int = add_float = add_str = _add
+
+    def add_bool(self, variable_name: str, default: bool, **kwargs):
+        self.definitions[variable_name] = (default, [True, False], None, None)
+
+    def add_csv_file(self, variable_name: str, **kwargs):
+        self.definitions[variable_name] = (None, None, None, None)
+
+    def values(self, overrides: dict = None) -> dict:
+        values = {name: default for name, (default, _, _, _) in self.definitions.items()}
+        for name, value in (overrides or {}).items():
+            if name not in self.definitions:
+                raise ValueError(f'unknown parameter {name}')
+            _, allowed, minimum, maximum = self.definitions[name]
+            if allowed is not None and value not in allowed:
+                raise ValueError(f'{name}={value!r} is not one of {allowed}')
+            if minimum is not None and not minimum <= value <= maximum:
+                raise ValueError(f'{name}={value!r} is outside {minimum}-{maximum}')
+            values[name] = value
+        return values
+
+
+class Params:
+    '''protocol.params: parameter values as attributes.'''
+
+    def __init__(self, values: dict):
+        self.__dict__.update(values)
+
+    def get_all(self) -> dict:
+        return dict(self.__dict__)
+
+
+class FakeContext:
+    def __init__(self, api_version: str = '2.20', params: dict = None):
+        self.api_version = tuple(int(part) for part in api_version.split('.'))
+        self.params = Params(params or {})
+        self.loaded_labwares, self.loaded_instruments, self.liquids = {}, {}, []
+        self.log_rows = []
+        self._trash = None
+
+    @property
+    def fixed_trash(self) -> Labware:
+        if self._trash is None:
+            self._trash = Labware('opentrons_1_trash_1100ml_fixed', TRASH_SLOT)
+        return self._trash
+
+    def load_labware(self, load_name: str, location, label: str = None, namespace: str = None, version: int = None):
+        slot = int(location)
+        if slot in self.loaded_labwares:
+            raise ValueError(f'slot {slot} already holds {self.loaded_labwares[slot].load_name}')
+        self.loaded_labwares[slot] = Labware(load_name, slot, label)
+        return self.loaded_labwares[slot]
+
+    def load_instrument(self, instrument_name: str, mount: str, tip_racks: list = None, replace: bool = False):
+        mount = str(mount).lower()
+        if mount in self.loaded_instruments and not replace:
+            raise RuntimeError(f'the {mount} mount already has {self.loaded_instruments[mount].name}')
+        self.loaded_instruments[mount] = Instrument(self, instrument_name, mount, tip_racks)
+        return self.loaded_instruments[mount]
+
+    def define_liquid(self, name: str, description: str = None, display_color: str = None) -> Liquid:
+        if self.api_version < (2, 14):
+            raise RuntimeError(f'define_liquid is not available until API version 2.14 (this protocol uses '
+                               f'{".".join(map(str, self.api_version))})')
+        self.liquids.append(Liquid(name, description, display_color))
+        return self.liquids[-1]
+
+    def _log(self, op: str, seconds: float = 0.0):
+        self.log_rows.append((OP[op], 0, 0, -1, seconds))
+
+    def comment(self, msg: str):
+        self._log('comment')
+
+    def pause(self, msg: str = None):
+        self._log('pause')
+
+    def delay(self, seconds: float = 0, minutes: float = 0, msg: str = None):
+        self._log('delay', 60 * minutes + seconds)
+
+    def home(self):
+        self._log('home')
+
+    def is_simulating(self) -> bool:
+        return True
+
+    def log(self) -> np.ndarray:
+        '''The command log as a structured array (op, mount, slot, well, volume); op indexes OPS,
+        mount is 0 for protocol commands, 1 left, 2 right; well indexes the labware's wells(), -1 for none.'''
+        return np.array(self.log_rows, dtype=LOG_DTYPE)
+
+    def counts(self) -> dict:
+        '''Commands of each op in the log.'''
+        ops = np.bincount(self.log()['op'], minlength=len(OPS))
+        return dict(zip(OPS, ops.tolist()))
+
+
+def run_protocol(module, params: dict = None) -> FakeContext:
+    '''Run a loaded protocol module against a fresh FakeContext, with its parameter defaults
+    (from add_parameters) overridden by params.'''
+    parameters = Parameters()
+    if hasattr(module, 'add_parameters'):
+        module.add_parameters(parameters)
+    context = FakeContext(module.metadata.get('apiLevel', '2.20') if hasattr(module, 'metadata') else '2.20',
+                          parameters.values(params))
+    module.run(context)
+    return context
+
+
+if __name__ == '__main__':
+    import io
+    import os
+    import time
+
+    from planning.analysis_bench import find_protocols
+    from planning.simulation_sweep import simulate_run
+
+    paths = [os.path.abspath(path) for path in sys.argv[1:]] or [str(path) for path in find_protocols()]
+    print(f"{'protocol':<48} {'runs/s':>8}  {'tips':>11} {'aspirations':>13} {'dispenses':>11}   (fake / simulator)")
+    for path in paths:
+        name = os.path.basename(path)
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()  # protocols print as they go
+        try:
+            module = load_protocol(path)
+            context = run_protocol(module)
+            runs, start = 0, time.perf_counter()
+            while time.perf_counter() - start < 1.0:
+                run_protocol(module)
+                runs += 1
+            rate = runs / (time.perf_counter() - start)
+        except Exception as error:
+            sys.stdout = stdout
+            print(f'{name[:48]:<48} fake run failed: {type(error).__name__}: {error}')
+            continue
+        finally:
+            sys.stdout = stdout
+        counts = context.counts()
+        simulated = simulate_run(path, {})
+        if simulated['status'] != 'ok':
+            reference = ('-', '-', '-')
+        else:
+            reference = (simulated['tips'], simulated['aspirations'], simulated['dispenses'])
+        fake = (counts['pick_up_tip'], counts['aspirate'], counts['dispense'])
+        marks = ['' if f == r or r == '-' else ' *' for f, r in zip(fake, reference)]
+        print(f'{name[:48]:<48} {rate:8.0f}  ' + ' '.join(f'{f"{f} / {r}{m}":>{w}}' for f, r, m, w in
+                                                        zip(fake, reference, marks, (11, 13, 11))))
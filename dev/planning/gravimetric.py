@@ -0,0 +1,176 @@
+'''
+Gravimetric calibration
+
+Fits the fastest accurate flow rates from balance readings and feeds them back into the liquid
+classes (liquid_classes.py).
+
+Input: one or more CSV files from verification runs, one row per weighed dispense, with the columns
+
+    pipette     pipette model, e.g. p300_single_gen2
+    liquid      liquid class, e.g. mastermix
+    volume      requested volume (µL)
+    flow_rate   aspirate/dispense flow rate of the dispense (µL/s)
+    mass        measured mass (mg)
+    density     optional - g/mL; otherwise the class's typical density (DENSITY) is used
+
+Rows are grouped by pipette, liquid, volume and flow rate; each group gives the systematic error
+(mean volume against the requested volume) and the CV of the replicates. For every pipette, liquid
+and volume, error and CV are fitted as straight lines against flow rate, and the highest rate within
+the tested range at which both fits - and every tested rate below it - stay inside the limits is
+kept. A liquid's rate for a pipette is the lowest of those over the volumes tested, so it holds for
+all of them. Rates are never extrapolated above the fastest rate tested.
+
+With --write the rates are saved to flow_rates.json, which liquid_classes.py applies on top of
+its starting values (aspirate and dispense; blow out is unchanged); --apply also rewrites the
+copies of the liquid classes in the protocols to match.
+
+Usage (from the dev folder; requires numpy):
+
+    python -m planning.gravimetric "balance/2025-03-12 p300.csv" balance/primers.csv
+    python -m planning.gravimetric balance/*.csv --cv 0.03 --error 0.05 --write --apply
+'''
+
+import argparse
+import csv
+from dataclasses import dataclass
+import math
+import sys
+
+import numpy as np
+
+from planning import liquid_classes
+
+
+CV_LIMIT = 0.02         # largest coefficient of variation of the replicates
+ERROR_LIMIT = 0.05      # largest systematic error (relative to the requested volume)
+
+# typical densities (g/mL) at room temperature - a density column in the CSV takes precedence
+DENSITY = {'aqueous': 0.998, 'rna': 0.998, 'primer': 0.998, 'mastermix': 1.03}
+
+
+@dataclass
+class RateResult:
+    '''Replicates of one pipette, liquid, volume and flow rate.'''
+    pipette: str
+    liquid: str
+    volume: float
+    flow_rate: float
+    n: int
+    error: float        # (mean - requested) / requested
+    cv: float
+
+
+def read_measurements(paths: list) -> list:
+    '''Rows of all CSV files as dicts with numeric volume, flow_rate and measured volume (µL).'''
+    rows = []
+    for path in paths:
+        with open(path, newline='', encoding='utf-8-sig') as csv_file:
+            for line, row in enumerate(csv.DictReader(csv_file), start=2):
+                try:
+                    liquid = row['liquid'].strip()
+                    density = float(row['density']) if row.get('density') else DENSITY[liquid]
+                    rows.append({'pipette': row['pipette'].strip(), 'liquid': liquid,
+                                 'volume': float(row['volume']), 'flow_rate': float(row['flow_rate']),
+                                 'measured': float(row['mass']) / density})
+                except (KeyError, ValueError) as error:
+                    raise ValueError(f'{path}, line {line}: {error!r}') from None
+    return rows
+
+
+def summarize(rows: list) -> list:
+    '''One RateResult per pipette, liquid, volume and flow rate (groups of at least two replicates).'''
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['pipette'], row['liquid'], row['volume'], row['flow_rate']), []).append(row['measured'])
+    results = []
+    for (pipette, liquid, volume, rate), measured in sorted(groups.items()):
+        if len(measured) < 2:
+            continue
+        mean = float(np.mean(measured))
+        results.append(RateResult(pipette, liquid, volume, rate, len(measured), mean / volume - 1,
+                                  float(np.std(measured, ddof=1)) / mean))
+    return results
+
+
+def max_accurate_rate(results: list, cv_limit: float = CV_LIMIT, error_limit: float = ERROR_LIMIT) -> float:
+    '''Highest flow rate within the tested range at which the fitted error and CV stay inside the limits,
+    for one pipette, liquid and volume. Tested rates must pass as well; None if even the slowest fails.'''
+    results = sorted(results, key=lambda r: r.flow_rate)
+    rates = np.array([r.flow_rate for r in results])
+    if len(results) > 1:
+        error_fit = np.polyfit(rates, [r.error for r in results], 1)
+        cv_fit = np.polyfit(rates, [r.cv for r in results], 1)
+    else:
+        error_fit, cv_fit = [0.0, results[0].error], [0.0, results[0].cv]
+
+    def passes(rate):
+        return abs(np.polyval(error_fit, rate)) <= error_limit and np.polyval(cv_fit, rate) <= cv_limit
+
+    best = None
+    grid = np.linspace(rates[0], rates[-1], 200) if len(results) > 1 else rates
+    for rate in grid:
+        tested = [r for r in results if r.flow_rate <= rate + 1e-9]
+        if not passes(rate) or any(abs(r.error) > error_limit or r.cv > cv_limit for r in tested):
+            break
+        best = float(rate)
+    return best
+
+
+def fit_flow_rates(results: list, cv_limit: float = CV_LIMIT, error_limit: float = ERROR_LIMIT) -> tuple:
+    '''({liquid: {pipette: rate}}, [(liquid, pipette, volume)] with no accurate rate).
+    A liquid's rate for a pipette is the lowest of the rates fitted for each volume tested.'''
+    by_volume = {}
+    for r in results:
+        by_volume.setdefault((r.liquid, r.pipette, r.volume), []).append(r)
+    rates, failed = {}, []
+    for (liquid, pipette, volume), group in sorted(by_volume.items()):
+        rate = max_accurate_rate(group, cv_limit, error_limit)
+        if rate is None:
+            failed.append((liquid, pipette, volume))
+            continue
+        current = rates.setdefault(liquid, {}).get(pipette)
+        rates[liquid][pipette] = math.floor(rate * 10) / 10 if current is None else min(current, math.floor(rate * 10) / 10)
+    # a volume with no accurate rate means the liquid has none for that pipette
+    for liquid, pipette, _ in failed:
+        rates.get(liquid, {}).pop(pipette, None)
+    return rates, failed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Fit the fastest accurate flow rates from gravimetric data.')
+    parser.add_argument('csv', nargs='+', help='balance readings (pipette, liquid, volume, flow_rate, mass[, density])')
+    parser.add_argument('--cv', type=float, default=CV_LIMIT, help=f'CV limit (default {CV_LIMIT})')
+    parser.add_argument('--error', type=float, default=ERROR_LIMIT, help=f'systematic error limit (default {ERROR_LIMIT})')
+    parser.add_argument('--write', action='store_true', help=f'save the rates to {liquid_classes.FITTED_RATES}')
+    parser.add_argument('--apply', action='store_true', help='also update the liquid classes in the protocols')
+    args = parser.parse_args(argv)
+
+    results = summarize(read_measurements(args.csv))
+    print(f"{'liquid':<10} {'pipette':<18} {'volume':>7} {'rate':>7} {'n':>3} {'error':>7} {'CV':>6}")
+    for r in results:
+        flag = '' if abs(r.error) <= args.error and r.cv <= args.cv else '  outside limits'
+        print(f'{r.liquid:<10} {r.pipette:<18} {r.volume:7.1f} {r.flow_rate:7.1f} {r.n:3d} '
+              f'{100 * r.error:+6.1f}% {100 * r.cv:5.1f}%{flag}')
+
+    rates, failed = fit_flow_rates(results, args.cv, args.error)
+    print('\nFastest accurate flow rates (µL/s):')
+    for liquid, pipettes in sorted(rates.items()):
+        for pipette, rate in sorted(pipettes.items()):
+            current = liquid_classes.LIQUID_CLASSES[liquid].rates.get(pipette) if liquid in liquid_classes.LIQUID_CLASSES else None
+            was = f' (now {current[0]:g} / {current[1]:g})' if current else ''
+            print(f'  {liquid:<10} {pipette:<18} {rate:7.1f}{was}')
+    for liquid, pipette, volume in failed:
+        print(f'  ! {liquid} with the {pipette}: no tested rate is accurate at {volume:g} µL - rates left unchanged')
+
+    if args.write or args.apply:
+        liquid_classes.save_fitted_rates(rates)
+        print(f'\nSaved to {liquid_classes.FITTED_RATES}')
+    if args.apply:
+        liquid_classes.apply_fitted_rates()
+        for path in liquid_classes.update_copies():
+            print(f'Updated {path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+'''
+Labware definitions and well geometry
+
+Loads labware definitions the same way the robot does - custom definitions from the
+labware_definitions folder first, then the standard Opentrons definitions - and converts
+between liquid volume and liquid height in a well.
+
+Standard definitions with an `innerLabwareGeometry` section (schema 3, e.g. the 1.5 mL
+Eppendorf tube rack) describe the inside of the well as a stack of spherical, conical and
+cuboidal sections, so heights are accurate down to the tip of a conical tube. Other wells
+are treated as straight cylinders or boxes of the well's depth.
+
+Requires the `opentrons` package (for the standard definitions); custom definitions
+in labware_definitions are read directly.
+'''
+
+from dataclasses import dataclass
+import json
+import math
+import pathlib
+
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[2]
+LABWARE_ROOT = REPO_ROOT / 'labware_definitions'
+
+
+def _shared_data_root() -> pathlib.Path:
+    import opentrons_shared_data
+    return pathlib.Path(opentrons_shared_data.__file__).parent / 'data' / 'labware' / 'definitions'
+
+
+def load_definition(load_name: str) -> dict:
+    '''Labware definition for a load name: custom definition if there is one, otherwise the
+    latest standard definition (schema 3 where available, for its inner well geometry).'''
+    for path in sorted(LABWARE_ROOT.rglob(f'{load_name}.json')):
+        return json.loads(path.read_text(encoding='utf-8'))
+    root = _shared_data_root()
+    for schema in ('3', '2'):
+        versions = sorted((root / schema / load_name).glob('*.json'), key=lambda p: int(p.stem))
+        if versions:
+            return json.loads(versions[-1].read_text(encoding='utf-8'))
+    raise FileNotFoundError(f'no labware definition found for {load_name}')
+
+
+def _frustum_volume(h: float, d1: float, d2: float) -> float:
+    '''Volume of a conical frustum of height h between diameters d1 and d2.'''
+    return math.pi * h / 12 * (d1 * d1 + d1 * d2 + d2 * d2)
+
+
+def _section_volume(section: dict, height: float) -> float:
+    '''Volume held by one section of a well, filled to `height` above the section's bottom.'''
+    full = section['topHeight'] - section['bottomHeight']
+    h = min(max(height, 0.0), full)
+    if h <= 0:
+        return 0.0
+    shape = section['shape']
+    if shape == 'spherical':
+        # spherical cap at the bottom of the well, filled from its lowest point
+        r = section['radiusOfCurvature']
+        return math.pi * h * h * (3 * r - h) / 3
+    if shape == 'conical':
+        d1, d2 = section['bottomDiameter'], section['topDiameter']
+        return _frustum_volume(h, d1, d1 + (d2 - d1) * h / full)
+    if shape == 'cuboidal':
+        x1, y1 = section['bottomXDimension'], section['bottomYDimension']
+        x2 = x1 + (section['topXDimension'] - x1) * h / full
+        y2 = y1 + (section['topYDimension'] - y1) * h / full
+        mid = ((x1 + x2) / 2) * ((y1 + y2) / 2)
+        return h / 6 * (x1 * y1 + 4 * mid + x2 * y2)  # prismatoid formula
+    raise ValueError(f'unsupported well section shape: {shape}')
+
+
+@dataclass
+class WellGeometry:
+    '''Inside of one well: depth (mm), capacity (µL) and its sections, bottom to top.'''
+    depth: float
+    capacity: float
+    sections: list
+
+    @classmethod
+    def from_definition(cls, definition: dict, well: str = 'A1') -> 'WellGeometry':
+        info = definition['wells'][well]
+        geometry_id = info.get('geometryDefinitionId')
+        inner = definition.get('innerLabwareGeometry') or {}
+        if geometry_id in inner:
+            sections = sorted(inner[geometry_id]['sections'], key=lambda s: s['bottomHeight'])
+        elif info['shape'] == 'circular':
+            sections = [{'shape': 'conical', 'bottomDiameter': info['diameter'], 'topDiameter': info['diameter'],
+                         'bottomHeight': 0.0, 'topHeight': info['depth']}]
+        else:
+            sections = [{'shape': 'cuboidal', 'bottomXDimension': info['xDimension'], 'topXDimension': info['xDimension'],
+                         'bottomYDimension': info['yDimension'], 'topYDimension': info['yDimension'],
+                         'bottomHeight': 0.0, 'topHeight': info['depth']}]
+        return cls(depth=info['depth'], capacity=info['totalLiquidVolume'], sections=sections)
+
+    @classmethod
+    def load(cls, load_name: str, well: str = 'A1') -> 'WellGeometry':
+        return cls.from_definition(load_definition(load_name), well)
+
+    @property
+    def geometric_volume(self) -> float:
+        '''Volume of the well filled to its top (can exceed the rated capacity).'''
+        return self.volume_at(self.sections[-1]['topHeight'])
+
+    def volume_at(self, height: float) -> float:
+        '''Liquid volume (µL = mm³) when the liquid surface is `height` mm above the well bottom.'''
+        return sum(_section_volume(s, height - s['bottomHeight']) for s in self.sections)
+
+    def height_of(self, volume: float) -> float:
+        '''Liquid height (mm above the well bottom) of a volume (µL), by bisection on `volume_at`.'''
+        if volume <= 0:
+            return 0.0
+        top = self.sections[-1]['topHeight']
+        if volume >= self.volume_at(top):
+            return top
+        low, high = 0.0, top
+        for _ in range(60):
+            mid = (low + high) / 2
+            if self.volume_at(mid) < volume:
+                low = mid
+            else:
+                high = mid
+        return (low + high) / 2
+
+    def diameter_at(self, height: float) -> float:
+        '''Inner width of the well at a height (diameter, or the mean side of a rectangular section).'''
+        for s in self.sections:
+            if s['bottomHeight'] <= height <= s['topHeight']:
+                t = (height - s['bottomHeight']) / max(s['topHeight'] - s['bottomHeight'], 1e-9)
+                if s['shape'] == 'spherical':
+                    r = s['radiusOfCurvature']
+                    return 2 * math.sqrt(max(0.0, height * (2 * r - height)))
+                if s['shape'] == 'conical':
+                    return s['bottomDiameter'] + (s['topDiameter'] - s['bottomDiameter']) * t
+                x = s['bottomXDimension'] + (s['topXDimension'] - s['bottomXDimension']) * t
+                y = s['bottomYDimension'] + (s['topYDimension'] - s['bottomYDimension']) * t
+                return (x + y) / 2
+        return self.diameter_at(self.sections[-1]['topHeight'])
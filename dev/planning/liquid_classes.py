@@ -0,0 +1,216 @@
+'''
+Liquid classes
+
+The protocols pipette everything at the pipettes' default flow rates - tRNA diluent, RNA, viscous
+2x mastermix and 1.5 µL primers alike - except Freetown_Mastermix_Plating_96well.py, which sets
+80 µL/s by hand to match a Picus pipette. A liquid class names a kind of liquid and carries, for
+each pipette model:
+
+* flow rates (µL/s) for aspirate, dispense and blow out,
+* delays (s) after aspirating and after dispensing, to let a viscous liquid catch up with the plunger,
+* an air gap (µL) drawn after aspirating, so nothing drips while the tip travels,
+* where the disposal volume is blown out ('source well' or 'trash').
+
+Classes:
+
+* `aqueous` - tRNA diluent, water, negatives: default flow rates. The diluent volume sets the
+  dilution factor and the p20 moves the smallest diluent volumes, so a faster rate has to come
+  from gravimetric data before this class uses it.
+* `rna` - RNA dilutions: water-like too, but they set the copies per well, so they stay at the
+  default flow rates, which are the rates the pipettes' accuracy specifications are measured at.
+* `mastermix` - 2x qPCR mastermix (glycerol): slow (the Picus-equivalent 80 µL/s on the p300),
+  with short delays after aspirating and dispensing.
+* `primer` - primer and probe solutions, dispensed 1.5-2 µL at a time at the bottom of the p20's
+  range: default flow rates, disposal volume to the trash.
+
+The flow rates are starting values. Rates fitted from gravimetric data (gravimetric.py) are kept in
+flow_rates.json and replace the aspirate and dispense rates here when the module is loaded;
+`update_copies` then brings the protocols' copies in line.
+
+`transfer` and `distribute` cannot pause between moves, so delays are only applied where a protocol
+makes its own aspirate/dispense calls (`multi_dispense`). The protocols carry a compact copy of the
+classes they use (`liquid_classes`, `set_liquid_class`) in the form `protocol_copy` gives, and
+`check_copies` compares the copies in the protocols with this library.
+
+Usage (from the dev folder):
+
+    python -m planning.liquid_classes
+'''
+
+from dataclasses import dataclass, field
+import importlib.util
+import json
+import os
+import re
+
+from planning.pipettes import PIPETTES
+
+
+PROTOCOLS = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'protocols'))
+FITTED_RATES = os.path.join(os.path.dirname(__file__), 'flow_rates.json')
+
+
+@dataclass
+class LiquidClass:
+    name: str
+    description: str
+    rates: dict = field(default_factory=dict)     # pipette model -> (aspirate, dispense, blow out) µL/s
+    aspirate_delay: float = 0.0                   # s after each aspiration
+    dispense_delay: float = 0.0                   # s after each dispense
+    air_gap: float = 0.0                          # µL of air drawn after each aspiration
+    blowout: str = 'source well'                  # 'source well' or 'trash'
+
+
+def default_rates(model: str) -> tuple:
+    spec = PIPETTES[model]
+    return spec['aspirate'], spec['dispense'], spec['blow_out']
+
+
+LIQUID_CLASSES = {
+    'aqueous': LiquidClass(
+        'aqueous', 'tRNA diluent, water, negatives',
+        rates={model: default_rates(model) for model in PIPETTES}),
+    'rna': LiquidClass(
+        'rna', 'RNA dilutions in tRNA-water',
+        rates={model: default_rates(model) for model in PIPETTES}),
+    'mastermix': LiquidClass(
+        'mastermix', '2x qPCR mastermix',
+        rates={'p20_single_gen2': (5.0, 5.0, 5.0), 'p300_single_gen2': (80.0, 80.0, 80.0),
+               'p1000_single_gen2': (200.0, 200.0, 200.0), 'p20_multi_gen2': (5.0, 5.0, 5.0),
+               'p300_multi_gen2': (80.0, 80.0, 80.0)},
+        aspirate_delay=1.0, dispense_delay=0.2),
+    'primer': LiquidClass(
+        'primer', 'primer and probe solutions',
+        rates={model: default_rates(model) for model in PIPETTES},
+        blowout='trash'),
+}
+
+
+def load_fitted_rates(path: str = FITTED_RATES) -> dict:
+    '''{liquid: {pipette model: flow rate}} fitted from gravimetric data, or {} if there is none yet.'''
+    try:
+        with open(path, encoding='utf-8') as rates_file:
+            return json.load(rates_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_fitted_rates(rates: dict, path: str = FITTED_RATES):
+    '''Merge newly fitted rates into the saved ones.'''
+    saved = load_fitted_rates(path)
+    for liquid, pipettes in rates.items():
+        saved.setdefault(liquid, {}).update(pipettes)
+    with open(path, 'w', encoding='utf-8') as rates_file:
+        json.dump(saved, rates_file, indent=4, sort_keys=True)
+        rates_file.write('\n')
+
+
+def apply_fitted_rates(path: str = FITTED_RATES):
+    '''Replace the aspirate and dispense rates of the classes with the fitted ones (blow out is kept).'''
+    for liquid, pipettes in load_fitted_rates(path).items():
+        for model, rate in pipettes.items():
+            blow_out = LIQUID_CLASSES[liquid].rates.get(model, default_rates(model))[2]
+            LIQUID_CLASSES[liquid].rates[model] = (rate, rate, blow_out)
+
+
+apply_fitted_rates()
+
+
+def protocol_copy(names: list, models: list) -> dict:
+    '''The compact form the protocols carry: class name -> settings, with rates by pipette model.'''
+    copy = {}
+    for name in names:
+        liquid = LIQUID_CLASSES[name]
+        copy[name] = {'rates': {model: liquid.rates[model] for model in models},
+                      'aspirate_delay': liquid.aspirate_delay, 'dispense_delay': liquid.dispense_delay,
+                      'air_gap': liquid.air_gap, 'blowout': liquid.blowout}
+    return copy
+
+
+def check_copies(root: str = PROTOCOLS) -> list:
+    '''(protocol, class, problem) for every embedded liquid class that differs from the library.'''
+    problems = []
+    for folder, _, files in os.walk(root):
+        for file_name in sorted(files):
+            path = os.path.join(folder, file_name)
+            if not file_name.endswith('.py') or 'liquid_classes' not in open(path, encoding='utf-8').read():
+                continue
+            spec = importlib.util.spec_from_file_location('protocol', path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            for name, embedded in module.liquid_classes.items():
+                if name not in LIQUID_CLASSES:
+                    problems.append((file_name, name, 'not in the library'))
+                    continue
+                expected = protocol_copy([name], list(embedded['rates']))[name]
+                for key, value in expected.items():
+                    if key == 'rates':
+                        value = {model: tuple(rates) for model, rates in value.items()}
+                        embedded_value = {model: tuple(rates) for model, rates in embedded[key].items()}
+                    else:
+                        embedded_value = embedded.get(key)
+                    if embedded_value != value:
+                        problems.append((file_name, name, f'{key}: {embedded_value} (library: {value})'))
+    return problems
+
+
+def update_copies(root: str = PROTOCOLS) -> list:
+    '''Rewrite the flow rates in the protocols' copies of the liquid classes to match the library
+    (the rest of each file, including its line endings, is left as it is). Returns the files changed.'''
+    changed = []
+    for folder, _, files in os.walk(root):
+        for file_name in sorted(files):
+            path = os.path.join(folder, file_name)
+            if not file_name.endswith('.py'):
+                continue
+            with open(path, 'rb') as protocol_file:
+                raw = protocol_file.read().decode('utf-8')
+            start = raw.find('liquid_classes = {')
+            if start < 0:
+                continue
+            end = raw.find('\n}', start)
+            block = raw[start:end]
+            for name, liquid in LIQUID_CLASSES.items():
+                prefix = f"'{name}': {{'rates': {{"
+                entry = block.find(prefix)
+                if entry < 0:
+                    continue
+                rates_end = block.find('}', entry + len(prefix))
+                rates = block[entry:rates_end]
+                for model, values in liquid.rates.items():
+                    rates = re.sub(rf"'{model}': \([^)]*\)", f"'{model}': ({values[0]}, {values[1]}, {values[2]})", rates)
+                block = block[:entry] + rates + block[rates_end:]
+            updated = raw[:start] + block + raw[end:]
+            if updated != raw:
+                with open(path, 'wb') as protocol_file:
+                    protocol_file.write(updated.encode('utf-8'))
+                changed.append(path)
+    return changed
+
+
+def plunger_time(volume: float, rates: tuple) -> float:
+    '''Seconds of plunger movement to aspirate and dispense volume.'''
+    return volume / rates[0] + volume / rates[1]
+
+
+if __name__ == '__main__':
+    print(f"{'class':<10} {'pipette':<18} {'aspirate':>9} {'dispense':>9} {'blow out':>9}  delays / air gap / blowout")
+    for liquid in LIQUID_CLASSES.values():
+        for model, rates in liquid.rates.items():
+            print(f'{liquid.name:<10} {model:<18} {rates[0]:9.2f} {rates[1]:9.2f} {rates[2]:9.2f}  '
+                  f'{liquid.aspirate_delay:.1f} s / {liquid.dispense_delay:.1f} s / {liquid.air_gap:.0f} µL / {liquid.blowout}')
+
+    print()
+    p300 = 'p300_single_gen2'
+    # LSP_Pools_12replicates.py: 6 x 60 wells of 10 µL mastermix, 19 per aspiration - slower, with delays
+    trips = 6 * -(-60 // 19)
+    mastermix = LIQUID_CLASSES['mastermix']
+    before = plunger_time(6 * 60 * 10, default_rates(p300))
+    after = (plunger_time(6 * 60 * 10, mastermix.rates[p300])
+             + trips * mastermix.aspirate_delay + 6 * 60 * mastermix.dispense_delay)
+    print(f'LSP mastermix: plunger time {before:.0f} s -> {after:.0f} s with delays')
+
+    problems = check_copies()
+    print('\nProtocol copies: ' + ('match the library' if not problems else f'{len(problems)} differences'))
+    for file_name, name, problem in problems:
+        print(f'  {file_name}: {name} - {problem}')
@@ -0,0 +1,149 @@
+'''
+Liquid height tracking
+
+The protocols aspirate at the default 1 mm above the well bottom, however full the tube is: in a
+5 mL or 25 mL tube the tip travels to the bottom on every trip and most of its length ends up
+wetted, carrying liquid on the outside. They already declare starting volumes (`load_liquid`),
+so the volume in every tube is known throughout the run.
+
+`LiquidLedger` follows each aspirate and dispense and, from the well geometry in the labware
+definition (labware.py), gives the aspiration height: `IMMERSION` mm below the surface that
+will be left after the aspiration (so the tip stays submerged to the end), and never lower than
+the default clearance.
+
+The protocols carry a compact copy: StdCurve_Dil_Plate.py uses its tube profiles (`tube_height`),
+the others treat the well as a straight cylinder of its diameter. `check_approximation`
+compares such an approximation with the definition geometry - it must never put the surface
+higher than it is, or the tip could come out of the liquid.
+
+Usage (from the dev folder):
+
+    python -m planning.liquid_height
+'''
+
+from dataclasses import dataclass
+import math
+
+from planning.labware import WellGeometry
+
+
+IMMERSION = 2.0         # mm below the liquid surface left after an aspiration
+MIN_CLEARANCE = 1.0     # mm above the well bottom - the default aspiration height
+Z_SPEED = 125.0         # mm/s, OT-2 default z speed
+
+
+@dataclass
+class LedgerEntry:
+    geometry: WellGeometry
+    volume: float
+
+
+class LiquidLedger:
+    '''Volume in each tracked well, and where to aspirate from it.'''
+
+    def __init__(self, immersion: float = IMMERSION, min_clearance: float = MIN_CLEARANCE):
+        self.immersion = immersion
+        self.min_clearance = min_clearance
+        self.entries = {}
+        self.shortfalls = []    # (well, µL) aspirations that asked for more than the well held
+
+    def add(self, well: str, geometry: WellGeometry, volume: float = 0.0):
+        self.entries[well] = LedgerEntry(geometry, volume)
+
+    def volume(self, well: str) -> float:
+        return self.entries[well].volume
+
+    def surface(self, well: str) -> float:
+        entry = self.entries[well]
+        return entry.geometry.height_of(entry.volume)
+
+    def aspirate(self, well: str, vol: float) -> float:
+        '''Take vol out of a well; returns the aspiration height (mm above the well bottom).'''
+        entry = self.entries[well]
+        if vol > entry.volume + 1e-9:
+            self.shortfalls.append((well, vol - entry.volume))
+        entry.volume = max(0.0, entry.volume - vol)
+        return max(self.min_clearance, entry.geometry.height_of(entry.volume) - self.immersion)
+
+    def dispense(self, well: str, vol: float):
+        self.entries[well].volume += vol
+
+
+def cylinder_height(geometry: WellGeometry, diameter: float):
+    '''The protocols' fallback: liquid height in a straight cylinder of the well's (top) diameter.'''
+    return lambda vol: vol / (math.pi * diameter ** 2 / 4)
+
+
+def check_approximation(geometry: WellGeometry, height, steps: int = 50) -> float:
+    '''Largest amount (mm) by which an approximate height function puts the surface above the
+    true surface, over the well's range of volumes (0 or less is safe).'''
+    worst = -math.inf
+    for k in range(1, steps + 1):
+        vol = geometry.capacity * k / steps
+        worst = max(worst, height(vol) - geometry.height_of(vol))
+    return worst
+
+
+def descent_saved(geometry: WellGeometry, start: float, aspirations: list, returned: float = 0.0) -> tuple:
+    '''(mm of Z descent saved, shortfalls) by aspirating below the surface instead of at the default
+    clearance, for a sequence of aspiration volumes from one well (returned: µL blown back into it
+    after each aspiration). The tip is immersed that much less, too.'''
+    ledger = LiquidLedger()
+    ledger.add('tube', geometry, start)
+    descent = 0.0
+    for vol in aspirations:
+        descent += ledger.aspirate('tube', vol) - MIN_CLEARANCE
+        ledger.dispense('tube', returned)
+    return descent, ledger.shortfalls
+
+
+def trips(total: float, per_trip: float) -> list:
+    n = math.ceil(total / per_trip)
+    return [per_trip] * (n - 1) + [total - per_trip * (n - 1)]
+
+
+if __name__ == '__main__':
+    tube_1_5 = WellGeometry.load('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap')
+    tube_5 = WellGeometry.load('usascientific_15_tuberack_5000ul')
+    tube_25 = WellGeometry.load('opentrons_6_tuberack_25ml')
+
+    # the approximations carried by the protocols must not place the surface too high
+    def stdcurve_profile(d1, d2, h, diameter):
+        def height(vol):
+            low, high = 0.0, 100.0
+            for _ in range(30):
+                mid = (low + high) / 2
+                if mid >= h:
+                    v = math.pi * h / 12 * (d1**2 + d1*d2 + d2**2) + (mid - h) * math.pi * diameter**2 / 4
+                else:
+                    d = d1 + (d2 - d1) * mid / h
+                    v = math.pi * mid / 12 * (d1**2 + d1*d + d**2)
+                low, high = (mid, high) if v < vol else (low, mid)
+            return (low + high) / 2
+        return height
+
+    print('Height approximations (largest error above the true surface, mm; <= 0 is safe):')
+    for name, geometry, profile, diameter in (
+            ('1.5 mL tube', tube_1_5, (3.0, 8.6, 17.56, 8.9), 8.7),
+            ('5 mL tube', tube_5, (15.0, 15.0, 0.0, 15.0), 15.16),
+            ('25 mL tube', tube_25, (27.81, 27.81, 0.0, 27.81), 27.81)):
+        print(f'  {name:<12} tube profile {check_approximation(geometry, stdcurve_profile(*profile)):+5.2f}   '
+              f'cylinder {check_approximation(geometry, cylinder_height(geometry, diameter)):+5.2f}')
+
+    print('\nZ descent saved by aspirating below the surface (the tip goes down and back up):')
+    cases = [
+        # StdCurve_Dil_Plate.py, 24 plates: a 5 mL diluent tube (4.8 mL), drawn in 200 µL p300 trips
+        ('StdCurve diluent, 5 mL tube', tube_5, 4800, trips(4600, 200), 0.0),
+        # StdCurve_Dil_Plate.py, 24 plates: the 25 mL tube of the 100 copies dilution, plated 190 µL at a time
+        ('StdCurve 25 mL dilution tube', tube_25, 6000, trips(5800, 200), 10.0),
+        # Freetown_Mastermix_Plating_96well.py: a 5 mL tube for 5 plates at 10 µL
+        ('Mastermix, 5 mL tube', tube_5, 5000, trips(4800, 200), 10.0),
+        # aliquot protocols: 540 µL 1.5 mL tubes, 45 µL aliquots (4 per trip with the 20 µL disposal volume)
+        ('Aliquots, 540 µL tube, 8 wells', tube_1_5, 540, [200, 200, 20 + 90], 20.0),
+        ('Aliquots, 540 µL tube, 12 wells', tube_1_5, 540, [200, 200, 20 + 180], 20.0),
+    ]
+    for label, geometry, start, aspirations, returned in cases:
+        descent, shortfalls = descent_saved(geometry, start, aspirations, returned)
+        print(f'  {label:<32} {len(aspirations):3d} aspirations: {descent:5.0f} mm, '
+              f'about {2 * descent / Z_SPEED:4.1f} s'
+              + (f'  - SHORT by {sum(s for _, s in shortfalls):.0f} µL' if shortfalls else ''))
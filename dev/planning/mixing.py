@@ -0,0 +1,227 @@
+'''
+Mixing planner
+
+The dilution protocols mix every tube the same way: 5 cycles at 80% of the tube volume
+(capped at the pipette's maximum), at the default flow rate and default height.
+`plan_mixing` instead chooses the pipette, cycle count, mix volume, mix height and flow rate
+for each tube from the tube geometry, the liquid volume and the transfer ratio, so that the
+tube reaches a target homogeneity in the least time.
+
+The model is not calibrated against measured mixing, so its plans are a report: the
+protocols keep the validated mix as a floor (at least 5 cycles at 80% of the tube volume,
+default flow rate) and use the model only to add cycles, or to pause for mixing by hand,
+where it predicts a tube stays short of the target.
+
+Model (rough, but enough to rank options):
+
+* Right after a transfer, the added liquid sits as an unmixed layer. For a volume fraction
+  phi = transfer / total, the concentration across the tube has a coefficient of
+  variation CV0 = sqrt((1 - phi) / phi).
+* Each cycle exchanges a fraction f = mix volume / total volume of the tube, with an
+  efficiency e, so CV falls by a factor (1 - e * f) per cycle.
+* e depends on how far the dispensed jet carries into the liquid above the tip. A laminar
+  jet penetrates roughly 0.1 * Re tip diameters (Re = jet Reynolds number), so a faster
+  plunger or a wider tip mixes a taller column. Liquid below the tip is only reached by
+  aspiration, so raising the tip also leaves a poorly mixed layer underneath.
+* Flow rate is limited by splashing/foaming at the tip outlet, and the tip must stay
+  submerged at the bottom of each aspiration.
+
+Usage (from the dev folder):
+
+    python -m planning.mixing
+'''
+
+from dataclasses import dataclass
+import math
+
+from planning.labware import WellGeometry
+from planning.pipettes import PIPETTES, PICK_UP_TIP, DROP_TIP, choose_pipette
+
+
+TARGET_CV = 0.02            # target coefficient of variation of concentration within the tube
+WATER_VISCOSITY = 1.0       # mm²/s (kinematic viscosity, water at ~20 °C)
+JET_PENETRATION = 0.1       # jet penetration length, in tip diameters per unit Reynolds number
+MAX_JET_VELOCITY = 600.0    # mm/s at the tip outlet - faster jets splash and foam
+RATE_MULTIPLIERS = (1.0, 1.5, 2.0, 2.5, 3.0)
+MIN_BOTTOM_CLEARANCE = 1.0  # mm - the protocols' default aspirate/dispense height
+IMMERSION = 1.0             # mm the tip must stay below the surface at the end of an aspiration
+CYCLE_OVERHEAD = 0.5        # s per cycle for plunger reversal
+MAX_CYCLES = 20
+
+# tip outlet diameters (mm) for the filter tips used with each pipette model
+TIP_OUTLET = {20.0: 0.55, 200.0: 0.8, 1000.0: 1.1}
+
+# what the protocols do now
+CURRENT_CYCLES = 5
+CURRENT_FRACTION = 0.8
+
+
+@dataclass
+class MixPlan:
+    '''How to mix one tube.'''
+    pipette: str
+    cycles: int
+    volume: float       # µL per cycle
+    height: float       # mm above the tube bottom (aspirate and dispense)
+    rate: float         # multiple of the pipette's default flow rates
+    time: float         # seconds, including an extra tip if mixing with a different pipette
+    cv: float           # predicted coefficient of variation after mixing
+    new_tip: bool = False
+
+
+def _tip_outlet(spec: dict) -> float:
+    return TIP_OUTLET[spec['max']]
+
+
+def initial_cv(transfer_vol: float, total_vol: float) -> float:
+    '''Concentration CV right after adding transfer_vol of one liquid to make total_vol.'''
+    phi = min(max(transfer_vol / total_vol, 1e-9), 1.0)
+    return math.sqrt((1 - phi) / phi)
+
+
+def jet_penetration(spec: dict, rate: float) -> float:
+    '''How far (mm) a dispense jet carries into the liquid at `rate` times the default flow rate.'''
+    d = _tip_outlet(spec)
+    velocity = rate * spec['dispense'] / (math.pi * d * d / 4)
+    reynolds = velocity * d / WATER_VISCOSITY
+    return JET_PENETRATION * reynolds * d
+
+
+def cycle_efficiency(geometry: WellGeometry, total_vol: float, mix_vol: float, height: float,
+                     spec: dict, rate: float) -> float:
+    '''Fraction of the exchanged volume that ends up well mixed in one cycle.'''
+    column = geometry.height_of(total_vol - mix_vol) - height
+    if column <= 0:
+        return 0.0
+    reach = min(1.0, jet_penetration(spec, rate) / column)
+    below = geometry.volume_at(height) / total_vol  # dead volume under the tip
+    return reach * (1 - below)
+
+
+def cycle_time(mix_vol: float, spec: dict, rate: float) -> float:
+    return mix_vol / (spec['aspirate'] * rate) + mix_vol / (spec['dispense'] * rate) + CYCLE_OVERHEAD
+
+
+def cycles_needed(cv0: float, efficiency: float, fraction: float, target_cv: float = TARGET_CV) -> int:
+    '''Cycles to bring the CV from cv0 down to target_cv (MAX_CYCLES + 1 if the mixing has no effect).'''
+    if cv0 <= target_cv:
+        return 1
+    per_cycle = 1 - efficiency * fraction
+    if per_cycle <= 0:
+        return 1
+    if per_cycle >= 1:
+        return MAX_CYCLES + 1
+    return max(1, math.ceil(math.log(target_cv / cv0) / math.log(per_cycle)))
+
+
+def predicted_cv(cv0: float, efficiency: float, fraction: float, cycles: int) -> float:
+    return cv0 * max(0.0, 1 - efficiency * fraction) ** cycles
+
+
+def _options(geometry: WellGeometry, total_vol: float, spec: dict):
+    '''Candidate (mix volume, height, rate) for one pipette.'''
+    top = min(spec['max'], total_vol - geometry.volume_at(MIN_BOTTOM_CLEARANCE + IMMERSION))
+    if top < spec['min']:
+        return
+    volumes = sorted({round(spec['min'] + (top - spec['min']) * k / 8, 1) for k in range(9)})
+    d = _tip_outlet(spec)
+    max_rate = MAX_JET_VELOCITY * math.pi * d * d / 4 / spec['dispense']
+    rates = [r for r in RATE_MULTIPLIERS if r <= max_rate] or [1.0]
+    for mix_vol in volumes:
+        # highest height that keeps the tip submerged at the end of the aspiration
+        highest = geometry.height_of(total_vol - mix_vol) - IMMERSION
+        if highest < MIN_BOTTOM_CLEARANCE:
+            continue
+        heights = sorted({round(MIN_BOTTOM_CLEARANCE + (highest - MIN_BOTTOM_CLEARANCE) * k / 4, 1) for k in range(5)})
+        for height in heights:
+            for rate in rates:
+                yield mix_vol, height, rate
+
+
+def _rank(plan: MixPlan, target_cv: float) -> tuple:
+    '''Fastest plan reaching the target; if none does within MAX_CYCLES, the one getting closest.'''
+    return (max(0.0, plan.cv - target_cv), plan.time, plan.cycles)
+
+
+def plan_mixing(transfer_vol: float, total_vol: float, geometry: WellGeometry, pipettes: list,
+                current: str = None, target_cv: float = TARGET_CV) -> MixPlan:
+    '''Fastest way to mix a tube holding total_vol µL, total_vol - transfer_vol of which was already there.
+
+    pipettes: names (keys of PIPETTES) that may be used. Mixing with a pipette other than
+    `current` (the one that made the transfer, which still holds its tip) costs a fresh tip.
+    At most MAX_CYCLES cycles are planned; if that cannot reach target_cv, the plan getting closest is returned.
+    '''
+    cv0 = initial_cv(transfer_vol, total_vol)
+    best = None
+    for name in pipettes:
+        spec = PIPETTES[name]
+        tip_time = 0.0 if name == current else PICK_UP_TIP + DROP_TIP
+        for mix_vol, height, rate in _options(geometry, total_vol, spec):
+            e = cycle_efficiency(geometry, total_vol, mix_vol, height, spec, rate)
+            n = min(MAX_CYCLES, cycles_needed(cv0, e, mix_vol / total_vol, target_cv))
+            t = tip_time + n * cycle_time(mix_vol, spec, rate)
+            plan = MixPlan(name, n, mix_vol, height, rate, t, predicted_cv(cv0, e, mix_vol / total_vol, n),
+                           new_tip=name != current)
+            if best is None or _rank(plan, target_cv) < _rank(best, target_cv):
+                best = plan
+    if best is None:
+        raise ValueError(f'no pipette in {pipettes} can mix {total_vol} µL')
+    return best
+
+
+def current_mixing(transfer_vol: float, total_vol: float, geometry: WellGeometry, pipette: str,
+                   mix_pipette: str = None) -> MixPlan:
+    '''The protocols' fixed rule: 5 cycles at 80% of the tube volume (capped at the pipette maximum),
+    default rate, 1 mm from the bottom - with its time and predicted CV under the same model.'''
+    mix_pipette = mix_pipette or pipette
+    spec = PIPETTES[mix_pipette]
+    mix_vol = min(CURRENT_FRACTION * total_vol, spec['max'])
+    e = cycle_efficiency(geometry, total_vol, mix_vol, MIN_BOTTOM_CLEARANCE, spec, 1.0)
+    cv0 = initial_cv(transfer_vol, total_vol)
+    t = CURRENT_CYCLES * cycle_time(mix_vol, spec, 1.0)
+    if mix_pipette != pipette:
+        t += PICK_UP_TIP + DROP_TIP
+    return MixPlan(mix_pipette, CURRENT_CYCLES, mix_vol, MIN_BOTTOM_CLEARANCE, 1.0, t,
+                   predicted_cv(cv0, e, mix_vol / total_vol, CURRENT_CYCLES), new_tip=mix_pipette != pipette)
+
+
+def compare_run(series: dict, geometry: WellGeometry, pipettes: list) -> list:
+    '''Current vs planned mixing for each dilution step of a series ({'rna': [...], 'dil': [...]},
+    as returned by `get_volumes`). Returns a list of (step, current MixPlan, planned MixPlan).'''
+    by_size = sorted(pipettes, key=lambda name: PIPETTES[name]['max'])
+    ranges = [{'name': name, 'min': PIPETTES[name]['min'], 'max': PIPETTES[name]['max']} for name in by_size]
+    rows = []
+    for i in range(1, len(series['rna'])):
+        rna, dil = series['rna'][i], series['dil'][i]
+        # pipette making the transfer, as chosen by choose_pipette
+        transfer_pipette = choose_pipette(rna, *ranges)['name']
+        # the protocols switch from a p20 to the p300 for mixing when 80% of the tube is more than 20 µL
+        mix_pipette = transfer_pipette
+        if PIPETTES[transfer_pipette]['max'] == 20.0 and CURRENT_FRACTION * (rna + dil) >= 20.0:
+            mix_pipette = next((n for n in by_size if PIPETTES[n]['max'] == 200.0), transfer_pipette)
+        before = current_mixing(rna, rna + dil, geometry, transfer_pipette, mix_pipette)
+        after = plan_mixing(rna, rna + dil, geometry, pipettes, current=transfer_pipette)
+        rows.append((i, before, after))
+    return rows
+
+
+if __name__ == '__main__':
+    from planning.dilution import plan_dilutions
+    from planning.pipettes import ROBOTS
+
+    tube = WellGeometry.load('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap')
+    copies_per_well =    [1*10**7, 1*10**6, 1*10**5, 1*10**4, 1000, 200, 100, 20, 10, 5]
+    wells_per_dilution = [      3,       3,       3,       3,    6,   6,   8,  8,  8, 8]
+
+    for robot, mounts in ROBOTS.items():
+        for num_plates in (1, 4):
+            series = plan_dilutions(10, copies_per_well, wells_per_dilution, num_plates=num_plates,
+                                    excess_vol=0 if num_plates == 1 else 5).series()
+            rows = compare_run(series, tube, list(mounts.values()))
+            before = sum(row[1].time for row in rows)
+            after = sum(row[2].time for row in rows)
+            print(f'{robot}, {num_plates} plate(s): mixing {before:.0f} s -> {after:.0f} s (saves {before - after:.0f} s per run)')
+            for i, old, new in rows:
+                print(f"  tube {i}: {old.cycles} x {old.volume:5.1f} µL {old.pipette.split('_')[0]:>5} (CV {old.cv:.3f}, {old.time:4.1f} s)"
+                      f"  ->  {new.cycles} x {new.volume:5.1f} µL {new.pipette.split('_')[0]:>5} at {new.height:4.1f} mm,"
+                      f" {new.rate:.1f}x rate (CV {new.cv:.3f}, {new.time:4.1f} s)")
@@ -0,0 +1,134 @@
+'''
+Multi-dispense helpers
+
+The plating protocols are uploaded as single files, so each carries its own copy of the compact
+multi-dispense helpers: `serpentine` (the search-free ordering from routing.py, with `distance`),
+`plan_dispenses` and `multi_dispense` (the packing from dispensing.py), and `trash_location` for
+blowing out the disposal volume over the trash at any API level. This module holds the
+reference versions; `check_copies` compares the protocols' copies with them, so a fix made in
+one protocol is not missed in the others.
+
+Usage (from the dev folder):
+
+    python -m planning.multi_dispense
+'''
+
+import ast
+import inspect
+import math
+import os
+import re
+
+from planning.well_index import PROTOCOLS
+
+
+def distance(a, b):
+    return math.hypot(a.x - b.x, a.y - b.y)
+
+
+def serpentine(wells, source):
+    '''Order multi-dispense destinations to shorten gantry travel, without a search: row by row or column
+    by column (whichever path is shorter), reversing every other line, from the corner nearest the source.'''
+    start = source.top().point
+    points = [well.top().point for well in wells]
+    best = None
+    for major in (1, 0):           # rows (same y), then columns (same x)
+        minor = 1 - major
+        lines = {}
+        for i, p in enumerate(points):
+            lines.setdefault(round(p[major], 1), []).append(i)
+        for reverse_lines in (False, True):
+            for reverse_first in (False, True):
+                order = []
+                for n, key in enumerate(sorted(lines, reverse=reverse_lines)):
+                    line = sorted(lines[key], key=lambda i: points[i][minor])
+                    order += line[::-1] if (n % 2 == 1) != reverse_first else line
+                route = [start] + [points[i] for i in order]
+                length = sum(distance(a, b) for a, b in zip(route, route[1:]))
+                if best is None or length < best[0]:
+                    best = (length, order)
+    return [wells[i] for i in best[1]]
+
+def plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume=0):
+    '''Pack dispenses (µL per destination, in order) into as few aspirations as possible.
+
+    The disposal volume is aspirated once, stays in the tip for the whole run and is blown out at the end;
+    each aspiration also draws conditioning_volume, which goes straight back into the source.
+    Returns a list of trips, each a list of indices into volumes.'''
+    room = capacity - disposal_volume - conditioning_volume
+    if max(volumes) > room:
+        raise ValueError(f'a {max(volumes)} µL dispense does not fit in {capacity} µL with '
+                         f'{disposal_volume} µL disposal and {conditioning_volume} µL conditioning volume')
+    trips = [[]]
+    filled = 0
+    for i, vol in enumerate(volumes):
+        if filled + vol > room + 1e-9:
+            trips.append([])
+            filled = 0
+        trips[-1].append(i)
+        filled += vol
+    return trips
+
+
+def trash_location(protocol):
+    '''The fixed trash as a blowout location: its well up to API 2.15, the trash bin from 2.16.'''
+    trash = protocol.fixed_trash
+    return trash['A1'] if hasattr(trash, 'wells') else trash
+
+
+def multi_dispense(pipette, volume, source, dests, capacity, disposal_volume, blowout_location,
+                   conditioning_volume=0, touch_tip=False, liquid=None, protocol=None):
+    '''Dispense volume (µL, or a list with one volume per destination) from source into each of dests,
+    as planned by plan_dispenses, then blow out the disposal volume at blowout_location.
+    The disposal volume is cut to what fits beside the largest dispense (none for a full tip), so
+    large volumes go one per aspiration instead of failing.
+    liquid: a liquid class (from set_liquid_class), whose delays are made with protocol after each
+    aspiration and each dispense. The pipette must already have a tip.'''
+    volumes = volume if isinstance(volume, list) else [volume] * len(dests)
+    disposal_volume = max(0, min(disposal_volume, capacity - conditioning_volume - max(volumes)))
+    aspirate_delay = liquid['aspirate_delay'] if liquid else 0
+    dispense_delay = liquid['dispense_delay'] if liquid else 0
+    for n, trip in enumerate(plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume)):
+        pipette.aspirate(sum(volumes[i] for i in trip) + conditioning_volume + (disposal_volume if n == 0 else 0), source)
+        if aspirate_delay:
+            protocol.delay(seconds = aspirate_delay)
+        if touch_tip:
+            pipette.touch_tip(source)
+        if conditioning_volume:
+            pipette.dispense(conditioning_volume, source)
+        for i in trip:
+            pipette.dispense(volumes[i], dests[i])
+            if dispense_delay:
+                protocol.delay(seconds = dispense_delay)
+            if touch_tip:
+                pipette.touch_tip(dests[i])
+    pipette.blow_out(blowout_location)
+
+
+HELPERS = [distance, serpentine, plan_dispenses, trash_location, multi_dispense]
+
+
+def check_copies(roots: tuple = (PROTOCOLS,)) -> list:
+    '''(file, function) for every protocol copy of a helper that differs from this one.'''
+    library = {helper.__name__: ast.dump(ast.parse(inspect.getsource(helper))) for helper in HELPERS}
+    different = []
+    for root in roots:
+        for folder, _, files in os.walk(root):
+            for file_name in sorted(files):
+                path = os.path.join(folder, file_name)
+                if not file_name.endswith('.py'):
+                    continue
+                with open(path, encoding='utf-8') as protocol_file:
+                    source = protocol_file.read()
+                for name, dump in library.items():
+                    match = re.search(rf'^def {name}\(.*?(?=^\S)', source, re.M | re.S)
+                    if match and ast.dump(ast.parse(match.group(0))) != dump:
+                        different.append((path, name))
+    return different
+
+
+if __name__ == '__main__':
+    different = check_copies()
+    print('Protocol copies: ' + ('match the library' if not different else f'{len(different)} differ'))
+    for path, name in different:
+        print(f'  {name}: {path}')
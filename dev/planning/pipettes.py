@@ -0,0 +1,42 @@
+'''
+Pipette specifications
+
+Volume ranges and default flow rates of the OT-2 pipettes used in this repository, the pipettes
+installed on each robot, rough tip handling times, and the per-step pipette choice the standard
+curve protocol makes (`choose_pipette`). The other planning modules take their pipette figures
+from here.
+'''
+
+
+# OT-2 GEN2 pipettes: accurate volume range (µL) and default flow rates (µL/s).
+# 'max' is the working volume with the tips used in this repository's protocols (e.g. 200 µL filter tips on the p300).
+PIPETTES = {
+    'p20_single_gen2':   {'min': 1.0,   'max': 20.0,   'aspirate': 7.56,  'dispense': 7.56,  'blow_out': 7.56,  'channels': 1},
+    'p300_single_gen2':  {'min': 20.0,  'max': 200.0,  'aspirate': 92.86, 'dispense': 92.86, 'blow_out': 92.86, 'channels': 1},
+    'p1000_single_gen2': {'min': 100.0, 'max': 1000.0, 'aspirate': 274.7, 'dispense': 274.7, 'blow_out': 274.7, 'channels': 1},
+    'p20_multi_gen2':    {'min': 1.0,   'max': 20.0,   'aspirate': 7.6,   'dispense': 7.6,   'blow_out': 7.6,   'channels': 8},
+    'p300_multi_gen2':   {'min': 20.0,  'max': 200.0,  'aspirate': 94.0,  'dispense': 94.0,  'blow_out': 94.0,  'channels': 8},
+}
+
+# pipettes installed on each robot (the "robot" parameter in StdCurve_Dil_Plate.py)
+ROBOTS = {
+    '7B10': {'left': 'p20_single_gen2', 'right': 'p300_single_gen2'},
+    '8B04': {'left': 'p1000_single_gen2', 'right': 'p300_single_gen2'},
+}
+
+# time model (seconds) - rough OT-2 figures, used to compare plans rather than predict exact run times
+PICK_UP_TIP = 6.0       # move to tip rack + pick up
+DROP_TIP = 5.0          # move to trash + drop
+
+
+def choose_pipette(vol, range1: dict, range2: dict):
+    '''Same rule as `choose_pipette` in StdCurve_Dil_Plate.py: the range containing the volume,
+    else the smaller pipette for very small volumes, else the larger one.'''
+    if vol > range1['min'] and vol <= range1['max']:
+        return range1
+    elif vol > range2['min'] and vol <= range2['max']:
+        return range2
+    elif vol <= range1['min'] and vol <= range2['min']:
+        return range1 if range1['min'] <= range2['min'] else range2
+    else:
+        return range1 if range1['max'] >= range2['max'] else range2
@@ -0,0 +1,147 @@
+'''
+Plate grid
+
+Well selection in the protocols is index arithmetic on labware.wells() order (column by column):
+`k*16 + row`, `i*48 + 16`, `section_rows*5 + section_columns*192 + no_of_cols*16`, and a `while` loop
+that skips rows G and H in VariousPrimers. `PlateGrid` is a selection of wells on a 96- or 384-well
+plate held as a boolean rows x columns array: rows, columns, a rectangle (`select`, `block`), a
+384-well quadrant or a stride are each one call, selections combine with | & - ~, and the result
+comes back as plate-order indices or as well objects from a `WellIndex` (well_index.py). A row or
+column that is not on the plate raises IndexError instead of wrapping onto the next column.
+
+PlateGrid is for planning layouts here; the protocols don't carry it. Importing numpy and defining
+the class slowed every analysis, so the protocols take the same selections straight from the rows
+and columns of a `WellIndex`, which list comprehensions slice just as cheaply.
+
+Usage (from the dev folder):
+
+    python -m planning.plate_grid
+'''
+
+import numpy as np
+
+
+class PlateGrid:
+    '''A selection of wells on a 96- or 384-well plate, as a boolean array of rows x columns.
+    Rows and columns are numbered from 0. Selections combine with | (either), & (both), - (except) and ~ (not);
+    indices() gives plate-order indices (labware.wells() order), wells(index) the wells of a WellIndex.'''
+
+    shapes = {96: (8, 12), 384: (16, 24)}
+
+    def __init__(self, size=96, mask=None):
+        self.size = size
+        self.mask = np.zeros(self.shapes[size], dtype=bool) if mask is None else mask
+
+    def _axis(self, selection, axis):
+        positions = np.arange(self.mask.shape[axis])
+        if isinstance(selection, slice):
+            return positions[selection]
+        selection = np.atleast_1d(np.asarray(selection, dtype=int))
+        outside = selection[(selection < 0) | (selection >= len(positions))]
+        if outside.size:
+            raise IndexError(f'{"rows" if axis == 0 else "columns"} {outside.tolist()} not on a {self.size}-well plate')
+        return selection
+
+    def select(self, rows=slice(None), columns=slice(None)):
+        '''Wells in the given rows and columns (an int, a list or range, or a slice; default all).'''
+        mask = np.zeros_like(self.mask)
+        mask[np.ix_(self._axis(rows, 0), self._axis(columns, 1))] = True
+        return PlateGrid(self.size, mask)
+
+    def rows(self, rows):
+        return self.select(rows=rows)
+
+    def columns(self, columns):
+        return self.select(columns=columns)
+
+    def block(self, first, last):
+        '''The rectangle with corners first and last (well names, e.g. 'A1', 'H3').'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return self.select(range(min(r0, r1), max(r0, r1) + 1), range(min(c0, c1), max(c0, c1) + 1))
+
+    def stride(self, row_step=1, column_step=1, row_start=0, column_start=0):
+        return self.select(slice(row_start, None, row_step), slice(column_start, None, column_step))
+
+    def quadrant(self, quadrant):
+        '''One of the four interleaved 96-well quadrants of a 384-well plate: 0 from A1, 1 from A2, 2 from B1, 3 from B2.'''
+        return self.stride(2, 2, quadrant // 2, quadrant % 2)
+
+    def __or__(self, other):
+        return PlateGrid(self.size, self.mask | other.mask)
+
+    def __and__(self, other):
+        return PlateGrid(self.size, self.mask & other.mask)
+
+    def __sub__(self, other):
+        return PlateGrid(self.size, self.mask & ~other.mask)
+
+    def __invert__(self):
+        return PlateGrid(self.size, ~self.mask)
+
+    def __len__(self):
+        return int(self.mask.sum())
+
+    def indices(self, order='columns'):
+        '''Selected wells as indices into labware.wells(), column by column (plate order) or row by row.'''
+        if order == 'rows':
+            rows, columns = np.nonzero(self.mask)
+        else:
+            columns, rows = np.nonzero(self.mask.T)
+        return (columns * self.mask.shape[0] + rows).tolist()
+
+    def wells(self, index, order='columns'):
+        '''Selected wells as well objects, from a WellIndex of the plate.'''
+        return [index[i] for i in self.indices(order)]
+
+
+if __name__ == '__main__':
+    import timeit
+
+    plate = PlateGrid(384)
+
+    # the protocols' hand-written lists, and the same selections as grids
+    cases = []
+    for section_rows in range(3):       # LSP_Pools_12replicates.py
+        for section_columns in range(2):
+            cases.append((f'LSP 12 replicates, mastermix {len(cases) + 1}',
+                          [section_rows*5 + section_columns*192 + no_of_cols*16 + wells_in_column
+                           for no_of_cols in range(12) for wells_in_column in range(5)],
+                          plate.select(range(section_rows*5, section_rows*5 + 5),
+                                       range(section_columns*12, section_columns*12 + 12)).indices()))
+    for i in range(4):                  # YFV_6x6_ProbeScreen.py, primer mixes
+        cases.append((f'YFV primer mix {i + 1}', [k*16 + row for row in (i, i+4, i+8) for k in range(18)],
+                      plate.select([i, i+4, i+8], range(18)).indices('rows')))
+    for i in range(6):                  # YFV_6x6_ProbeScreen.py, probes
+        cases.append((f'YFV probe {i + 1}', [k + 16*j + i*48 for j in range(3) for k in range(12)],
+                      plate.select(range(12), range(i*3, i*3 + 3)).indices()))
+    num_primers = 8
+    for i in range(num_primers):        # PrimerEval_PlatePrimers_Custom.py
+        cases.append((f'PrimerEval forward {i + 1}',
+                      list(range(i, num_primers*48, 16)) + list(range(num_primers + i, num_primers*49, 16)),
+                      plate.select([i, num_primers + i], range(3*num_primers)).indices('rows')))
+        cases.append((f'PrimerEval reverse {i + 1}',
+                      [w for c in range(3) for w in range(i*48 + 16*c, i*48 + 16*c + 2*num_primers)],
+                      plate.select(range(2*num_primers), range(3*i, 3*i + 3)).indices()))
+    for h in range(2):                  # VariousPrimers_v3.1, 422 probes: rows A-N except G and H
+        hand = []
+        for k in range(3):
+            j = 0
+            while j < 14:
+                hand.append(j + k*16 + h*48)
+                j += 1
+                if j == 6:
+                    j = 8
+        cases.append((f'VariousPrimers 422 probe {h + 1}', sorted(hand),
+                      (plate.select(range(14), range(3*h, 3*h + 3)) - plate.rows([6, 7])).indices()))
+
+    mismatches = [label for label, hand, grid in cases if hand != grid]
+    print(f'{len(cases)} selections from the protocols: ' + ('all match' if not mismatches else f'mismatches: {mismatches}'))
+
+    seconds = timeit.timeit(lambda: plate.select(range(5, 10), range(12, 24)).indices(), number=10000) / 10000
+    print(f'select + indices on a 384-well plate: {seconds * 1e6:.0f} µs')
+    seconds = timeit.timeit(lambda: plate.quadrant(1).indices(), number=10000) / 10000
+    print(f'quadrant + indices: {seconds * 1e6:.0f} µs')
+    try:
+        plate.select(range(17), 0)
+    except IndexError as error:
+        print(f'out of bounds: IndexError ({error})')
@@ -0,0 +1,234 @@
+'''
+Plate map compiler
+
+StdCurve_Dil_Plate.py and the reportable-range aliquot protocols draw their plate maps as box
+diagrams in the docstring, then encode the same layout again by hand (`get_wells()`, nested loops
+over `8*col + row`). This module compiles a plate map - the box diagram itself, or a CSV grid - into
+the destination wells of each liquid:
+
+* box diagrams: the column numbers above the box and the row letters beside it place each well;
+  the box-drawing lines split the plate into regions (a flood fill from each well that stops at
+  the lines), and the text inside a region names its liquid. Regions without text are left empty.
+* CSV: a header row of column numbers, then one row per plate row - the row letter, then the
+  liquid in each well (empty cells are left empty).
+
+Regions with the same name are one liquid, so each liquid is one multi-dispense. Its wells are
+ordered row by row, alternating direction (a serpentine), so consecutive dispenses of a
+multi-dispense are neighbours.
+
+The protocols carry the compiled map as data (`plate_map = {liquid: [well names]}`), so nothing
+is parsed during analysis and changing a layout means redrawing the diagram and recompiling.
+`check` compares a protocol's `plate_map` with the diagram in its docstring; --update rewrites it.
+
+Usage (from the dev folder):
+
+    python -m planning.plate_map "../protocols/Pretoria/Pretoria_RNA_Aliquots_ReportableRange.py"
+    python -m planning.plate_map layout.csv
+    python -m planning.plate_map --check
+    python -m planning.plate_map --update "../protocols/Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py"
+'''
+
+import argparse
+import ast
+import csv
+import io
+import os
+import re
+import sys
+
+from planning.well_index import PROTOCOLS
+
+
+BOX_CHARACTERS = set('─│┌┐└┘├┤┬┴┼═║╔╗╚╝╠╣╦╩╬')
+
+
+def _header(lines: list) -> tuple:
+    '''(line number, [x of each column number]) of the first line that numbers the plate's columns 1, 2, 3...'''
+    for y, line in enumerate(lines):
+        tokens = [(match.group(), match.start(), match.end()) for match in re.finditer(r'\S+', line)]
+        if len(tokens) >= 12 and [token for token, _, _ in tokens] == [str(n) for n in range(1, len(tokens) + 1)]:
+            return y, [(start + end - 1) // 2 for _, start, end in tokens]
+    raise ValueError('no line of column numbers (1 2 3 ... 12) found above a plate map')
+
+
+def parse_ascii(text: str) -> dict:
+    '''{well name: liquid} from a box diagram (wells in regions without text are left out).'''
+    lines = text.splitlines()
+    header, xs = _header(lines)
+    rows = {}
+    for y in range(header + 1, len(lines)):
+        match = re.match(r'\s*([A-P])\s*[│|║]', lines[y])
+        if match:
+            rows[match.group(1)] = y
+        elif rows and not lines[y].strip():
+            break
+    width = max(len(line) for line in lines)
+    grid = [line.ljust(width) for line in lines]
+    drawn = ''.join(lines[header:max(rows.values()) + 2])
+    if BOX_CHARACTERS & set(drawn):
+        def wall(x, y):
+            return grid[y][x] in BOX_CHARACTERS
+    else:
+        # in plain ASCII, - and | only draw a line when they continue one (so '1.0E+07' is text):
+        # - next to - or + on its row, | next to | or + in its column, + next to either
+        def at(x, y):
+            return grid[y][x] if 0 <= y < len(grid) and 0 <= x < width else ' '
+
+        def wall(x, y):
+            character = at(x, y)
+            across = at(x - 1, y) in '-+' or at(x + 1, y) in '-+'
+            down = at(x, y - 1) in '|+' or at(x, y + 1) in '|+'
+            return (character == '-' and across) or (character == '|' and down) or (character == '+' and (across or down))
+
+    region_of, texts = {}, []
+    for row, y in rows.items():
+        for column, x in enumerate(xs, start=1):
+            if wall(x, y):
+                x += 1 if not wall(x + 1, y) else -1
+            if (x, y) in region_of:
+                continue
+            # flood fill between the lines
+            region = len(texts)
+            stack, cells = [(x, y)], []
+            region_of[(x, y)] = region
+            while stack:
+                cx, cy = stack.pop()
+                cells.append((cx, cy))
+                for nx, ny in ((cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)):
+                    if 0 <= ny < len(grid) and 0 <= nx < width and (nx, ny) not in region_of and not wall(nx, ny):
+                        region_of[(nx, ny)] = region
+                        stack.append((nx, ny))
+            words = []
+            for line in sorted({cy for _, cy in cells}):
+                words += ''.join(grid[line][cx] for cx in sorted(cx for cx, cy in cells if cy == line)).split()
+            texts.append(' '.join(words))
+    wells = {}
+    for row, y in rows.items():
+        for column, x in enumerate(xs, start=1):
+            if wall(x, y):
+                x += 1 if not wall(x + 1, y) else -1
+            liquid = texts[region_of[(x, y)]]
+            if liquid:
+                wells[f'{row}{column}'] = liquid
+    return wells
+
+
+def parse_csv(text: str) -> dict:
+    '''{well name: liquid} from a CSV grid: column numbers in the first row, row letters in the first column.'''
+    reader = csv.reader(io.StringIO(text))
+    columns = [cell.strip() for cell in next(reader)[1:]]
+    wells = {}
+    for line in reader:
+        if not line or not line[0].strip():
+            continue
+        for column, cell in zip(columns, line[1:]):
+            if cell.strip():
+                wells[f'{line[0].strip()}{column}'] = cell.strip()
+    return wells
+
+
+def _position(well: str) -> tuple:
+    return ord(well[0]) - ord('A'), int(well[1:]) - 1
+
+
+def compile_map(wells: dict) -> dict:
+    '''{liquid: [well names]} - liquids in the order they first appear reading the map, each liquid's wells
+    row by row in a serpentine (left to right, then right to left on the next row it uses).'''
+    by_liquid = {}
+    for well in sorted(wells, key=_position):
+        by_liquid.setdefault(wells[well], []).append(well)
+    compiled = {}
+    for liquid, names in by_liquid.items():
+        rows = {}
+        for name in names:
+            rows.setdefault(_position(name)[0], []).append(name)
+        compiled[liquid] = []
+        for n, row in enumerate(sorted(rows)):
+            row_wells = sorted(rows[row], key=lambda name: _position(name)[1])
+            compiled[liquid] += row_wells if n % 2 == 0 else row_wells[::-1]
+    return compiled
+
+
+def compile_file(path: str) -> dict:
+    '''Compile a CSV grid, or the first box diagram in a text file or protocol (docstring).'''
+    with open(path, encoding='utf-8') as map_file:
+        text = map_file.read()
+    return compile_map(parse_csv(text) if path.endswith('.csv') else parse_ascii(text))
+
+
+def format_map(plate_map: dict, name: str = 'plate_map') -> str:
+    lines = [f'{name} = {{']
+    for liquid, wells in plate_map.items():
+        lines.append(f'    {liquid!r}: {wells!r},')
+    return '\n'.join(lines) + '\n}'
+
+
+def protocol_map(path: str) -> dict:
+    '''The plate_map a protocol carries, or None.'''
+    with open(path, encoding='utf-8') as protocol_file:
+        tree = ast.parse(protocol_file.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == 'plate_map' for target in node.targets):
+            return ast.literal_eval(node.value)
+    return None
+
+
+def check(root: str = PROTOCOLS) -> list:
+    '''(protocol, problem) for every protocol whose plate_map differs from the diagram in its docstring.'''
+    problems = []
+    for folder, _, files in os.walk(root):
+        for file_name in sorted(files):
+            path = os.path.join(folder, file_name)
+            if not file_name.endswith('.py'):
+                continue
+            carried = protocol_map(path)
+            if carried is None:
+                continue
+            compiled = compile_file(path)
+            if carried != compiled:
+                different = sorted(set(carried) ^ set(compiled)) or [liquid for liquid in carried if carried[liquid] != compiled[liquid]]
+                problems.append((path, f'differs from the plate map in the docstring: {different}'))
+    return problems
+
+
+def update(path: str) -> bool:
+    '''Rewrite the plate_map block of a protocol from its docstring diagram (line endings are kept).'''
+    with open(path, 'rb') as protocol_file:
+        raw = protocol_file.read().decode('utf-8')
+    newline = '\r\n' if '\r\n' in raw else '\n'
+    start = raw.find('plate_map = {')
+    end = raw.find(f'{newline}}}', start) + len(newline) + 1
+    if start < 0:
+        return False
+    updated = raw[:start] + format_map(compile_file(path)).replace('\n', newline) + raw[end:]
+    if updated == raw:
+        return False
+    with open(path, 'wb') as protocol_file:
+        protocol_file.write(updated.encode('utf-8'))
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Compile plate maps (box diagrams or CSV grids) into destination wells.')
+    parser.add_argument('maps', nargs='*', help='protocols or text files with a box diagram, or CSV grids')
+    parser.add_argument('--check', action='store_true', help="compare the protocols' plate_map with their diagrams")
+    parser.add_argument('--update', action='store_true', help="rewrite the given protocols' plate_map from their diagrams")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        problems = check()
+        print('Protocol plate maps: ' + ('match their diagrams' if not problems else f'{len(problems)} differ'))
+        for path, problem in problems:
+            print(f'  {path}: {problem}')
+        return 1 if problems else 0
+    for path in args.maps:
+        if args.update:
+            print(('Updated ' if update(path) else 'Unchanged ') + path)
+        else:
+            print(f'# {os.path.basename(path)}')
+            print(format_map(compile_file(path)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+'''
+Cross-step regrouping
+
+Several protocols split one continuous job into separate `distribute` calls: YFV_6x6_ProbeScreen.py
+fills rows A, E and I with the same primer mix (and the same tip) in three calls, and the mastermix
+plating protocols call `distribute` once per plate from the same tube. Every call starts with a
+fresh aspiration and ends with a blowout - and usually a part-filled last trip.
+
+`merge_operations` is a plan-level pass over a list of operations: consecutive operations that
+draw the same liquid from the same source, with the same tip (or each with a fresh tip, which
+can then be shared - the destinations all receive that liquid), become one continuous
+multi-dispense across rows and plates. `report` counts aspirations, blowouts and tips before
+and after, for either `distribute` or the packed engine in dispensing.py (one blowout per run).
+
+Usage (from the dev folder):
+
+    python -m planning.regrouping
+'''
+
+from dataclasses import dataclass, field
+
+from planning.dispensing import legacy_plan, plan_dispenses
+
+
+@dataclass
+class Operation:
+    '''One multi-dispense from a source. tip: label of the tip used; operations with the same label
+    share a tip, None means the operation picks up its own.'''
+    source: str
+    volumes: list                   # µL per destination
+    dests: list = field(default_factory=list)
+    tip: str = None
+    capacity: float = 200.0
+    disposal_volume: float = 10.0
+    label: str = ''
+
+
+def can_merge(a: Operation, b: Operation) -> bool:
+    '''Same source (so the same liquid), same tip and same pipetting settings.
+    Fresh-tip operations are given a shared tip by `shared_tips` first.'''
+    return (a.source == b.source and a.tip == b.tip
+            and a.capacity == b.capacity and a.disposal_volume == b.disposal_volume)
+
+
+def merge_operations(operations: list) -> list:
+    '''Merge runs of consecutive mergeable operations into single operations (order kept).'''
+    merged = []
+    for op in operations:
+        if merged and can_merge(merged[-1], op):
+            last = merged[-1]
+            merged[-1] = Operation(last.source, last.volumes + op.volumes, last.dests + op.dests, last.tip,
+                                   last.capacity, last.disposal_volume, f'{last.label} + {op.label}')
+        else:
+            merged.append(op)
+    return merged
+
+
+@dataclass
+class Counts:
+    aspirations: int = 0
+    blowouts: int = 0
+    tips: int = 0
+    blown_out: float = 0.0
+
+    def __str__(self):
+        return (f'{self.aspirations:3d} aspirations, {self.blowouts:3d} blowouts, {self.tips:2d} tips, '
+                f'{self.blown_out:6.1f} µL disposal volume blown out')
+
+
+def count(operations: list, engine: bool = False) -> Counts:
+    '''Aspirations, blowouts, tips and disposal volume blown out for a list of operations, run with `distribute`
+    (blowout after every aspiration) or with the packed engine (one blowout per operation).'''
+    counts = Counts()
+    tips_seen = set()
+    for op in operations:
+        if engine:
+            plan = plan_dispenses(op.volumes, op.capacity, op.disposal_volume)
+            blowouts = 1
+        else:
+            plan = legacy_plan(op.volumes, op.capacity, op.disposal_volume)
+            blowouts = len(plan.trips)
+        counts.aspirations += len(plan.trips)
+        counts.blowouts += blowouts
+        counts.blown_out += op.disposal_volume * blowouts
+        if op.tip is None or op.tip not in tips_seen:
+            counts.tips += 1
+            tips_seen.add(op.tip)
+    return counts
+
+
+def shared_tips(operations: list) -> list:
+    '''Give consecutive fresh-tip operations from the same source one shared tip label, so that
+    merge_operations can join them (e.g. one distribute per plate from the same mastermix tube).'''
+    shared = []
+    for op in operations:
+        tip = op.tip
+        if tip is None:
+            previous = shared[-1] if shared else None
+            if previous is not None and previous.source == op.source and previous.tip.startswith('fresh '):
+                tip = previous.tip
+            else:
+                tip = f'fresh {op.source} {len(shared)}'
+        shared.append(Operation(op.source, op.volumes, op.dests, tip, op.capacity, op.disposal_volume, op.label))
+    return shared
+
+
+def report(name: str, operations: list, engine_before: bool = False, engine_after: bool = False):
+    before = count(operations, engine_before)
+    merged = merge_operations(shared_tips(operations))
+    after = count(merged, engine_after)
+    print(f'{name}: {len(operations)} operations -> {len(merged)}')
+    print(f'  before: {before}')
+    print(f'  after:  {after}')
+    print(f'  removed {before.aspirations - after.aspirations} aspirations, {before.blowouts - after.blowouts} blowouts, '
+          f'{before.tips - after.tips} tips; {before.blown_out - after.blown_out:.1f} µL less disposal volume blown out')
+
+
+if __name__ == '__main__':
+    from planning.pipettes import PIPETTES
+
+    p20, p300 = PIPETTES['p20_single_gen2'], PIPETTES['p300_single_gen2']
+
+    # YFV_6x6_ProbeScreen.py: primer mix i into rows i, i+4, i+8 (18 wells each), 2 µL, one p20 tip per mix;
+    # the probe step is one call per probe already
+    ops = []
+    for i in range(4):
+        for row in (i, i + 4, i + 8):
+            ops.append(Operation(f'A{i + 1}', [2] * 18, [k*16 + row for k in range(18)], tip=f'primer mix {i + 1}',
+                                 capacity=p20['max'], disposal_volume=p20['min'], label=f'row {"ABCDEFGHIJKL"[row]}'))
+    report('YFV_6x6_ProbeScreen.py, primer mixes', ops, engine_after=True)
+
+    # ARC_MM_Plating.py (dev): 92 wells per plate, 10 µL, one distribute (and tip) per plate
+    arc_wells = [n for n in range(96) if (n % 8 != 2) or (n < 64)]
+    for plates in (2, 4):
+        ops = [Operation('A1', [10] * len(arc_wells), arc_wells, capacity=p300['max'], disposal_volume=10,
+                         label=f'plate {p + 1}') for p in range(plates)]
+        report(f'ARC_MM_Plating.py, {plates} plates', ops)
+
+    # Freetown_Mastermix_Plating_96well.py: 96 wells per plate, 10 µL from a 5 mL tube (5 plates per tube)
+    for plates in (4, 9):
+        ops = [Operation('A1' if p < 5 else 'B1', [10] * 96, list(range(96)), capacity=p300['max'], disposal_volume=10,
+                         label=f'plate {p + 1}') for p in range(plates)]
+        report(f'Freetown_Mastermix_Plating_96well.py, {plates} plates, 5 mL tubes', ops)
@@ -0,0 +1,250 @@
+'''
+Dispense ordering
+
+`distribute` visits its destination wells in the order they are listed, and the lists in the plating
+protocols come out of index arithmetic - e.g. `list(range(i, num_primers*48, 16))` in
+PrimerEval_PlatePrimers_Custom.py sweeps a row left to right, then jumps back to the left end of
+the next row. This module computes gantry travel for a distribute from real well positions
+(labware definitions placed on the OT-2 deck definition) and reorders the destinations to shorten it.
+
+Travel model: a legacy `distribute` fills the tip with as many dispenses as fit (pipette max
+minus disposal volume), so each trip is source -> its wells in order -> trash (blowout of the
+disposal volume) -> back to the source. Moves are straight lines in x/y; heights are ignored.
+
+Orderings compared for each well list:
+
+* `serpentine` - rows (or columns) in turn, reversing direction on every other one, starting from
+  the corner nearest the source; the shorter of the row-wise and column-wise versions.
+* `nearest_neighbour` - greedy tour from the source, then 2-opt improvement of each trip with its
+  start (source) and end (trash) fixed.
+
+`best_order` keeps the shortest of the original order and these, so a list that is already
+good is left alone.
+
+Usage (from the dev folder):
+
+    python -m planning.routing
+'''
+
+from dataclasses import dataclass
+import math
+
+from planning.labware import load_definition
+
+
+TRASH = 'fixedTrash'
+GANTRY_SPEED = 400.0    # mm/s, OT-2 default x/y speed
+
+
+def _deck():
+    from opentrons_shared_data.deck import load
+    return load('ot2_standard', 5)
+
+
+def slot_origin(slot) -> tuple:
+    '''Front left corner (x, y) of a deck slot, in deck coordinates (mm).'''
+    deck = _deck()
+    cutouts = {c['id']: c['position'] for c in deck['locations']['cutouts']}
+    area = next(a for a in deck['locations']['addressableAreas'] if a['id'] == str(slot))
+    x, y, _ = cutouts[f'cutout{slot}']
+    dx, dy, _ = area['offsetFromCutoutFixture']
+    return x + dx, y + dy
+
+
+def trash_point() -> tuple:
+    '''Centre (x, y) of the fixed trash in slot 12.'''
+    deck = _deck()
+    cutouts = {c['id']: c['position'] for c in deck['locations']['cutouts']}
+    area = next(a for a in deck['locations']['addressableAreas'] if a['id'] == TRASH)
+    x, y, _ = cutouts['cutout12']
+    dx, dy, _ = area['offsetFromCutoutFixture']
+    return (x + dx + area['boundingBox']['xDimension'] / 2,
+            y + dy + area['boundingBox']['yDimension'] / 2)
+
+
+@dataclass
+class PlacedLabware:
+    '''A labware definition on a deck slot, for looking up well positions.'''
+    load_name: str
+    slot: int
+
+    def __post_init__(self):
+        self.definition = load_definition(self.load_name)
+        self.origin = slot_origin(self.slot)
+        self.order = [name for column in self.definition['ordering'] for name in column]
+
+    def wells(self) -> list:
+        '''Well names in `labware.wells()` order (column by column).'''
+        return list(self.order)
+
+    def point(self, well) -> tuple:
+        '''Deck (x, y) of a well, by name or by index into wells().'''
+        name = self.order[well] if isinstance(well, int) else well
+        info = self.definition['wells'][name]
+        return self.origin[0] + info['x'], self.origin[1] + info['y']
+
+
+def distance(a: tuple, b: tuple) -> float:
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def path_length(points: list) -> float:
+    return sum(distance(p, q) for p, q in zip(points, points[1:]))
+
+
+def dispenses_per_trip(volume: float, max_volume: float, disposal_volume: float) -> int:
+    '''Dispenses per aspiration in a legacy distribute.'''
+    return max(1, int((max_volume - disposal_volume) // volume + 1e-9))
+
+
+def trips(points: list, per_trip: int) -> list:
+    return [points[i:i + per_trip] for i in range(0, len(points), per_trip)]
+
+
+def distribute_travel(source: tuple, points: list, per_trip: int, blowout: tuple = None) -> float:
+    '''Gantry travel (mm) of a distribute from source to points, in order.
+    blowout: where the disposal volume goes after each trip (trash by default; the source for
+    blowout_location='source well').'''
+    blowout = blowout or trash_point()
+    total = 0.0
+    position = source
+    for trip in trips(points, per_trip):
+        total += path_length([position] + trip + [blowout])
+        position = blowout
+        if blowout != source:
+            total += distance(blowout, source)
+            position = source
+    return total
+
+
+def serpentine(points: list, source: tuple) -> list:
+    '''Indices of points in boustrophedon order: by rows or by columns (whichever is shorter),
+    starting from the corner nearest the source.'''
+    best = None
+    for major in (1, 0):           # rows (same y), then columns (same x)
+        minor = 1 - major
+        lines = {}
+        for i, p in enumerate(points):
+            lines.setdefault(round(p[major], 1), []).append(i)
+        for reverse_lines in (False, True):
+            for reverse_first in (False, True):
+                order = []
+                keys = sorted(lines, reverse=reverse_lines)
+                for n, key in enumerate(keys):
+                    line = sorted(lines[key], key=lambda i: points[i][minor])
+                    if (n % 2 == 1) != reverse_first:
+                        line.reverse()
+                    order += line
+                length = distance(source, points[order[0]]) + path_length([points[i] for i in order])
+                if best is None or length < best[0]:
+                    best = (length, order)
+    return best[1]
+
+
+def _two_opt(route: list, start: tuple, end: tuple) -> list:
+    '''2-opt on one trip (points in order), with fixed start and end.'''
+    route = list(route)
+    improved = True
+    while improved:
+        improved = False
+        full = [start] + route + [end]
+        for i in range(1, len(full) - 2):
+            for j in range(i + 1, len(full) - 1):
+                before = distance(full[i - 1], full[i]) + distance(full[j], full[j + 1])
+                after = distance(full[i - 1], full[j]) + distance(full[i], full[j + 1])
+                if after < before - 1e-6:
+                    full[i:j + 1] = reversed(full[i:j + 1])
+                    improved = True
+        route = full[1:-1]
+    return route
+
+
+def nearest_neighbour(points: list, source: tuple, per_trip: int, blowout: tuple = None) -> list:
+    '''Indices of points as a greedy tour from the source, each trip then improved by 2-opt.'''
+    blowout = blowout or trash_point()
+    remaining = set(range(len(points)))
+    order = []
+    position = source
+    while remaining:
+        nearest = min(remaining, key=lambda i: (distance(position, points[i]), i))
+        order.append(nearest)
+        remaining.remove(nearest)
+        position = source if len(order) % per_trip == 0 else points[nearest]
+    improved = []
+    for trip in trips(order, per_trip):
+        lookup = {points[i]: i for i in trip}
+        improved += [lookup[p] for p in _two_opt([points[i] for i in trip], source, blowout)]
+    return improved
+
+
+def best_order(points: list, source: tuple, per_trip: int, blowout: tuple = None) -> tuple:
+    '''(method name, index order) with the least distribute travel; 'original' if nothing is shorter.'''
+    candidates = {
+        'original': list(range(len(points))),
+        'serpentine': serpentine(points, source),
+        'nearest neighbour': nearest_neighbour(points, source, per_trip, blowout),
+    }
+    return min(candidates.items(),
+               key=lambda item: distribute_travel(source, [points[i] for i in item[1]], per_trip, blowout))
+
+
+@dataclass
+class Distribute:
+    '''One multi-dispense: destination wells (indices into plate.wells()) from a source point.'''
+    label: str
+    source: tuple
+    wells: list
+    per_trip: int
+    blowout: tuple = None
+
+
+def report(name: str, plate: PlacedLabware, distributes: list):
+    total_before = total_after = 0.0
+    print(name)
+    for d in distributes:
+        points = [plate.point(w) for w in d.wells]
+        before = distribute_travel(d.source, points, d.per_trip, d.blowout)
+        method, order = best_order(points, d.source, d.per_trip, d.blowout)
+        after = distribute_travel(d.source, [points[i] for i in order], d.per_trip, d.blowout)
+        total_before += before
+        total_after += after
+        print(f'  {d.label:<24} {len(d.wells):3d} wells  {before:7.0f} mm -> {after:7.0f} mm  ({method})')
+    saved = total_before - total_after
+    print(f'  total {total_before:.0f} mm -> {total_after:.0f} mm (-{saved:.0f} mm, {100 * saved / total_before:.0f}%,'
+          f' about {saved / GANTRY_SPEED:.0f} s of travel)')
+
+
+if __name__ == '__main__':
+    from planning.pipettes import PIPETTES
+
+    plate384 = 'appliedbiosystemsmicroamp_384_wellplate_40ul'
+    tube_rack = 'opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap'
+    p20, p300 = PIPETTES['p20_single_gen2'], PIPETTES['p300_single_gen2']
+
+    # PrimerEval_PlatePrimers_Custom.py: plate in slot 2, primers in slot 5, 1.5 µL with the p20
+    # (default disposal volume = pipette minimum)
+    plate = PlacedLabware(plate384, 2)
+    primers = PlacedLabware(tube_rack, 5)
+    num_primers = 8
+    per_trip = dispenses_per_trip(1.5, p20['max'], p20['min'])
+    distributes = []
+    for i in range(num_primers):
+        wells = list(range(i, num_primers*48, 16)) + list(range(num_primers + i, num_primers*49, 16))
+        distributes.append(Distribute(f'forward primer {i + 1}', primers.point(i), wells, per_trip))
+    for i in range(num_primers):
+        wells = (list(range(i*48, i*48 + 2*num_primers)) + list(range(i*48 + 16, i*48 + 2*num_primers + 16))
+                 + list(range(i*48 + 32, i*48 + 2*num_primers + 32)))
+        distributes.append(Distribute(f'reverse primer {i + 1}', primers.point(i + 8), wells, per_trip))
+    report(f'PrimerEval_PlatePrimers_Custom.py ({num_primers} primers)', plate, distributes)
+
+    # LSP_Pools_12replicates.py: plate in slot 2, master mixes in slot 4, 10 µL with the p300, 10 µL disposal
+    rack = PlacedLabware(tube_rack, 4)
+    per_trip = dispenses_per_trip(10, p300['max'], 10)
+    distributes = []
+    tube_number = 0
+    for section_rows in range(3):
+        for section_columns in range(2):
+            tube_number += 1
+            wells = [section_rows*5 + section_columns*192 + col*16 + row for col in range(12) for row in range(5)]
+            distributes.append(Distribute(f'master mix {tube_number}', rack.point(f'A{tube_number}'), wells, per_trip))
+    report('LSP_Pools_12replicates.py', plate, distributes)
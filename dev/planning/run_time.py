@@ -0,0 +1,316 @@
+'''
+Run duration estimate
+
+The durations in the protocol headers ("Duration: 35 min", "DURATION: 20 min", "STEP 1: Forward
+primers (15 min)") were timed by hand on the robot and go stale as soon as a protocol changes.
+This module predicts them from a simulated run instead: every command in the run log is priced
+with a simple timing model, and the prices are summed per step and for the whole run.
+
+Timing model (OT-2, default speeds):
+
+* moves - from where the pipette is to the well the command names: straight up to the travel
+  height, across in x/y at the gantry speed (400 mm/s; the x axis may go up to 600 mm/s but the
+  vector speed is capped at 400), and down again, z at 125 mm/s. The travel height between labware
+  is the deck arc (arcs.py: 10 mm above the tallest item on the deck), within one labware 5 mm
+  above it. Aspirate and dispense go to 1 mm above the well bottom (the default clearance), tip
+  pick-up, blowout and touch tip to the top of the well, drops into the fixed trash to its top.
+* aspirate and dispense - volume / flow rate (the rate is in the log text).
+* tip pick-up 4 s, tip drop 10 s, blowout 0.5 s, touch tip 0.5 s - the hardware-timed figures of
+  the Opentrons duration estimator; delays as logged; homing a rough 10 s.
+* transfer, distribute and mix only group the aspirates and dispenses logged under them, so they
+  cost nothing themselves. Pauses wait for the user and are counted, not priced.
+
+Accelerations, plunger homing between aspirations and custom heights (`well.top(-3)`) are left
+out, so the estimate is a floor; it is meant for comparing versions of a protocol (--baseline),
+not for replacing a timed run.
+
+Steps are the numbered section comments in `run()` ("### 1. Transfer diluent",
+"# 1. FORWARD PRIMERS | 15 min", "# 1A. FORWARD PRIMERS - 422"); each command belongs to the step whose comment is the last one
+above the line of `run()` that issued it, and commands before the first one are setup. Stated
+durations are read from the step comments and the header (a "STEP n: ... (15 min)" line counts
+for step n).
+
+Usage (from the dev folder; requires the `opentrons` package):
+
+    python -m planning.run_time "../protocols/Freetown/Assay Development/PrimerEval_PlatePrimers_Custom.py"
+    python -m planning.run_time "../protocols/Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py" num_plates=4
+    python -m planning.run_time --baseline HEAD~1 "../protocols/Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py"
+'''
+
+import argparse
+import ast
+from dataclasses import dataclass, field
+import math
+import os
+import pathlib
+import re
+import sys
+import tempfile
+
+from planning.analysis_bench import file_at_revision
+from planning.arcs import _LOCATION, TRASH_HEIGHT, TRASH_SLOT, Z_SPEED, deck_arc, obstacles, simulate
+from planning.routing import GANTRY_SPEED, PlacedLabware, trash_point
+
+
+LABWARE_MARGIN = 5.0            # mm above the labware for moves within it
+WELL_CLEARANCE = 1.0            # mm above the well bottom for aspirate and dispense (API default)
+HOME_POINT = (418.0, 353.0)     # deck x, y of the pipettes when homed
+HOME_HEIGHT = 205.0             # mm, z when homed
+PICK_UP_TIP = 4.0               # s, hardware-timed (Opentrons duration estimator)
+DROP_TIP = 10.0
+BLOW_OUT = 0.5
+TOUCH_TIP = 0.5
+HOME = 10.0                     # s, rough
+
+_STEP = re.compile(r'^\s*#+\s*(\d+[A-Za-z]?)\.\s+(.*?)[\s#]*$')
+_MINUTES = re.compile(r'(\d+(?:\.\d+)?)\s*min')
+_STATED_TOTAL = re.compile(r'duration:?\**\s*(\d+(?:\.\d+)?)\s*min', re.I)
+_STATED_STEP = re.compile(r'STEP\s+(\d+)\b[^\n(]*\((\d+(?:\.\d+)?)\s*min\)', re.I)
+_VOLUME = re.compile(r'(\d+(?:\.\d+)?) uL .* at (\d+(?:\.\d+)?) uL/sec')
+_DELAY = re.compile(r'Delaying for (\d+) minutes and (\d+(?:\.\d+)?) seconds')
+SETUP = '(setup)'
+
+
+@dataclass
+class Estimate:
+    seconds: float = 0.0
+    kinds: dict = field(default_factory=lambda: {'moves': 0.0, 'liquid': 0.0, 'tips': 0.0, 'other': 0.0})
+    steps: dict = field(default_factory=dict)       # step -> [commands, seconds]
+    pauses: int = 0
+    travel: float = 0.0                             # mm, z and x/y
+
+    def add(self, step: str, kind: str, seconds: float):
+        self.seconds += seconds
+        self.kinds[kind] += seconds
+        self.steps[step][1] += seconds
+
+
+def steps(path: str) -> dict:
+    '''{line: step title} of the numbered section comments in run().'''
+    with open(path, encoding='utf-8') as protocol_file:
+        source = protocol_file.read()
+    run = next(node for node in ast.parse(source).body if isinstance(node, ast.FunctionDef) and node.name == 'run')
+    lines = source.splitlines()
+    headers = {}
+    for number in range(run.lineno, run.end_lineno + 1):
+        match = _STEP.match(lines[number - 1])
+        if match:
+            headers[number] = f'{match.group(1)}. {match.group(2)}'
+    return headers
+
+
+def stated(path: str, titles: list) -> tuple:
+    '''(stated total in minutes or None, {step title: stated minutes}) from the header and step comments.'''
+    with open(path, encoding='utf-8') as protocol_file:
+        source = protocol_file.read()
+    total = _STATED_TOTAL.search(source)
+    by_number = {int(number): float(minutes) for number, minutes in _STATED_STEP.findall(source)}
+    per_step = {}
+    for title in titles:
+        if title == SETUP:
+            continue
+        number, name = title.split('.', 1)
+        match = _MINUTES.search(name)
+        if match:
+            per_step[title] = float(match.group(1))
+        elif number.isdigit() and int(number) in by_number:
+            per_step[title] = by_number[int(number)]
+    return (float(total.group(1)) if total else None), per_step
+
+
+def line_of_run(path: str):
+    '''The line of the protocol's run() being executed (called from inside a command), or None.'''
+    frame = sys._getframe(1)
+    while frame:
+        if frame.f_code.co_name == 'run' and os.path.abspath(frame.f_code.co_filename) == path:
+            return frame.f_lineno
+        frame = frame.f_back
+    return None
+
+
+def trace(path: str, **params) -> tuple:
+    '''Simulate a protocol, recording the line of run() that issued each command.
+    Returns (layout, command texts, [line of run() or None for each command]).'''
+    from opentrons.legacy_commands import types as command_types
+
+    path = os.path.abspath(path)
+    issued = []
+
+    def on_command(message):
+        # the same filter as ProtocolContext's own command log, so the lists line up
+        payload = message.get('payload')
+        if message['$'] == 'before' and payload is not None and payload.get('text') is not None:
+            issued.append(line_of_run(path))
+
+    def subscribe(context):
+        context.broker.subscribe(command_types.COMMAND, on_command)
+
+    layout, commands = simulate(path, before_run=subscribe, **params)
+    return layout, commands, issued
+
+
+class Deck:
+    '''Well positions and travel heights of a simulated run's layout.'''
+
+    def __init__(self, layout: dict):
+        self.placed = {slot: PlacedLabware(load_name, slot) for slot, load_name in layout.items()}
+        self.arc, _ = deck_arc(obstacles(layout))
+        self.trash = trash_point()
+
+    def position(self, text: str, depth: str) -> tuple:
+        '''(x, y, z, slot) the command goes to, or None; depth is 'bottom' or 'top' of the well.'''
+        match = _LOCATION.search(text)
+        if not match:
+            return None
+        well, slot = match.group(1), int(match.group(2))
+        if slot == TRASH_SLOT:
+            return (*self.trash, TRASH_HEIGHT, slot)
+        if slot not in self.placed or not well:
+            return None
+        info = self.placed[slot].definition['wells'][well]
+        z = info['z'] + (WELL_CLEARANCE if depth == 'bottom' else info['depth'])
+        return (*self.placed[slot].point(well), z, slot)
+
+    def height(self, slot) -> float:
+        if slot == TRASH_SLOT:
+            return TRASH_HEIGHT
+        return self.placed[slot].definition['dimensions']['zDimension']
+
+    def path(self, start: tuple, end: tuple) -> tuple:
+        '''(z, x/y) distance in mm from start to end: up to the travel height, across, down.'''
+        if start[3] == end[3]:
+            travel = self.height(end[3]) + LABWARE_MARGIN
+        else:
+            travel = self.arc
+        travel = max(travel, start[2], end[2])
+        return travel - start[2] + travel - end[2], math.dist(start[:2], end[:2])
+
+    def move(self, start: tuple, end: tuple) -> float:
+        '''Seconds to move from start to end.'''
+        z, across = self.path(start, end)
+        return z / Z_SPEED + across / GANTRY_SPEED
+
+
+_DEPTHS = {'Aspirating': 'bottom', 'Dispensing': 'bottom', 'Picking up tip': 'top', 'Dropping tip': 'top',
+           'Blowing out': 'top'}
+_FIXED = {'Picking up tip': ('tips', PICK_UP_TIP), 'Dropping tip': ('tips', DROP_TIP),
+          'Blowing out': ('other', BLOW_OUT), 'Touching tip': ('other', TOUCH_TIP)}
+
+
+def costs(layout: dict, commands: list) -> list:
+    '''(move seconds, travel mm, kind, seconds) of each command: the move to where it works, then the action
+    itself (kind None if it costs nothing, 'pause' for a pause).'''
+    deck = Deck(layout)
+    here = (*HOME_POINT, HOME_HEIGHT, None)
+    priced = []
+    for text in commands:
+        text = text.strip()
+        move, travel = 0.0, 0.0
+        command = next((name for name in _DEPTHS if text.startswith(name)), None)
+        if command:
+            target = deck.position(text, _DEPTHS[command])
+            if target:
+                move, travel = deck.move(here, target), sum(deck.path(here, target))
+                here = target
+        kind, seconds = None, 0.0
+        if text.startswith(('Aspirating', 'Dispensing')):
+            match = _VOLUME.search(text)
+            if match and float(match.group(2)) > 0:
+                kind, seconds = 'liquid', float(match.group(1)) / float(match.group(2))
+        elif text.startswith(tuple(_FIXED)):
+            kind, seconds = next(_FIXED[name] for name in _FIXED if text.startswith(name))
+        elif text.startswith('Delaying'):
+            match = _DELAY.search(text)
+            if match:
+                kind, seconds = 'other', 60 * int(match.group(1)) + float(match.group(2))
+        elif text.startswith('Homing'):
+            kind, seconds = 'other', HOME
+            here = (*HOME_POINT, HOME_HEIGHT, None)
+        elif text.startswith('Pausing'):
+            kind = 'pause'
+        priced.append((move, travel, kind, seconds))
+    return priced
+
+
+def step_of(line, headers: dict) -> str:
+    '''The step a line of run() belongs to: the last numbered section comment above it.'''
+    above = [number for number in headers if line is not None and number <= line]
+    return headers[max(above)] if above else SETUP
+
+
+def estimate(layout: dict, commands: list, issued: list, headers: dict) -> Estimate:
+    '''Price every command of a run and sum per step (see the module docstring).'''
+    result = Estimate()
+    for (move, travel, kind, seconds), line in zip(costs(layout, commands), issued):
+        step = step_of(line, headers)
+        result.steps.setdefault(step, [0, 0.0])[0] += 1
+        result.add(step, 'moves', move)
+        result.travel += travel
+        if kind == 'pause':
+            result.pauses += 1
+        elif kind:
+            result.add(step, kind, seconds)
+    return result
+
+
+def estimate_file(path: str, **params) -> tuple:
+    '''(Estimate, stated total in minutes or None, {step: stated minutes}) for one protocol.'''
+    layout, commands, issued = trace(path, **params)
+    result = estimate(layout, commands, issued, steps(path))
+    total, per_step = stated(path, list(result.steps))
+    return result, total, per_step
+
+
+def _minutes(seconds) -> str:
+    return '-' if seconds is None else f'{seconds / 60:.1f}'
+
+
+def _parameter(text: str) -> tuple:
+    name, _, value = text.partition('=')
+    for kind in (int, float):
+        try:
+            return name, kind(value)
+        except ValueError:
+            pass
+    return name, {'True': True, 'False': False}.get(value, value)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Predict protocol run durations from a simulated run.')
+    parser.add_argument('protocol', help='protocol file')
+    parser.add_argument('parameters', nargs='*', help='runtime parameters, as name=value')
+    parser.add_argument('--baseline', help='git revision to compare with (the same protocol at that revision)')
+    args = parser.parse_args(argv)
+
+    params = dict(_parameter(text) for text in args.parameters)
+    result, total, per_step = estimate_file(args.protocol, **params)
+    before = None
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as directory:
+            old = file_at_revision(pathlib.Path(args.protocol), args.baseline, directory)
+            if old is None:
+                print(f'{args.protocol} did not exist at {args.baseline}', file=sys.stderr)
+                return 1
+            before, _, _ = estimate_file(str(old), **params)
+
+    print(f'{os.path.basename(args.protocol)}' + (f' ({", ".join(args.parameters)})' if args.parameters else ''))
+    header = f"  {'step':<48} {'commands':>8} {'predicted':>10} {'stated':>7}"
+    print(header + (f" {args.baseline:>10}" if before else '') + '   (minutes)')
+    for step, (count, seconds) in result.steps.items():
+        stated_minutes = per_step.get(step)
+        line = f'  {step[:48]:<48} {count:8d} {_minutes(seconds):>10} {"-" if stated_minutes is None else f"{stated_minutes:g}":>7}'
+        if before:
+            line += f' {_minutes(before.steps.get(step, [0, None])[1]):>10}'
+        print(line)
+    line = f"  {'total':<48} {sum(count for count, _ in result.steps.values()):8d} {_minutes(result.seconds):>10} " \
+           f"{'-' if total is None else f'{total:g}':>7}"
+    if before:
+        line += f' {_minutes(before.seconds):>10}'
+    print(line)
+    print('  ' + ', '.join(f'{kind} {_minutes(seconds)}' for kind, seconds in result.kinds.items()) + ' min'
+          + (f'; {result.pauses} pause(s) for the user not counted' if result.pauses else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+'''
+Multi-plate scaling
+
+How the standard curve protocol (StdCurve_Dil_Plate.py) lays out a run for N plates: how many
+dilution plates are needed, which tube size each dilution step is made in (1.5 mL, 5 mL or 25 mL,
+the smallest that holds it), and how many 5 mL diluent tubes to prepare. The same rules are
+carried by the protocol itself (`choose_tube`, `split_sources`); this module plans any number of
+plates at once, so the lab can see what a week's worth of plates needs before setting up the deck.
+
+Plating directly into qPCR plates (the protocol's "Direct to qPCR plates" option) needs no dilution
+plate and no excess volume per well; `compare_direct` gives the RNA stock and hands-on time that
+saves against splitting a dilution plate by hand.
+
+Usage (from the dev folder):
+
+    python -m planning.scaling
+    python -m planning.scaling 6 12 24
+'''
+
+from dataclasses import dataclass
+import math
+import sys
+
+from planning.dilution import plan_dilutions
+from planning.labware import load_definition
+
+
+# dilution tube types, smallest first (as in StdCurve_Dil_Plate.py)
+TUBE_RACKS = ['opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap',
+              'usascientific_15_tuberack_5000ul',
+              'opentrons_6_tuberack_25ml']
+DILUTION_PLATE = 'abs_96well_100ul'
+DILUENT_DEAD_VOL = 200
+STOCK_OVERAGE = 20
+DILUTION_PLATE_SLOTS = [2, 5, 7, 8]
+QPCR_PLATE_SLOTS = [2, 5, 7, 8, 10, 11]
+MANUAL_COLUMN_TIME = 20     # s per column moved from a dilution plate to a qPCR plate with a multichannel
+
+
+def capacity(load_name: str) -> float:
+    '''Rated volume (µL) of the first well of a labware.'''
+    definition = load_definition(load_name)
+    return float(definition['wells'][definition['ordering'][0][0]]['totalLiquidVolume'])
+
+
+def choose_tube(vol: float, capacities: list) -> int:
+    '''Index of the smallest tube type that holds vol.'''
+    for t, cap in enumerate(capacities):
+        if vol <= cap:
+            return t
+    raise ValueError(f'{vol} µL is more than the largest tube holds')
+
+
+def split_sources(vols: list, capacity: float, dead_vol: float) -> list:
+    '''Draw volumes from as few source tubes as possible (same rule as the protocol): a volume that
+    doesn't fit in what's left of the current tube starts a new one; only volumes larger than a whole
+    tube are split. Returns one list of (index into vols, volume) per source tube.'''
+    usable = capacity - dead_vol
+    sources = [[]]
+    remaining = usable
+    for i, vol in enumerate(vols):
+        if vol > remaining and remaining < usable:
+            sources.append([])
+            remaining = usable
+        while vol > 0:
+            if remaining <= 0:
+                sources.append([])
+                remaining = usable
+            part = min(vol, remaining)
+            sources[-1].append((i, part))
+            remaining -= part
+            vol -= part
+    return sources
+
+
+@dataclass
+class ScaledRun:
+    num_plates: int
+    dilution_plates: int
+    tube_types: list        # rack load name for each dilution step
+    tube_volumes: list      # µL prepared in each dilution step
+    diluent_tubes: list     # µL to load in each 5 mL diluent tube
+    negative_vol: float     # µL of kit negative needed
+    direct: bool = False    # plated straight into the qPCR plates
+
+    @property
+    def fits_deck(self) -> bool:
+        if self.direct:
+            return self.num_plates <= len(QPCR_PLATE_SLOTS)
+        return self.dilution_plates <= len(DILUTION_PLATE_SLOTS)
+
+
+def scale_run(num_plates: int, copies_per_well: list, wells_per_dilution: list, vol_per_well: float = 10,
+              negative_from_diluent: bool = False, direct: bool = False) -> ScaledRun:
+    '''Layout of a standard curve run for num_plates plates (excess volume as in the protocol: 0 for one plate
+    or when plating directly into the qPCR plates, else 5 µL).'''
+    excess_vol = 0 if num_plates == 1 or direct else 5
+    per_plate_vol = vol_per_well + excess_vol
+    plates_per_dil_plate = int(capacity(DILUTION_PLATE) // per_plate_vol)
+    vols = plan_dilutions(vol_per_well, copies_per_well, wells_per_dilution, num_plates=num_plates,
+                          excess_vol=excess_vol).series()
+
+    capacities = [capacity(rack) for rack in TUBE_RACKS]
+    totals = [rna + dil for rna, dil in zip(vols['rna'], vols['dil'])]
+    totals[0] += STOCK_OVERAGE
+    types = [TUBE_RACKS[choose_tube(vol, capacities)] for vol in totals]
+
+    negative_vol = 4 * per_plate_vol * num_plates
+    demands = list(vols['dil']) + ([negative_vol] if negative_from_diluent else [])
+    sources = split_sources(demands, capacities[1], DILUENT_DEAD_VOL)
+    diluent = [DILUENT_DEAD_VOL + math.ceil(sum(vol for _, vol in source) / 10) * 10 for source in sources]
+
+    return ScaledRun(num_plates, 0 if direct else math.ceil(num_plates / plates_per_dil_plate), types, totals, diluent,
+                     0.0 if negative_from_diluent else negative_vol + STOCK_OVERAGE, direct)
+
+
+def compare_direct(num_plates: int, copies_per_well: list, wells_per_dilution: list, plate_columns: int = 8,
+                   vol_per_well: float = 10) -> dict:
+    '''RNA stock, kit negative and hands-on time of plating directly into num_plates qPCR plates,
+    against plating into dilution plates and splitting them by hand (plate_columns columns per qPCR plate).'''
+    via_plate = scale_run(num_plates, copies_per_well, wells_per_dilution, vol_per_well)
+    direct = scale_run(num_plates, copies_per_well, wells_per_dilution, vol_per_well, direct=True)
+    return {'stock': (via_plate.tube_volumes[0], direct.tube_volumes[0]),
+            'negative': (via_plate.negative_vol, direct.negative_vol),
+            'hands_on': (num_plates * plate_columns * MANUAL_COLUMN_TIME, 0.0),
+            'fits_deck': direct.fits_deck}
+
+
+if __name__ == '__main__':
+    copies_per_well =    [1*10**7, 1*10**6, 1*10**5, 1*10**4, 1000, 200, 100, 20, 10, 5]
+    wells_per_dilution = [      3,       3,       3,       3,    6,   6,   8,  8,  8, 8]
+    short = {TUBE_RACKS[0]: '1.5', TUBE_RACKS[1]: '5', TUBE_RACKS[2]: '25'}
+
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 2, 4, 6, 8, 12, 18, 24, 30]
+    print(f"{'plates':>6} {'dil. plates':>11}  {'tube size per step (mL)':<40} {'diluent tubes (µL)':<36} deck")
+    for n in counts:
+        run = scale_run(n, copies_per_well, wells_per_dilution)
+        print(f"{n:>6} {run.dilution_plates:>11}  {' '.join(short[t] for t in run.tube_types):<40} "
+              f"{' '.join(f'{v:g}' for v in run.diluent_tubes):<36} {'ok' if run.fits_deck else 'too many plates'}")
+
+    print("\nDirect to qPCR plates (no dilution plate, no excess) against a dilution plate split by hand:")
+    print(f"{'plates':>6} {'RNA stock (µL)':>16} {'kit negative (µL)':>19} {'hands-on saved':>15}  deck")
+    for n in counts:
+        saved = compare_direct(n, copies_per_well, wells_per_dilution)
+        stock, negative = saved['stock'], saved['negative']
+        print(f"{n:>6} {stock[0]:>7g} -> {stock[1]:<6g} {negative[0]:>8g} -> {negative[1]:<8g} {saved['hands_on'][0] / 60:>11.0f} min  "
+              f"{'ok' if saved['fits_deck'] else 'too many plates'}")
@@ -0,0 +1,215 @@
+'''
+Simulation sweep
+
+Simulates every protocol in the repository - protocols/, the scripts in dev/ and dev/archived, and
+the labware test_*.py scripts - for every combination of its runtime parameters, the way the app
+would analyze them after each change of a setting. A protocol's `add_parameters` is run against a
+parameter context and each parameter is expanded into the values to try:
+
+* choices (str, int or float parameters, and bool on/off) - every choice;
+* an int range - every value, or an evenly spaced selection of --max-values values (always
+  including the minimum, default and maximum) when the range is longer;
+* a float range - the minimum, default and maximum.
+
+CSV file parameters keep their default (no file). Protocols without parameters are simulated once.
+Each run is simulated in a process pool (one protocol and parameter set per task), and the results
+table - commands, tip pick-ups, aspirations, dispenses and simulation time per run, or the error
+it failed with - is written as a CSV file. A run that doesn't finish within --timeout seconds is
+stopped and reported as a failure (on Linux and macOS; Windows has no alarm signal to stop it with).
+
+Usage (from the dev folder; requires the `opentrons` package):
+
+    python -m planning.simulation_sweep
+    python -m planning.simulation_sweep --jobs 8 --output sweep.csv
+    python -m planning.simulation_sweep "../protocols/Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py"
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import os
+import pathlib
+import signal
+import sys
+import time
+
+from planning.analysis_bench import LABWARE_ROOT, REPO_ROOT, _short_error, find_protocols, labware_dirs
+
+
+MAX_VALUES = 8      # values tried for an int range (evenly spaced, including minimum, default and maximum)
+TIMEOUT = 300       # s per run
+RESULT_FIELDS = ['protocol', 'parameters', 'status', 'commands', 'tips', 'aspirations', 'dispenses', 'seconds', 'error']
+
+
+def discover(roots: tuple = (REPO_ROOT / 'protocols', REPO_ROOT / 'dev', LABWARE_ROOT)) -> list:
+    '''Every protocol file under the roots (the planning tools themselves are left out).'''
+    planning = pathlib.Path(__file__).resolve().parent
+    return [path for root in roots for path in find_protocols(root) if planning not in path.resolve().parents]
+
+
+def _load(path) -> object:
+    spec = importlib.util.spec_from_file_location('protocol', path)
+    module = importlib.util.module_from_spec(spec)
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.stdout = stdout
+    return module
+
+
+def parameter_values(definition, max_values: int = MAX_VALUES) -> list:
+    '''The values to simulate for one parameter definition (see the module docstring).'''
+    choices = getattr(definition, '_choices', None)
+    if choices:
+        return [choice['value'] for choice in choices]
+    minimum, maximum = getattr(definition, '_minimum', None), getattr(definition, '_maximum', None)
+    default = definition._default if hasattr(definition, '_default') else None
+    if minimum is None or maximum is None:
+        return [default]
+    if definition._type is int:
+        if maximum - minimum + 1 <= max_values:
+            return list(range(minimum, maximum + 1))
+        step = (maximum - minimum) / (max_values - 1)
+        return sorted({minimum + round(k * step) for k in range(max_values)} | {default})
+    return sorted({minimum, default, maximum})
+
+
+def parameter_space(path, max_values: int = MAX_VALUES) -> dict:
+    '''{variable name: values to simulate} for a protocol; {} if it has no runtime parameters.'''
+    from opentrons.protocol_api._parameter_context import ParameterContext
+    from opentrons.protocols.api_support.types import APIVersion
+
+    module = _load(path)
+    if not hasattr(module, 'add_parameters'):
+        return {}
+    parameters = ParameterContext(APIVersion.from_string(module.metadata['apiLevel']))
+    module.add_parameters(parameters)
+    return {name: parameter_values(definition, max_values) for name, definition in parameters._parameters.items()}
+
+
+def combinations(space: dict) -> list:
+    '''Every combination of the parameter values, as {variable name: value}.'''
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def _timed_out(signum, frame):
+    raise TimeoutError('simulation did not finish (stopped after the run timeout)')
+
+
+def simulate_run(path: str, params: dict, timeout: int = TIMEOUT) -> dict:
+    '''Simulate one protocol with one parameter set (run in a worker process). Returns a row of the results table.'''
+    from opentrons import simulate as opentrons_simulate
+    from planning.arcs import simulate
+
+    logging.disable(logging.CRITICAL)
+    row = {'protocol': os.path.relpath(path, REPO_ROOT), 'parameters': json.dumps(params), 'status': 'ok',
+           'commands': None, 'tips': None, 'aspirations': None, 'dispenses': None, 'seconds': None, 'error': ''}
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()  # protocols and the simulator print as they go
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _timed_out)
+        signal.alarm(timeout)
+    try:
+        start = time.perf_counter()
+        if params:
+            _, commands = simulate(path, **params)
+        else:
+            # the app's analysis path - it also accepts labware definitions a script embeds itself
+            # (get_protocol_api rejects those when a custom definition with the same load name is loaded)
+            with open(path, 'rb') as protocol_file:
+                log, _ = opentrons_simulate.simulate(protocol_file, os.path.basename(path), custom_labware_paths=labware_dirs())
+            commands = [entry['payload']['text'] for entry in log]
+        row['seconds'] = round(time.perf_counter() - start, 2)
+        texts = [text.strip() for text in commands]
+        row['commands'] = len(texts)
+        row['tips'] = sum(text.startswith('Picking up tip') for text in texts)
+        row['aspirations'] = sum(text.startswith('Aspirating') for text in texts)
+        row['dispenses'] = sum(text.startswith('Dispensing') for text in texts)
+    except Exception as error:
+        row['status'] = 'error'
+        row['error'] = _short_error(error)
+    finally:
+        if hasattr(signal, 'SIGALRM'):
+            signal.alarm(0)
+        sys.stdout = stdout
+    return row
+
+
+def sweep(paths: list, jobs: int = None, max_values: int = MAX_VALUES, timeout: int = TIMEOUT) -> list:
+    '''Simulate every parameter combination of every protocol in a process pool; rows in protocol and combination order.'''
+    tasks, rows = [], []
+    for path in paths:
+        try:
+            runs = combinations(parameter_space(path, max_values))
+        except Exception as error:
+            rows.append({'protocol': os.path.relpath(path, REPO_ROOT), 'parameters': '', 'status': 'error',
+                         'error': f'add_parameters: {_short_error(error)}'})
+            continue
+        tasks += [(str(path), params) for params in runs]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(simulate_run, path, params, timeout): n for n, (path, params) in enumerate(tasks)}
+        results = [None] * len(tasks)
+        for done, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            print(f'\r{done}/{len(tasks)} runs simulated', end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+    return rows + results
+
+
+def write_results(rows: list, path: str):
+    with open(path, 'w', newline='', encoding='utf-8') as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({field: row.get(field) for field in RESULT_FIELDS})
+
+
+def _span(values: list) -> str:
+    values = [value for value in values if value is not None]
+    if not values:
+        return '-'
+    return f'{min(values)}' if min(values) == max(values) else f'{min(values)}-{max(values)}'
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Simulate every protocol for every combination of its runtime parameters.')
+    parser.add_argument('protocols', nargs='*', help='protocol files (default: protocols/, dev/ and the labware test scripts)')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--max-values', type=int, default=MAX_VALUES, help='values tried for an int range')
+    parser.add_argument('--timeout', type=int, default=TIMEOUT, help='seconds before a run is stopped')
+    parser.add_argument('--output', default='simulation_results.csv', help='results table (CSV)')
+    args = parser.parse_args(argv)
+
+    paths = [pathlib.Path(p).resolve() for p in args.protocols] or discover()
+    rows = sweep(paths, args.jobs, args.max_values, args.timeout)
+    write_results(rows, args.output)
+
+    print(f"{'protocol':<60} {'runs':>5} {'failed':>6} {'commands':>10} {'tips':>8}")
+    by_protocol = {}
+    for row in rows:
+        by_protocol.setdefault(row['protocol'], []).append(row)
+    for protocol, runs in by_protocol.items():
+        failed = sum(row['status'] != 'ok' for row in runs)
+        print(f"{os.path.basename(protocol):<60} {len(runs):>5} {failed:>6} "
+              f"{_span([row.get('commands') for row in runs]):>10} {_span([row.get('tips') for row in runs]):>8}")
+    # failures grouped by protocol and error, with the first parameter set that hit each
+    failures = [row for row in rows if row['status'] != 'ok']
+    grouped = {}
+    for row in failures:
+        grouped.setdefault((row['protocol'], row['error']), []).append(row['parameters'])
+    for (protocol, error), parameters in grouped.items():
+        print(f"  ! {os.path.basename(protocol)}: {error} ({len(parameters)} run(s), e.g. {parameters[0] or 'defaults'})")
+    print(f'\n{len(rows)} runs, {len(failures)} failed - results in {args.output}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+'''
+Run timeline
+
+The totals from run_time.py say how long a run should take, not where the time goes. This module
+lays a simulated run out on a timeline and writes it as Chrome trace-event JSON, which opens in
+https://ui.perfetto.dev or chrome://tracing:
+
+* a `steps` track with one span per step (the numbered section comments in `run()`);
+* a track per mount (e.g. `left: p20_single_gen2`) with every command of that pipette, nested as
+  the API issues them - a distribute or transfer spans its aspirates, dispenses, blowouts and tip
+  changes, and each of those starts with its move (e.g. `move to slot 2`);
+* a `protocol` track for commands without a pipette - delays, homing, pauses and comments
+  (pauses and comments as instant markers).
+
+Durations are the run_time.py timing model (moves, volume over flow rate, fixed tip and blowout
+times), laid end to end: the robot does one thing at a time, so a command starts when the one
+before it has finished. Event arguments carry the log text, the move and action seconds and the
+travel in mm.
+
+Usage (from the dev folder; requires the `opentrons` package):
+
+    python -m planning.timeline archived/VariousPrimers/VariousPrimers_v3.1_2.14.py
+    python -m planning.timeline "../protocols/Freetown/Performance Verification - 2025/StdCurve_Dil_Plate.py" num_plates=4 --output stdcurve.json
+'''
+
+import argparse
+from dataclasses import dataclass
+import json
+import os
+import re
+import sys
+
+from planning.arcs import simulate
+from planning.run_time import _parameter, costs, line_of_run, step_of, steps
+
+
+PROTOCOL_TRACK = 'protocol'
+
+
+@dataclass
+class Command:
+    text: str
+    track: str          # 'left: p20_single_gen2', or PROTOCOL_TRACK
+    line: int           # line of run() that issued it, or None
+    children: int = 0
+
+
+def record(path: str, **params) -> tuple:
+    '''Simulate a protocol, recording each command's pipette, the line of run() that issued it and
+    when it starts and ends. Returns (layout, [Command], [('before' or 'after', command index)]).'''
+    from opentrons.legacy_commands import types as command_types
+
+    path = os.path.abspath(path)
+    commands, events, open_commands = [], [], []
+
+    def on_command(message):
+        payload = message.get('payload')
+        if payload is None or payload.get('text') is None:
+            return
+        if message['$'] == 'before':
+            instrument = payload.get('instrument')
+            track = f'{instrument.mount}: {instrument.name}' if instrument is not None else PROTOCOL_TRACK
+            if open_commands:
+                commands[open_commands[-1]].children += 1
+            commands.append(Command(payload['text'].strip(), track, line_of_run(path)))
+            open_commands.append(len(commands) - 1)
+            events.append(('before', open_commands[-1]))
+        elif open_commands:
+            events.append(('after', open_commands.pop()))
+
+    def subscribe(context):
+        context.broker.subscribe(command_types.COMMAND, on_command)
+
+    layout, _ = simulate(path, before_run=subscribe, **params)
+    return layout, commands, events
+
+
+def _name(text: str) -> str:
+    '''Event name: the log text up to the location ('Aspirating 10.0 uL', 'Picking up tip').'''
+    name = re.split(r' (?:from|into|at|in|to) ', text)[0]
+    return name if len(name) <= 60 else name[:57] + '...'
+
+
+def trace_events(layout: dict, commands: list, events: list, headers: dict, label: str = 'protocol') -> list:
+    '''Chrome trace events (times in µs) for a recorded run.'''
+    priced = costs(layout, [command.text for command in commands])
+    used = {command.track for command in commands}
+    tracks = ['steps'] + sorted(used - {PROTOCOL_TRACK}) + ([PROTOCOL_TRACK] if PROTOCOL_TRACK in used else [])
+    tid = {track: n for n, track in enumerate(tracks)}
+    trace = [{'name': 'process_name', 'ph': 'M', 'pid': 0, 'args': {'name': label}}]
+    trace += [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': n, 'args': {'name': track}} for track, n in tid.items()]
+    trace += [{'name': 'thread_sort_index', 'ph': 'M', 'pid': 0, 'tid': n, 'args': {'sort_index': n}} for n in tid.values()]
+
+    clock, start = 0.0, {}
+    spans = []  # [step, start, end]
+    for phase, index in events:
+        command = commands[index]
+        move, travel, kind, seconds = priced[index]
+        if phase == 'before':
+            start[index] = clock
+            step = step_of(command.line, headers)
+            if spans and spans[-1][0] == step:
+                spans[-1][2] = max(spans[-1][2], clock)
+            else:
+                spans.append([step, clock, clock])
+            if move:
+                slot = re.search(r' on (?:slot )?(\d+)', command.text)
+                trace.append({'name': f'move to slot {slot.group(1)}' if slot else 'move', 'cat': 'move', 'ph': 'X',
+                              'pid': 0, 'tid': tid[command.track], 'ts': round(clock * 1e6), 'dur': round(move * 1e6),
+                              'args': {'travel_mm': round(travel, 1)}})
+            clock += move + seconds
+            continue
+        spans[-1][2] = max(spans[-1][2], clock)
+        event = {'name': _name(command.text), 'cat': kind or ('group' if command.children else 'log'), 'pid': 0,
+                 'tid': tid[command.track], 'ts': round(start[index] * 1e6),
+                 'args': {'text': command.text, 'move_s': round(move, 2), 'action_s': round(seconds, 2)}}
+        if clock > start[index] or command.children:
+            event.update(ph='X', dur=round((clock - start[index]) * 1e6))
+        else:
+            event.update(ph='i', s='t')
+        trace.append(event)
+    for step, begin, end in spans:
+        trace.append({'name': step, 'cat': 'step', 'ph': 'X', 'pid': 0, 'tid': tid['steps'], 'ts': round(begin * 1e6),
+                      'dur': round((end - begin) * 1e6), 'args': {'minutes': round((end - begin) / 60, 1)}})
+    return trace
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Export a simulated run as a Chrome trace (Perfetto, chrome://tracing).')
+    parser.add_argument('protocol', help='protocol file')
+    parser.add_argument('parameters', nargs='*', help='runtime parameters, as name=value')
+    parser.add_argument('--output', help='trace file (default: the protocol name with .trace.json)')
+    args = parser.parse_args(argv)
+
+    params = dict(_parameter(text) for text in args.parameters)
+    layout, commands, events = record(args.protocol, **params)
+    label = os.path.basename(args.protocol) + (f' ({", ".join(args.parameters)})' if args.parameters else '')
+    trace = trace_events(layout, commands, events, steps(args.protocol), label)
+    output = args.output or os.path.splitext(os.path.basename(args.protocol))[0] + '.trace.json'
+    with open(output, 'w', encoding='utf-8') as trace_file:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, trace_file)
+    step_spans = [event for event in trace if event.get('cat') == 'step']
+    print(f'{label}: {len(commands)} commands, {sum(event["dur"] for event in step_spans) / 60e6:.1f} min - {output}')
+    for event in step_spans:
+        print(f'  {event["name"][:48]:<48} {event["dur"] / 60e6:6.1f} min')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
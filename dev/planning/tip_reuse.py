@@ -0,0 +1,157 @@
+'''
+Tip reuse
+
+Plating a dilution series with a fresh tip per dilution is the safe default, but most of those
+tips are not needed: plated from the lowest concentration up, the liquid a tip carries into the
+next tube is a *weaker* solution of the same template (or template-free diluent/negative), and
+the change it makes to the next tube's concentration is a fraction of a percent.
+
+`plan_tip_reuse` orders the plating steps - template-free liquids (negatives) first, then by
+increasing concentration - and reuses the tip for a step whenever the carried-over liquid changes
+the step's concentration by no more than a tolerance. A tip that has touched template is never
+reused for a template-free liquid.
+
+Carryover model: a used tip (after the disposal volume is blown out) still carries `carryover`
+µL of the last liquid - film inside the tip and drops outside. Conservatively, all of it mixes
+into the smaller of the source tube's contents and the first aspiration.
+
+`check_lineage` is the proof: it replays the plan, tracking for every tube, tip and destination
+well the set of liquids that reached it (its lineage) and its resulting concentration, and returns
+every well whose lineage breaks the rules: a template-free well that any template reached, or a
+well whose concentration is off by more than the tolerance. An empty list means no destination
+is contaminated.
+
+Usage (from the dev folder):
+
+    python -m planning.tip_reuse
+'''
+
+from dataclasses import dataclass, field
+
+from planning.pipettes import DROP_TIP, PICK_UP_TIP
+
+
+CARRYOVER = 1.0         # µL of liquid a used tip carries into the next source
+TOLERANCE = 0.01        # largest relative change in concentration that tip reuse may cause
+
+
+@dataclass
+class PlatingStep:
+    '''One multi-dispense of a liquid into destination wells.'''
+    liquid: str
+    concentration: float    # any unit (copies/µL); 0 for template-free liquids
+    volume: float           # µL the tip's leftover mixes into (first aspiration, or the tube if smaller)
+    wells: list = field(default_factory=list)
+
+
+def plating_order(steps: list) -> list:
+    '''Template-free liquids first, then increasing concentration (stable for equal concentrations).'''
+    return sorted(steps, key=lambda step: step.concentration)
+
+
+def mixed_concentration(step: PlatingStep, tip_concentration: float, carryover: float = CARRYOVER) -> float:
+    '''Concentration of a step's liquid after a tip carrying tip_concentration is dipped into it.'''
+    return (step.volume * step.concentration + carryover * tip_concentration) / (step.volume + carryover)
+
+
+def can_reuse(step: PlatingStep, tip_concentration: float, tolerance: float = TOLERANCE,
+              carryover: float = CARRYOVER) -> bool:
+    if step.concentration == 0:
+        return tip_concentration == 0
+    error = abs(mixed_concentration(step, tip_concentration, carryover) - step.concentration) / step.concentration
+    return error <= tolerance
+
+
+def plan_tip_reuse(steps: list, tolerance: float = TOLERANCE, carryover: float = CARRYOVER) -> list:
+    '''For steps in plating order, True where a fresh tip is needed, False where the previous tip is reused.'''
+    new_tips = []
+    tip = None
+    for step in steps:
+        reuse = tip is not None and can_reuse(step, tip, tolerance, carryover)
+        new_tips.append(not reuse)
+        tip = mixed_concentration(step, tip, carryover) if reuse else step.concentration
+    return new_tips
+
+
+@dataclass
+class WellRecord:
+    intended: str
+    intended_concentration: float
+    concentration: float
+    lineage: set
+
+
+def replay(steps: list, new_tips: list, carryover: float = CARRYOVER) -> dict:
+    '''Well -> WellRecord after running the plan, tracking liquid lineage through tubes and tips.'''
+    wells = {}
+    tip_lineage, tip_concentration = set(), 0.0
+    for step, new_tip in zip(steps, new_tips):
+        if new_tip:
+            tip_lineage, tip_concentration = set(), 0.0
+        lineage = {step.liquid} | tip_lineage
+        concentration = step.concentration
+        if not new_tip:
+            concentration = mixed_concentration(step, tip_concentration, carryover)
+        for well in step.wells:
+            record = wells.setdefault(well, WellRecord(step.liquid, step.concentration, 0.0, set()))
+            record.lineage |= lineage
+            record.concentration = concentration
+        tip_lineage, tip_concentration = lineage, concentration
+    return wells
+
+
+def check_lineage(steps: list, new_tips: list, tolerance: float = TOLERANCE, carryover: float = CARRYOVER) -> list:
+    '''Wells contaminated by the plan: (well, reason). Empty if every destination is clean.'''
+    template = {step.liquid for step in steps if step.concentration > 0}
+    problems = []
+    for well, record in replay(steps, new_tips, carryover).items():
+        if record.intended_concentration == 0:
+            if record.lineage & template:
+                problems.append((well, f'template-free well reached by {sorted(record.lineage & template)}'))
+        else:
+            error = abs(record.concentration - record.intended_concentration) / record.intended_concentration
+            if error > tolerance * (1 + 1e-9):
+                problems.append((well, f'concentration off by {100 * error:.2f}%'))
+    return problems
+
+
+def stdcurve_steps(num_plates: int, negatives: bool = True) -> list:
+    '''Plating steps of StdCurve_Dil_Plate.py (step 3), in the protocol's current order.'''
+    from planning.dilution import plan_dilutions
+
+    vol_per_well = 10
+    copies_per_well = [1*10**7, 1*10**6, 1*10**5, 1*10**4, 1000, 200, 100, 20, 10, 5]
+    wells_per_dilution = [3, 3, 3, 3, 6, 6, 8, 8, 8, 8]
+    excess_vol = 0 if num_plates == 1 else 5
+    vols = plan_dilutions(vol_per_well, copies_per_well, wells_per_dilution, num_plates=num_plates,
+                          excess_vol=excess_vol).series()
+    per_plate_vol = vol_per_well + excess_vol
+    steps = []
+    for i, (copies, wells) in enumerate(zip(copies_per_well, wells_per_dilution)):
+        tube = vols['rna'][i] + vols['dil'][i] + (20 if i == 0 else 0) - (vols['rna'][i + 1] if i + 1 < len(copies_per_well) else 0)
+        first_aspiration = min(200.0, wells * per_plate_vol * num_plates + 10)
+        steps.append(PlatingStep(f'dilution {i + 1}', copies / vol_per_well, min(tube, first_aspiration),
+                                 [f'dilution {i + 1} well {k + 1}' for k in range(wells)]))
+    if negatives:
+        steps.append(PlatingStep('negative', 0.0, min(200.0, 4 * per_plate_vol * num_plates + 10),
+                                 [f'negative well {k + 1}' for k in range(4)]))
+    return steps
+
+
+if __name__ == '__main__':
+    for num_plates in (1, 4, 12, 24):
+        current = stdcurve_steps(num_plates)
+        ordered = plating_order(current)
+        new_tips = plan_tip_reuse(ordered)
+        problems = check_lineage(ordered, new_tips)
+        # the same tip plan in the current (high to low) order, for comparison
+        unordered = plan_tip_reuse(current)
+        saved = len(current) - sum(new_tips)
+        print(f'{num_plates} plate(s): {len(current)} tips -> {sum(new_tips)} '
+              f'(saves {saved} tips, {saved * (PICK_UP_TIP + DROP_TIP):.0f} s of pickups/drops); '
+              f'{sum(unordered)} tips if plated high to low; lineage check: '
+              + ('clean' if not problems else f'{len(problems)} contaminated wells'))
+        print('  ' + ' '.join(('*' if new else '') + step.liquid.replace('dilution ', 'd').replace('negative', 'neg')
+                              for step, new in zip(ordered, new_tips)) + '   (* = fresh tip)')
+        # the check catches a bad plan: reuse every tip in the current order
+        assert check_lineage(current, [True] + [False] * (len(current) - 1))
@@ -0,0 +1,107 @@
+'''
+Well index
+
+The protocols build their destinations as `[plate.wells()[well] for well in wells_to_plate]`, and
+`labware.wells()` builds a new list of all 96 or 384 wells on every call - once per destination.
+`WellIndex` looks a labware's wells up once and serves them by index in plate order (column by
+column, as `wells()`), by name, by row and column, and by rectangular block.
+
+The protocols carry a copy of the class (they are uploaded as single files); `check_copies`
+compares the copies with this one.
+
+Usage (from the dev folder; requires the `opentrons` package):
+
+    python -m planning.well_index
+    python -m planning.analysis_bench --baseline HEAD~1 "../protocols/Freetown/Assay Development/PrimerEval_PlatePrimers_Custom.py"
+'''
+
+import ast
+import inspect
+import os
+import re
+
+
+PROTOCOLS = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..', 'protocols'))
+
+
+class WellIndex:
+    '''The wells of a loaded labware, looked up once: by index in plate order or by name (index['A1']),
+    by row and column (index.rows[0], index.columns[0]) and by block (index.block('A1', 'H3')).'''
+
+    def __init__(self, labware):
+        self.wells = labware.wells()
+        self.names = labware.wells_by_name()
+        self.rows = labware.rows()
+        self.columns = labware.columns()
+
+    def __getitem__(self, key):
+        return self.names[key] if isinstance(key, str) else self.wells[key]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def block(self, first, last):
+        '''Wells of the rectangle with corners first and last (names), column by column.'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return [self.columns[c][r] for c in range(min(c0, c1), max(c0, c1) + 1)
+                for r in range(min(r0, r1), max(r0, r1) + 1)]
+
+
+def check_copies(roots: tuple = (PROTOCOLS,)) -> list:
+    '''Files whose copy of WellIndex differs from this one.'''
+    library = ast.dump(ast.parse(inspect.getsource(WellIndex)))
+    different = []
+    for root in roots:
+        for folder, _, files in os.walk(root):
+            for file_name in sorted(files):
+                path = os.path.join(folder, file_name)
+                if not file_name.endswith('.py'):
+                    continue
+                with open(path, encoding='utf-8') as protocol_file:
+                    source = protocol_file.read()
+                match = re.search(r'^class WellIndex:.*?(?=^\S)', source, re.M | re.S)
+                if match and ast.dump(ast.parse(match.group(0))) != library:
+                    different.append(path)
+    return different
+
+
+if __name__ == '__main__':
+    import logging
+    import time
+
+    from opentrons import simulate
+
+    logging.disable(logging.CRITICAL)
+
+    def per_destination(plate, lists):
+        return [[plate.wells()[well] for well in wells] for wells in lists]
+
+    def indexed(plate, lists):
+        index = WellIndex(plate)
+        return [[index[well] for well in wells] for wells in lists]
+
+    # destinations built by PrimerEval_PlatePrimers_Custom.py (8 primers) and VariousPrimers_v3.1 (a full 384-well plate)
+    primer_eval = []
+    for i in range(8):
+        primer_eval.append(list(range(i, 8 * 48, 16)) + list(range(8 + i, 8 * 49, 16)))
+        primer_eval.append([w for c in range(3) for w in range(i * 48 + 16 * c, i * 48 + 16 * c + 16)])
+    various_primers = [list(range(384))] * 3
+    print(f"{'destinations':<28} {'api':>5} {'plate.wells() per well':>23} {'WellIndex':>10}")
+    for version in ('2.13', '2.20'):
+        context = simulate.get_protocol_api(version)
+        plate = context.load_labware('appliedbiosystemsmicroamp_384_wellplate_40ul', 2)
+        for label, lists in (('PrimerEval, 8 primers', primer_eval), ('VariousPrimers, 3 x 384', various_primers)):
+            timings = []
+            for build in (per_destination, indexed):
+                start = time.perf_counter()
+                build(plate, lists)
+                timings.append(time.perf_counter() - start)
+            print(f'{label:<28} {version:>5} {timings[0] * 1000:20.1f} ms {timings[1] * 1000:7.1f} ms')
+        index = WellIndex(plate)
+        assert [w.well_name for w in index.block('A1', 'B2')] == ['A1', 'B1', 'A2', 'B2']
+        assert index['P24'].well_name == index[383].well_name == 'P24' and len(index) == 384
+
+    different = check_copies()
+    print('\nProtocol copies: ' + ('match the library' if not different else f'{len(different)} differ'))
+    for path in different:
+        print(f'  {path}')
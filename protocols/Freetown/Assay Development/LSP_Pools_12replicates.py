@@ -4,7 +4,11 @@
 #
 # Master mix tube rack layout:
 # 
+# Wells for each master mix are dispensed in serpentine order (`serpentine`), row by row or column by column,
+# rather than in plate order. Each aspiration is packed to the tip's capacity (`multi_dispense`); the disposal
+# volume stays in the tip from one aspiration to the next and is blown out once, after the last well.
 
+import math
 from opentrons import protocol_api
 
 metadata = {
@@ -16,19 +20,148 @@ metadata = {
                         Mastermixes are added to plate: top left, top right, center left, center right, bottom left, bottom right.'''
 }
 
+
+# liquid classes (see dev/planning/liquid_classes.py): flow rates (µL/s) by pipette model - aspirate, dispense,
+# blow out - then delays after aspirating and dispensing (s), air gap (µL) and where the disposal volume goes
+# master mix is viscous: slower rates, with delays to let it catch up with the plunger
+liquid_classes = {
+    'mastermix': {'rates': {'p300_single_gen2': (80.0, 80.0, 80.0)},
+                  'aspirate_delay': 1.0, 'dispense_delay': 0.2, 'air_gap': 0.0, 'blowout': 'source well'}
+}
+
+
+def set_liquid_class(pipette, name:str):
+    '''Set a pipette's flow rates (aspirate, dispense, blow out) for a liquid class, and return the class.'''
+    liquid = liquid_classes[name]
+    pipette.flow_rate.aspirate, pipette.flow_rate.dispense, pipette.flow_rate.blow_out = liquid['rates'][pipette.name]
+    return liquid
+
+
+def distance(a, b):
+    return math.hypot(a.x - b.x, a.y - b.y)
+
+
+def serpentine(wells, source):
+    '''Order multi-dispense destinations to shorten gantry travel, without a search: row by row or column
+    by column (whichever path is shorter), reversing every other line, from the corner nearest the source.'''
+    start = source.top().point
+    points = [well.top().point for well in wells]
+    best = None
+    for major in (1, 0):           # rows (same y), then columns (same x)
+        minor = 1 - major
+        lines = {}
+        for i, p in enumerate(points):
+            lines.setdefault(round(p[major], 1), []).append(i)
+        for reverse_lines in (False, True):
+            for reverse_first in (False, True):
+                order = []
+                for n, key in enumerate(sorted(lines, reverse=reverse_lines)):
+                    line = sorted(lines[key], key=lambda i: points[i][minor])
+                    order += line[::-1] if (n % 2 == 1) != reverse_first else line
+                route = [start] + [points[i] for i in order]
+                length = sum(distance(a, b) for a, b in zip(route, route[1:]))
+                if best is None or length < best[0]:
+                    best = (length, order)
+    return [wells[i] for i in best[1]]
+
+
+def plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume=0):
+    '''Pack dispenses (µL per destination, in order) into as few aspirations as possible.
+
+    The disposal volume is aspirated once, stays in the tip for the whole run and is blown out at the end;
+    each aspiration also draws conditioning_volume, which goes straight back into the source.
+    Returns a list of trips, each a list of indices into volumes.'''
+    room = capacity - disposal_volume - conditioning_volume
+    if max(volumes) > room:
+        raise ValueError(f'a {max(volumes)} µL dispense does not fit in {capacity} µL with '
+                         f'{disposal_volume} µL disposal and {conditioning_volume} µL conditioning volume')
+    trips = [[]]
+    filled = 0
+    for i, vol in enumerate(volumes):
+        if filled + vol > room + 1e-9:
+            trips.append([])
+            filled = 0
+        trips[-1].append(i)
+        filled += vol
+    return trips
+
+
+def trash_location(protocol):
+    '''The fixed trash as a blowout location: its well up to API 2.15, the trash bin from 2.16.'''
+    trash = protocol.fixed_trash
+    return trash['A1'] if hasattr(trash, 'wells') else trash
+
+
+def multi_dispense(pipette, volume, source, dests, capacity, disposal_volume, blowout_location,
+                   conditioning_volume=0, touch_tip=False, liquid=None, protocol=None):
+    '''Dispense volume (µL, or a list with one volume per destination) from source into each of dests,
+    as planned by plan_dispenses, then blow out the disposal volume at blowout_location.
+    The disposal volume is cut to what fits beside the largest dispense (none for a full tip), so
+    large volumes go one per aspiration instead of failing.
+    liquid: a liquid class (from set_liquid_class), whose delays are made with protocol after each
+    aspiration and each dispense. The pipette must already have a tip.'''
+    volumes = volume if isinstance(volume, list) else [volume] * len(dests)
+    disposal_volume = max(0, min(disposal_volume, capacity - conditioning_volume - max(volumes)))
+    aspirate_delay = liquid['aspirate_delay'] if liquid else 0
+    dispense_delay = liquid['dispense_delay'] if liquid else 0
+    for n, trip in enumerate(plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume)):
+        pipette.aspirate(sum(volumes[i] for i in trip) + conditioning_volume + (disposal_volume if n == 0 else 0), source)
+        if aspirate_delay:
+            protocol.delay(seconds = aspirate_delay)
+        if touch_tip:
+            pipette.touch_tip(source)
+        if conditioning_volume:
+            pipette.dispense(conditioning_volume, source)
+        for i in trip:
+            pipette.dispense(volumes[i], dests[i])
+            if dispense_delay:
+                protocol.delay(seconds = dispense_delay)
+            if touch_tip:
+                pipette.touch_tip(dests[i])
+    pipette.blow_out(blowout_location)
+
+class WellIndex:
+    '''The wells of a loaded labware, looked up once: by index in plate order or by name (index['A1']),
+    by row and column (index.rows[0], index.columns[0]) and by block (index.block('A1', 'H3')).'''
+
+    def __init__(self, labware):
+        self.wells = labware.wells()
+        self.names = labware.wells_by_name()
+        self.rows = labware.rows()
+        self.columns = labware.columns()
+
+    def __getitem__(self, key):
+        return self.names[key] if isinstance(key, str) else self.wells[key]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def block(self, first, last):
+        '''Wells of the rectangle with corners first and last (names), column by column.'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return [self.columns[c][r] for c in range(min(c0, c1), max(c0, c1) + 1)
+                for r in range(min(r0, r1), max(r0, r1) + 1)]
+
+
 def run(protocol: protocol_api.ProtocolContext):
 
     # 0. Initialization
     
     volume = 10
+    disposal_volume = 10
     
     protocol.home()
 
     p300tips = protocol.load_labware('opentrons_96_filtertiprack_200ul', 3, 'Tip Rack')
     plate = protocol.load_labware('appliedbiosystemsmicroamp_384_wellplate_40ul', 2, 'Plate')
+    plate_wells = WellIndex(plate)
     rack = protocol.load_labware('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', 4, 'Master Mixes')
 
     p300 = protocol.load_instrument('p300_single_gen2', 'right', tip_racks=[p300tips])
+    liquid = set_liquid_class(p300, 'mastermix')
+
+    # multi-dispense: tip capacity, and volume kept in the tip to keep the last dispense of each aspiration accurate
+    tip_capacity = min(p300.max_volume, p300tips.wells()[0].max_volume)
 
 
     # 1. Pipetting master mixes 1-6
@@ -39,26 +172,22 @@ def run(protocol: protocol_api.ProtocolContext):
         for section_columns in range(2):                # columns 1-12 or 13-24
 
             tube_number += 1
-            list = []
-
-            for no_of_cols in range(12):                # 12 columns per master mix
-                for wells_in_column in range(5):        # 5 wells per column
-                
-                    list.append(
-                        section_rows*5      +
-                        section_columns*192 +
-                        no_of_cols*16       +
-                        wells_in_column
-                    )
-            
+            # 5 rows x 12 columns per master mix
+            section = [plate_wells.columns[c][r] for c in range(section_columns*12, section_columns*12 + 12)
+                       for r in range(section_rows*5, section_rows*5 + 5)]
+
             p300.pick_up_tip()
 
-            p300.distribute(
+            multi_dispense(
+                p300,
                 volume,
                 rack['A'+str(tube_number)],
-                [plate.wells()[wellIndex] for wellIndex in list],
-                new_tip = 'never',
-                disposal_volume = 10
+                serpentine(section, rack['A'+str(tube_number)]),
+                tip_capacity,
+                disposal_volume,
+                rack['A'+str(tube_number)] if liquid['blowout'] == 'source well' else trash_location(protocol),
+                liquid = liquid,
+                protocol = protocol
             )
 
             p300.drop_tip()
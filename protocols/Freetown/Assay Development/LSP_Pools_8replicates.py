@@ -16,6 +16,29 @@ metadata = {
                         Mastermixes are added to plate from top left to bottom right quadrants, by row.'''
 }
 
+class WellIndex:
+    '''The wells of a loaded labware, looked up once: by index in plate order or by name (index['A1']),
+    by row and column (index.rows[0], index.columns[0]) and by block (index.block('A1', 'H3')).'''
+
+    def __init__(self, labware):
+        self.wells = labware.wells()
+        self.names = labware.wells_by_name()
+        self.rows = labware.rows()
+        self.columns = labware.columns()
+
+    def __getitem__(self, key):
+        return self.names[key] if isinstance(key, str) else self.wells[key]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def block(self, first, last):
+        '''Wells of the rectangle with corners first and last (names), column by column.'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return [self.columns[c][r] for c in range(min(c0, c1), max(c0, c1) + 1)
+                for r in range(min(r0, r1), max(r0, r1) + 1)]
+
+
 def run(protocol: protocol_api.ProtocolContext):
 
     # 0. Initialization
@@ -26,6 +49,7 @@ def run(protocol: protocol_api.ProtocolContext):
 
     p300tips = protocol.load_labware('opentrons_96_filtertiprack_200ul', 3, 'Tip Rack')
     plate = protocol.load_labware('appliedbiosystemsmicroamp_384_wellplate_40ul', 2, 'Plate')
+    plate_wells = WellIndex(plate)
     rack = protocol.load_labware('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', 4, 'Master Mixes')
 
     p300 = protocol.load_instrument('p300_single_gen2', 'right', tip_racks=[p300tips])
@@ -39,25 +63,17 @@ def run(protocol: protocol_api.ProtocolContext):
         for section_columns in range(3):                # columns 1-8, 9-16, or 17-24
 
             tube_number += 1
-            list = []
-
-            for no_of_cols in range(8):                # 12 columns per master mix
-                for wells_in_column in range(5):        # 5 wells per column
-                
-                    list.append(
-                        section_rows*5      +
-                        section_columns*128 +
-                        no_of_cols*16       +
-                        wells_in_column
-                    )
-            
+            # 5 rows x 8 columns per master mix
+            section = [plate_wells.columns[c][r] for c in range(section_columns*8, section_columns*8 + 8)
+                       for r in range(section_rows*5, section_rows*5 + 5)]
+
             p300.pick_up_tip()
             
             if tube_number <= 6:
                 p300.distribute(
                     volume,
                     rack['A'+str(tube_number)],
-                    [plate.wells()[wellIndex] for wellIndex in list],
+                    section,
                     new_tip = 'never',
                     disposal_volume = 10
                 )
@@ -66,7 +82,7 @@ def run(protocol: protocol_api.ProtocolContext):
                 p300.distribute(
                     volume,
                     rack['B'+str(tube_number - 6)],
-                    [plate.wells()[wellIndex] for wellIndex in list],
+                    section,
                     new_tip = 'never',
                     disposal_volume = 10
                 )
@@ -27,8 +27,13 @@
 #      - tubes A1-(n/2), B1-(n/2): 13X forward primers (100µL each)
 #      - tubes C1-(n/2), D1-(n/2): 13X reverse primers (100µL each)
 #  - **6:** 96-count 20µL tip rack (protocol uses 16 tips)
+# 
+# Wells for each primer are dispensed in serpentine order (`serpentine`), row by row or column by column,
+# rather than in plate order. Each aspiration is packed to the tip's capacity (`multi_dispense`); the disposal
+# volume stays in the tip from one aspiration to the next and is blown out once, after the last well.
 
 
+import math
 from opentrons import protocol_api
 
 metadata = {
@@ -62,6 +67,130 @@ def add_parameters(parameters: protocol_api.Parameters):
         unit = 'µL'
     )
 
+
+# liquid classes (see dev/planning/liquid_classes.py): flow rates (µL/s) by pipette model - aspirate, dispense,
+# blow out - then delays after aspirating and dispensing (s), air gap (µL) and where the disposal volume goes
+# primers are dispensed at the bottom of the p20's range: default rates, disposal volume to the trash
+liquid_classes = {
+    'primer': {'rates': {'p20_single_gen2': (7.56, 7.56, 7.56)},
+               'aspirate_delay': 0.0, 'dispense_delay': 0.0, 'air_gap': 0.0, 'blowout': 'trash'}
+}
+
+
+def set_liquid_class(pipette, name:str):
+    '''Set a pipette's flow rates (aspirate, dispense, blow out) for a liquid class, and return the class.'''
+    liquid = liquid_classes[name]
+    pipette.flow_rate.aspirate, pipette.flow_rate.dispense, pipette.flow_rate.blow_out = liquid['rates'][pipette.name]
+    return liquid
+
+
+def distance(a, b):
+    return math.hypot(a.x - b.x, a.y - b.y)
+
+
+def serpentine(wells, source):
+    '''Order multi-dispense destinations to shorten gantry travel, without a search: row by row or column
+    by column (whichever path is shorter), reversing every other line, from the corner nearest the source.'''
+    start = source.top().point
+    points = [well.top().point for well in wells]
+    best = None
+    for major in (1, 0):           # rows (same y), then columns (same x)
+        minor = 1 - major
+        lines = {}
+        for i, p in enumerate(points):
+            lines.setdefault(round(p[major], 1), []).append(i)
+        for reverse_lines in (False, True):
+            for reverse_first in (False, True):
+                order = []
+                for n, key in enumerate(sorted(lines, reverse=reverse_lines)):
+                    line = sorted(lines[key], key=lambda i: points[i][minor])
+                    order += line[::-1] if (n % 2 == 1) != reverse_first else line
+                route = [start] + [points[i] for i in order]
+                length = sum(distance(a, b) for a, b in zip(route, route[1:]))
+                if best is None or length < best[0]:
+                    best = (length, order)
+    return [wells[i] for i in best[1]]
+
+
+def plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume=0):
+    '''Pack dispenses (µL per destination, in order) into as few aspirations as possible.
+
+    The disposal volume is aspirated once, stays in the tip for the whole run and is blown out at the end;
+    each aspiration also draws conditioning_volume, which goes straight back into the source.
+    Returns a list of trips, each a list of indices into volumes.'''
+    room = capacity - disposal_volume - conditioning_volume
+    if max(volumes) > room:
+        raise ValueError(f'a {max(volumes)} µL dispense does not fit in {capacity} µL with '
+                         f'{disposal_volume} µL disposal and {conditioning_volume} µL conditioning volume')
+    trips = [[]]
+    filled = 0
+    for i, vol in enumerate(volumes):
+        if filled + vol > room + 1e-9:
+            trips.append([])
+            filled = 0
+        trips[-1].append(i)
+        filled += vol
+    return trips
+
+
+def trash_location(protocol):
+    '''The fixed trash as a blowout location: its well up to API 2.15, the trash bin from 2.16.'''
+    trash = protocol.fixed_trash
+    return trash['A1'] if hasattr(trash, 'wells') else trash
+
+
+def multi_dispense(pipette, volume, source, dests, capacity, disposal_volume, blowout_location,
+                   conditioning_volume=0, touch_tip=False, liquid=None, protocol=None):
+    '''Dispense volume (µL, or a list with one volume per destination) from source into each of dests,
+    as planned by plan_dispenses, then blow out the disposal volume at blowout_location.
+    The disposal volume is cut to what fits beside the largest dispense (none for a full tip), so
+    large volumes go one per aspiration instead of failing.
+    liquid: a liquid class (from set_liquid_class), whose delays are made with protocol after each
+    aspiration and each dispense. The pipette must already have a tip.'''
+    volumes = volume if isinstance(volume, list) else [volume] * len(dests)
+    disposal_volume = max(0, min(disposal_volume, capacity - conditioning_volume - max(volumes)))
+    aspirate_delay = liquid['aspirate_delay'] if liquid else 0
+    dispense_delay = liquid['dispense_delay'] if liquid else 0
+    for n, trip in enumerate(plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume)):
+        pipette.aspirate(sum(volumes[i] for i in trip) + conditioning_volume + (disposal_volume if n == 0 else 0), source)
+        if aspirate_delay:
+            protocol.delay(seconds = aspirate_delay)
+        if touch_tip:
+            pipette.touch_tip(source)
+        if conditioning_volume:
+            pipette.dispense(conditioning_volume, source)
+        for i in trip:
+            pipette.dispense(volumes[i], dests[i])
+            if dispense_delay:
+                protocol.delay(seconds = dispense_delay)
+            if touch_tip:
+                pipette.touch_tip(dests[i])
+    pipette.blow_out(blowout_location)
+
+
+class WellIndex:
+    '''The wells of a loaded labware, looked up once: by index in plate order or by name (index['A1']),
+    by row and column (index.rows[0], index.columns[0]) and by block (index.block('A1', 'H3')).'''
+
+    def __init__(self, labware):
+        self.wells = labware.wells()
+        self.names = labware.wells_by_name()
+        self.rows = labware.rows()
+        self.columns = labware.columns()
+
+    def __getitem__(self, key):
+        return self.names[key] if isinstance(key, str) else self.wells[key]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def block(self, first, last):
+        '''Wells of the rectangle with corners first and last (names), column by column.'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return [self.columns[c][r] for c in range(min(c0, c1), max(c0, c1) + 1)
+                for r in range(min(r0, r1), max(r0, r1) + 1)]
+
+
 def run(protocol: protocol_api.ProtocolContext):
 
     # 0. INITIALIZATION
@@ -81,9 +210,16 @@ def run(protocol: protocol_api.ProtocolContext):
     p20tips = protocol.load_labware('opentrons_96_tiprack_20uL', 3)
     primers = protocol.load_labware('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', 5)
     plate = protocol.load_labware('appliedbiosystemsmicroamp_384_wellplate_40ul', 2)
+    plate_wells = WellIndex(plate)
+    primer_tubes = WellIndex(primers)
 
     # pipette initialization/setup
     p20 = protocol.load_instrument('p20_single_gen2', 'left', tip_racks=[p20tips])
+    liquid = set_liquid_class(p20, 'primer')
+
+    # multi-dispense: tip capacity, and volume kept in the tip to keep the last dispense of each aspiration accurate
+    tip_capacity = min(p20.max_volume, p20tips.wells()[0].max_volume)
+    disposal_volume = p20.min_volume
 
 
     ### Visualization of deck layout - API 2.14 and above only!
@@ -106,25 +242,21 @@ def run(protocol: protocol_api.ProtocolContext):
     )
 
     for i in range(num_primers):
-        primers.wells()[i].load_liquid(
+        primer_tubes[i].load_liquid(
             f_primer_viz,
             (6 * num_primers * primer_volume) * 1.1 + 10 #10% excess + 10 µL
         )
 
     for i in range(num_primers):
-        primers.wells()[i+8].load_liquid(
+        primer_tubes[i+8].load_liquid(
             r_primer_viz,
             (6 * num_primers * primer_volume) * 1.1 + 10 #10% excess + 10 µL
         )
 
 
-    wells_to_plate_viz = []
-    for i in range(num_primers):
-        wells_to_plate_viz += list(range(i, num_primers*48, 16))                 
-        wells_to_plate_viz += list(range(num_primers + i, num_primers*49, 16))
-    
-    for well in wells_to_plate_viz:
-        plate.wells()[well].load_liquid(
+    # forward primers fill rows 1 to 2*num_primers, columns 1 to 3*num_primers
+    for well in [well for column in plate_wells.columns[:3*num_primers] for well in column[:2*num_primers]]:
+        well.load_liquid(
             empty_viz,
             0
         )
@@ -138,16 +270,25 @@ def run(protocol: protocol_api.ProtocolContext):
 
     for i in range(num_primers):
         
-        wells_to_plate = []
-        wells_to_plate = list(range(i, num_primers*48, 16))                 # first row: primer 1 --> row A, for columns up to 3*num_primers
-        wells_to_plate += list(range(num_primers + i, num_primers*49, 16))  # second row: primer 1 --> row num_primers, for columns up to 3*num_primers
+        # first row: primer 1 --> row A, second row: primer 1 --> row num_primers + 1; columns up to 3*num_primers
+        wells_to_plate = plate_wells.rows[i][:3*num_primers] + plate_wells.rows[num_primers + i][:3*num_primers]
+
+        p20.pick_up_tip()
 
-        p20.distribute(
+        multi_dispense(
+            p20,
             primer_volume,
-            primers.wells()[i],
-            [plate.wells()[well] for well in wells_to_plate]
+            primer_tubes[i],
+            serpentine(wells_to_plate, primer_tubes[i]),
+            tip_capacity,
+            disposal_volume,
+            trash_location(protocol) if liquid['blowout'] == 'trash' else primer_tubes[i],
+            liquid = liquid,
+            protocol = protocol
         )
 
+        p20.drop_tip()
+
 
     # 2. REVERSE PRIMERS | 20 min
     # fill trios of columns with the correct reverse primers
@@ -158,17 +299,25 @@ def run(protocol: protocol_api.ProtocolContext):
 
     for i in range(num_primers):
 
-        wells_to_plate = []
-        wells_to_plate = list(range(i*48, i*48 + 2*num_primers))                # first column: primer 1 --> column 1, for rows up to 2*num_primers
-        wells_to_plate += list(range(i*48 + 16, i*48 + 2*num_primers + 16))     # second column: primer 1 --> column 2, for rows up to 2*num_primers
-        wells_to_plate += list(range(i*48 + 32, i*48 + 2*num_primers + 32))     # third column: primer 1 --> column 3, for rows up to 2*num_primers
+        # primer 1 --> columns 1-3, for rows up to 2*num_primers
+        wells_to_plate = [well for column in plate_wells.columns[3*i:3*i + 3] for well in column[:2*num_primers]]
+
+        p20.pick_up_tip()
 
-        p20.distribute(
+        multi_dispense(
+            p20,
             primer_volume,
-            primers.wells()[i + 8],
-            [plate.wells()[well] for well in wells_to_plate],
-            touch_tip = True
+            primer_tubes[i + 8],
+            serpentine(wells_to_plate, primer_tubes[i + 8]),
+            tip_capacity,
+            disposal_volume,
+            trash_location(protocol) if liquid['blowout'] == 'trash' else primer_tubes[i + 8],
+            touch_tip = True,
+            liquid = liquid,
+            protocol = protocol
         )
 
+        p20.drop_tip()
+
     protocol.home()
 
@@ -4,6 +4,68 @@
 # Author: OP13 LL
 
 from opentrons import protocol_api
+import math
+
+# deck slots for plates, in order of use (slot 5: mastermix rack, slot 6: tips) - MicroAmp EnduraPlates,
+# labware_definitions/microamp_endura_96well_with_rack_0.1ml
+plate_slots = [1, 2, 3, 4, 7, 8, 9, 10, 11]
+excess_wells = 4    # mastermix prepared per plate: 96 wells plus this many wells' worth
+tip_capacity = 200  # µL, p300 with 200 µL filter tips
+
+# aspiration height (see dev/planning/liquid_height.py)
+immersion_depth = 2.0   # mm below the liquid surface left after an aspiration
+min_clearance = 1.0     # mm from the tube bottom - the default aspiration height
+
+# liquid classes (see dev/planning/liquid_classes.py): flow rates (µL/s) by pipette model - aspirate, dispense,
+# blow out - then delays after aspirating and dispensing (s), air gap (µL) and where the disposal volume goes
+# mastermix rates are equivalent to Picus p300 speed 3 - roughly 80 µL per second, see page 29 here:
+# https://pipette.com/mm5/pdfs/manuals-brochures/Biohit-Picus-User-Manual.pdf
+liquid_classes = {
+    'mastermix': {'rates': {'p300_single_gen2': (80.0, 80.0, 80.0)},
+                  'aspirate_delay': 1.0, 'dispense_delay': 0.2, 'air_gap': 0.0, 'blowout': 'source well'}
+}
+
+
+def assign_mastermix_tubes(number_of_plates:int, volume:float, capacity:float):
+    '''Split plating across as many mastermix tubes as needed. Each tube holds mastermix for its wells
+    plus excess_wells per plate it serves: whole plates per tube where they fit, otherwise each plate
+    is split evenly across tubes. Returns one list of (plate index, well indices) per tube.'''
+    per_plate = (96 + excess_wells)*volume
+    if per_plate <= capacity:
+        plates_per_tube = int(capacity // per_plate)
+        return [[(p, list(range(96))) for p in range(start, min(start + plates_per_tube, number_of_plates))]
+                for start in range(0, number_of_plates, plates_per_tube)]
+
+    # a plate doesn't fit in one tube: split its wells evenly across the fewest tubes that hold them
+    parts = 2
+    while (math.ceil(96/parts) + excess_wells)*volume > capacity:
+        parts += 1
+    wells_per_part = math.ceil(96/parts)
+    return [[(p, list(range(start, min(start + wells_per_part, 96))))]
+            for p in range(number_of_plates) for start in range(0, 96, wells_per_part)]
+
+
+def set_liquid_class(pipette, name:str):
+    '''Set a pipette's flow rates (aspirate, dispense, blow out) for a liquid class, and return the class.'''
+    liquid = liquid_classes[name]
+    pipette.flow_rate.aspirate, pipette.flow_rate.dispense, pipette.flow_rate.blow_out = liquid['rates'][pipette.name]
+    return liquid
+
+
+def aspirate_location(ledger:dict, well, vol:float):
+    '''Take vol out of a tube in the liquid ledger (well -> volume) and return where to aspirate it: immersion_depth
+    below the surface that will be left afterwards, but no lower than min_clearance. The liquid height is that of a
+    cylinder of the tube's diameter - lower than the real surface in a tube with a conical bottom, never higher.'''
+    ledger[well] -= vol
+    height = ledger[well] / (math.pi * (well.diameter/2)**2)
+    return well.bottom(max(min_clearance, height - immersion_depth))
+
+
+def dispense_trips(count:int, volume:float, capacity:float, disposal_vol:float):
+    '''Split count equal dispenses into the groups a distribute aspirates together. Returns lists of indices.'''
+    per_trip = int((capacity - disposal_vol) // volume)
+    return [list(range(start, min(start + per_trip, count))) for start in range(0, count, per_trip)]
+
 
 metadata = {
     'apiLevel': '2.18',
@@ -16,6 +78,29 @@ requirements = {
     'robotType': 'OT-2'
 }
 
+class WellIndex:
+    '''The wells of a loaded labware, looked up once: by index in plate order or by name (index['A1']),
+    by row and column (index.rows[0], index.columns[0]) and by block (index.block('A1', 'H3')).'''
+
+    def __init__(self, labware):
+        self.wells = labware.wells()
+        self.names = labware.wells_by_name()
+        self.rows = labware.rows()
+        self.columns = labware.columns()
+
+    def __getitem__(self, key):
+        return self.names[key] if isinstance(key, str) else self.wells[key]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def block(self, first, last):
+        '''Wells of the rectangle with corners first and last (names), column by column.'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return [self.columns[c][r] for c in range(min(c0, c1), max(c0, c1) + 1)
+                for r in range(min(r0, r1), max(r0, r1) + 1)]
+
+
 def add_parameters(parameters: protocol_api.Parameters):
     
     parameters.add_int(
@@ -24,7 +109,7 @@ def add_parameters(parameters: protocol_api.Parameters):
         description = 'Number of 96-well plates to prepare; all wells of each plate will be filled.',
         default = 1,
         minimum = 1,
-        maximum = 4,
+        maximum = 9,
     )
 
     parameters.add_float(
@@ -45,7 +130,8 @@ def add_parameters(parameters: protocol_api.Parameters):
             {'display_name': '2 mL Snapcap', 'value': 'opentrons_24_tuberack_eppendorf_2ml_safelock_snapcap'},
             {'display_name': '1.5 mL Screwcap', 'value': 'opentrons_24_tuberack_nest_1.5ml_screwcap'},
             {'display_name': '2 mL Screwcap', 'value': 'opentrons_24_tuberack_generic_2ml_screwcap'},
-            {'display_name': '5 mL Screwcap', 'value': 'usascientific_15_tuberack_5000ul'}
+            {'display_name': '5 mL Screwcap', 'value': 'usascientific_15_tuberack_5000ul'},
+            {'display_name': '25 mL Screwcap', 'value': 'opentrons_6_tuberack_25ml'}
         ],
         default = 'opentrons_24_tuberack_nest_1.5ml_screwcap'
     )
@@ -64,10 +150,14 @@ def run(protocol: protocol_api.ProtocolContext):
     
     plateDict = {}
     for i in range(number_of_plates):
-        plateDict[str(i+1)] = protocol.load_labware('thermo_96_well_endura_0.1ml', i+1, 'Plate '+str(i+1))
+        plateDict[str(i+1)] = protocol.load_labware('microamp_endura_96well_with_rack_0.1ml', plate_slots[i], 'Plate '+str(i+1))
+    plate_wells = {name: WellIndex(plate) for name, plate in plateDict.items()}
 
     rack = protocol.load_labware(mastermix_rack, 5)
 
+    # mastermix tubes A1, B1, C1... - as many as needed for the number of plates
+    tube_plan = assign_mastermix_tubes(number_of_plates, volume, rack.wells()[0].max_volume)
+
     p300 = protocol.load_instrument('p300_single_gen2', 'right', tip_racks=[p300tips])
 
 
@@ -79,10 +169,14 @@ def run(protocol: protocol_api.ProtocolContext):
         '#44f'
     )
 
-    rack['A1'].load_liquid(
-        mmx_viz,
-        number_of_plates * volume * 100
-    )
+    # liquid ledger - volume in every mastermix tube, as declared for the deck map
+    ledger = {}
+    for tube, plan in zip(rack.wells(), tube_plan):
+        ledger[tube] = sum(len(wells) + excess_wells for _, wells in plan) * volume
+        tube.load_liquid(
+            mmx_viz,
+            ledger[tube]
+        )
 
     # 1. Adding mastermix to all wells
 
@@ -93,22 +187,28 @@ def run(protocol: protocol_api.ProtocolContext):
 
     #ARC_wells = [num for num in list if (num % 8 != 2) or (num < 64)]  # remove wells C9-C12 from list: #66, 74, 82, and 90
 
-    # these rates are equivalent to Picus p300 speed 3 - roughly 80 µL per second
-    # see more on page 29 here:
-    # https://pipette.com/mm5/pdfs/manuals-brochures/Biohit-Picus-User-Manual.pdf
-    p300.flow_rate.aspirate = 80
-    p300.flow_rate.dispense = 80
-    p300.flow_rate.blow_out = 80
-
-    for i in range(number_of_plates):
-
-        p300.distribute(
-            volume,
-            rack['A1'],
-            [plateDict[str(i+1)].wells()[wellIndex] for wellIndex in list],
-            disposal_volume = 10,
-            blow_out = True,
-            blowout_location = "source well",
-        )
+    # distribute can't pause between moves, so the class's delays don't apply here
+    liquid = set_liquid_class(p300, 'mastermix')
+
+    # one continuous run per tube, across all the plates (or plate parts) it fills - same tube, same tip;
+    # one distribute per aspiration, each just below the surface
+    for tube, plan in zip(rack.wells(), tube_plan):
+
+        dests = [plate_wells[str(i+1)][wellIndex] for i, wells in plan for wellIndex in list if wellIndex in wells]
+
+        p300.pick_up_tip()
+        for trip in dispense_trips(len(dests), volume, tip_capacity, 10):
+            p300.distribute(
+                volume,
+                aspirate_location(ledger, tube, volume*len(trip) + 10),
+                [dests[k] for k in trip],
+                disposal_volume = 10,
+                air_gap = liquid['air_gap'],
+                blow_out = True,
+                blowout_location = liquid['blowout'],
+                new_tip = 'never'
+            )
+            ledger[tube] += 10
+        p300.drop_tip()
 
     protocol.home()
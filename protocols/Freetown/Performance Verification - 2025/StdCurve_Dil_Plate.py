@@ -6,12 +6,29 @@ Author: OP13 LL
 
 INSTRUCTIONS FOR USE
 
-This protocol takes two parameters, entered in the Opentrons app interface:
+This protocol takes three parameters, entered in the Opentrons app interface:
  - Number of plates (integer)
  - Negative plating: manual, plate using template diluent, or plate using kit negative (separate user-provided tube)
+ - Plating: into a dilution plate, to be split into qPCR plates by hand, or directly into qPCR plates (MicroAmp
+   EnduraPlates, labware_definitions/microamp_endura_96well_with_rack_0.1ml) already loaded with master mix
+   (up to 6, slots 2, 5, 7, 8, 10, 11) - no dilution plate and no excess volume per well, so less RNA
+   is used; the run log starts with the RNA and hands-on time saved
+
+For more plates than one dilution plate can hold (6 at 15 µL per well per plate), extra dilution plates are used (slots 5, 7, 8).
+Dilutions that outgrow a 1.5 mL tube are made in 5 mL tubes (in the diluent rack, after the diluent tubes) or a 25 mL tube
+(rack in slot 9), and diluent is split across as many 5 mL tubes as needed - check the deck map in the app for positions.
+Pipette mixing cannot bring the largest of these dilutions to an even concentration: the run log starts with the dilutions
+to mix by hand, and the run pauses after each of them.
+
+Plating goes from the lowest concentration up (negatives first), so one tip can carry on from one dilution to the next
+as long as the liquid left on it changes the next dilution's concentration by no more than 1%; otherwise a fresh tip is used.
+
+The protocol keeps track of the liquid in every tube and aspirates just below the surface rather than at the bottom,
+so the starting volumes shown in the deck map must be what is actually in the tubes.
 
 A ten-point serial dilution series is generated (1.0E6 to 0.5 copies per µL), then plated on a 96-well plate.
-Dilutions can then be transferred to another plate containing mastermix using a multichannel pipette.
+Dilutions can then be transferred to another plate containing mastermix using a multichannel pipette - or, plating
+directly, go straight into the qPCR plates, dispensed above the master mix so the tips never touch it.
 
 The serial dilution values can be changed here in Python, if desired;
 from an end-user perspective, these values are hard-coded as to reduce risk of user error.
@@ -42,23 +59,81 @@ PLATE LAYOUT (copies per well)
 
 
 from opentrons import protocol_api
-import pandas as pd
+from fractions import Fraction
 import math
 
 
 vol_per_well = 10 #µL
 copies_per_well =    [1*10**7, 1*10**6, 1*10**5, 1*10**4, 1000, 200, 100, 20, 10, 5]
-wells_per_dilution = [      3,       3,       3,       3,    6,   6,   8,  8,  8, 8]
+# wells to plate for each dilution and the negatives, compiled from the plate layout above (dev/planning/plate_map.py) -
+# to change the layout, redraw it and run `python -m planning.plate_map --update` on this file
+plate_map = {
+    '1.0E+07': ['A6', 'A7', 'A8'],
+    '1.0E+06': ['A9', 'A10', 'A11'],
+    'Kit Neg': ['A12', 'B12', 'C12', 'D12'],
+    '1.0E+05': ['B6', 'B7', 'B8'],
+    '1.0E+04': ['B9', 'B10', 'B11'],
+    '1000': ['C6', 'C7', 'C8', 'C9', 'C10', 'C11'],
+    '200': ['D6', 'D7', 'D8', 'D9', 'D10', 'D11'],
+    '100': ['E5', 'E6', 'E7', 'E8', 'E9', 'E10', 'E11', 'E12'],
+    '20': ['F5', 'F6', 'F7', 'F8', 'F9', 'F10', 'F11', 'F12'],
+    '10': ['G5', 'G6', 'G7', 'G8', 'G9', 'G10', 'G11', 'G12'],
+    '5': ['H5', 'H6', 'H7', 'H8', 'H9', 'H10', 'H11', 'H12'],
+}
+plate_map_labels = ['1.0E+07', '1.0E+06', '1.0E+05', '1.0E+04', '1000', '200', '100', '20', '10', '5']  # in copies_per_well order
+neg_label = 'Kit Neg'
+wells_per_dilution = [len(plate_map[label]) for label in plate_map_labels]
 num_plates = 1
 excess_vol = 5 #µL
 
 dil_loc = 'A1'
 neg_loc = 'A6'
 
+# dilution tube types, smallest first: rack, tube capacity (µL), and tube profile for the mixing model -
+# conical bottom (bottom diameter, top diameter, height), then diameter above it (all mm)
+tube_types = [
+    ('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', 1500, (3.0, 8.6, 17.56, 8.9)),
+    ('usascientific_15_tuberack_5000ul', 5000, (15.0, 15.0, 0.0, 15.0)),
+    ('opentrons_6_tuberack_25ml', 25000, (27.81, 27.81, 0.0, 27.81))
+]
+diluent_dead_vol = 200            # µL left in each diluent tube
+extra_plate_slots = [5, 7, 8]     # dilution plates after the first one (slot 2)
+qpcr_plate_slots = [2, 5, 7, 8, 10, 11]   # qPCR plates when plating directly
+qpcr_dispense_depth = 3.0         # mm below the top of a qPCR well - direct plating dispenses above the master mix
+manual_column_time = 20           # s per column moved by hand with a multichannel (aspirate, dispense, new tips)
+large_tube_slot = 9               # 25 mL tube rack, loaded only if a dilution needs it
+
+# mixing model for the dilution tubes (see dev/planning/mixing.py)
+target_cv = 0.02                  # coefficient of variation of concentration within a tube after mixing
+min_mix_cycles = 5                # the validated mix, kept as a floor: at least 5 cycles at the default flow rate...
+mix_fraction = 0.8                # ...of 80% of the tube volume (capped at the pipette's maximum)
+water_viscosity = 1.0             # mm²/s
+
+# tip reuse when plating (see dev/planning/tip_reuse.py)
+tip_carryover = 1.0               # µL of liquid a used tip carries into the next tube (film inside, drops outside)
+carryover_tolerance = 0.01        # largest change in a dilution's concentration that reusing a tip may cause
+
+# aspiration height (see dev/planning/liquid_height.py)
+immersion_depth = 2.0             # mm below the liquid surface left after an aspiration
+min_clearance = 1.0               # mm from the tube bottom - the default aspiration height
+
+# liquid classes (see dev/planning/liquid_classes.py): flow rates (µL/s) by pipette model - aspirate, dispense,
+# blow out - then delays after aspirating and dispensing (s), air gap (µL) and where the disposal volume goes
+# diluent and RNA both run at the default rates, which the pipettes' accuracy specifications are measured at -
+# the diluent volume sets the dilution factor, so it only speeds up once gravimetric.py has fitted a faster rate
+liquid_classes = {
+    'aqueous': {'rates': {'p20_single_gen2': (7.56, 7.56, 7.56), 'p300_single_gen2': (92.86, 92.86, 92.86),
+                          'p1000_single_gen2': (274.7, 274.7, 274.7)},
+                'aspirate_delay': 0.0, 'dispense_delay': 0.0, 'air_gap': 0.0, 'blowout': 'source well'},
+    'rna': {'rates': {'p20_single_gen2': (7.56, 7.56, 7.56), 'p300_single_gen2': (92.86, 92.86, 92.86),
+                      'p1000_single_gen2': (274.7, 274.7, 274.7)},
+            'aspirate_delay': 0.0, 'dispense_delay': 0.0, 'air_gap': 0.0, 'blowout': 'source well'}
+}
+
 
 def ceil_10(num):
     '''Round value up to the nearest 10.'''
-    return int(math.ceil(num/10.0))*10
+    return int(math.ceil(num/10))*10
 
 
 def get_volumes(vol_per_well:float, copies_per_well:list, wells_per_dilution:list, num_plates=1, excess_vol=10.0):
@@ -66,33 +141,34 @@ def get_volumes(vol_per_well:float, copies_per_well:list, wells_per_dilution:lis
     create a table containing volumes of RNA and diluent required for each dilution step.
     
     For ease of use in Opentrons commands, table is returned as a dictionary of lists.
+    Volumes are calculated with exact fractions rather than pandas (keeps protocol analysis fast),
+    so non-integer dilution factors (e.g. 1:2.5) are also handled correctly.
     '''
 
-    # construct data frame from existing lists
-    data = {'cp/well': copies_per_well, 'wells/dil': wells_per_dilution}
-    df = pd.DataFrame(data)
-
-    # calculate dilution factor for each step
-    df['dil factor'] = 1
-    for i in range(1, len(df)):
-        df.loc[i, 'dil factor'] = df.loc[i-1, 'cp/well'] // df.loc[i, 'cp/well']
+    # calculate dilution factor for each step - first step is the undiluted RNA
+    dil_factors = [Fraction(1)]
+    for i in range(1, len(copies_per_well)):
+        dil_factors.append(Fraction(str(copies_per_well[i-1])) / Fraction(str(copies_per_well[i])))
 
     # calculate exact volume needed for plating in each step (wells * volume per well, plus 20 µL excess, plus 15 µL per plated well)
-    df['exact vol'] = (df['wells/dil'] * (vol_per_well+excess_vol)) * num_plates + 20
+    per_well = Fraction(str(vol_per_well)) + Fraction(str(excess_vol))
+    exact_vols = [wells * per_well * num_plates + 20 for wells in wells_per_dilution]
 
     # calculate adjusted volume needed, accounting for downstream dilutions
-    df['adj vol'] = df['exact vol']
-    for i in range(len(df) - 2, -1, -1): #start at second-to-last dilution and iterate backwards through first dilution
-        df.loc[i, 'adj vol'] = ceil_10(df.loc[i, 'exact vol'] + (df.loc[i+1,'adj vol'] // df.loc[i+1,'dil factor']))
+    adj_vols = exact_vols[:]
+    for i in range(len(adj_vols) - 2, -1, -1): #start at second-to-last dilution and iterate backwards through first dilution
+        adj_vols[i] = ceil_10(exact_vols[i] + adj_vols[i+1] / dil_factors[i+1])
 
     # calculate volumes of RNA and diluent needed for each step
-    df['rna vol'] = df['adj vol'] // df['dil factor']
-    df['dil vol'] = df['adj vol'] - df['rna vol']
+    rna_vols = [adj / factor for adj, factor in zip(adj_vols, dil_factors)]
+    dil_vols = [adj - rna for adj, rna in zip(adj_vols, rna_vols)]
 
-    # calculate volumes to dispense into wells
+    # whole-number volumes as ints, anything else as floats
+    def simplify(vol):
+        return int(vol) if vol.denominator == 1 else float(vol)
 
-    dict = {'rna': df['rna vol'].to_list(),
-            'dil': df['dil vol'].to_list()}
+    dict = {'rna': [simplify(vol) for vol in rna_vols],
+            'dil': [simplify(vol) for vol in dil_vols]}
     return dict
 
 
@@ -119,57 +195,171 @@ def choose_pipette(vol, range1:dict, range2:dict):
             return list(range2.values())
 
 
-def choose_mixing(rna_vol:float, dil_vol:float, range1:dict, range2:dict):
+def tube_volume(height:float, profile=tube_types[0][2]):
+    '''Approximate volume (µL) of liquid filled to a height (mm above the bottom) in a tube (see tube_types).'''
+    d1, d2, h, diameter = profile
+    if height >= h:
+        return math.pi*h/12*(d1**2 + d1*d2 + d2**2) + (height - h)*math.pi*diameter**2/4
+    d = d1 + (d2 - d1)*height/h
+    return math.pi*height/12*(d1**2 + d1*d + d**2)
+
+
+def tube_height(vol:float, profile=tube_types[0][2]):
+    '''Approximate liquid height (mm above the bottom) of a volume (µL) in a tube (see tube_types).'''
+    low, high = 0.0, 100.0
+    for _ in range(30):
+        mid = (low + high)/2
+        if tube_volume(mid, profile) < vol:
+            low = mid
+        else:
+            high = mid
+    return (low + high)/2
+
+
+def plan_mixing(rna_vol:float, dil_vol:float, pipette, ranges:list, profile=tube_types[0][2]):
+    '''After transferring rna_vol into dil_vol with pipette, choose the pipette, number of cycles
+    and volume for mixing the tube.
+
+    Every option keeps the validated mix - at least min_mix_cycles at mix_fraction of the tube volume
+    (capped at the pipette's maximum), at the default flow rate - and adds cycles only where the model
+    (see dev/planning/mixing.py) predicts the tube stays short of the target homogeneity: each cycle mixes
+    the volume it moves, but only as far up the liquid column as the dispense jet reaches.
+    Returns (mixing pipette, cycles, volume, predicted CV). If no option reaches target_cv in
+    20 cycles, the one getting closest is returned, and its CV shows by how much it falls short.'''
+    total_vol = rna_vol + dil_vol
+    start_cv = math.sqrt(dil_vol/rna_vol)    # concentration CV right after the transfer, before mixing
+
+    best = None
+    for r in ranges:
+        mix_pipette = r['pipette']
+        mix_vol = round(min(mix_fraction*total_vol, r['max']), 1)
+        if mix_vol < r['min']:
+            continue
+        aspirate, dispense = mix_pipette.flow_rate.aspirate, mix_pipette.flow_rate.dispense
+        tip_time = 0 if mix_pipette is pipette else 11    # s, picking up and dropping another tip
+        column = tube_height(total_vol - mix_vol, profile) - 1    # liquid above the tip at the end of an aspiration
+        reach = 0.4*dispense/(math.pi*water_viscosity)   # mm, jet penetration (0.1 tip diameters per unit Re)
+        efficiency = min(1.0, reach/column)*(1 - tube_volume(1, profile)/total_vol)
+        per_cycle = 1 - efficiency*mix_vol/total_vol
+        cycles = min_mix_cycles
+        if start_cv*per_cycle**cycles > target_cv:
+            cycles = min(20, max(cycles, math.ceil(math.log(target_cv/start_cv)/math.log(per_cycle))))
+        cv = start_cv*per_cycle**cycles
+        time = tip_time + cycles*(mix_vol/aspirate + mix_vol/dispense + 0.5)
+        # fastest option reaching the target; if none does in 20 cycles, the one getting closest
+        key = (max(0.0, cv - target_cv), time)
+        if best is None or key < best[0]:
+            best = (key, mix_pipette, cycles, mix_vol, cv)
+
+    return best[1:]
+
+
+def choose_mixing(rna_vol:float, dil_vol:float, range1:dict, range2:dict, profile=tube_types[0][2]):
     '''Based on RNA volume, diluent volume, and available pipette ranges,
-    choose pipettes for dispensing and mixing, plus mixing volume.'''
-    use_p300_mix = False
-    pipette, _, p_max = choose_pipette(rna_vol, range1, range2)
-    totalvol_80percent = 0.8*(rna_vol + dil_vol)
-    
-    # if 80% of total volume in tube is less than pipette's max, use this as mixing vol
-    if totalvol_80percent < p_max:
-        mix_vol = totalvol_80percent
-    # if this volume is greater than the pipette's max, check which pipette is being used
-    else:
-        # if P20 is being used, switch to p300 for mixing
-        if p_max == 20.0:
-            if totalvol_80percent < 200.0:
-                mix_vol = totalvol_80percent
-                use_p300_mix = True
-            else:
-                mix_vol = 200.0
-                use_p300_mix = True
-        # if P20 isn't being used for the dilution step, current pipette - P300 or P1000 - is fine
+    choose pipettes for dispensing and mixing, plus number of mixing cycles, mixing volume and predicted CV.'''
+    pipette = choose_pipette(rna_vol, range1, range2)[0]
+    return (pipette,) + plan_mixing(rna_vol, dil_vol, pipette, [range1, range2], profile)
+
+
+def set_liquid_class(pipette, name:str):
+    '''Set a pipette's flow rates (aspirate, dispense, blow out) for a liquid class, and return the class.'''
+    liquid = liquid_classes[name]
+    pipette.flow_rate.aspirate, pipette.flow_rate.dispense, pipette.flow_rate.blow_out = liquid['rates'][pipette.name]
+    return liquid
+
+
+def aspirate_location(ledger:dict, well, vol:float):
+    '''Take vol out of a tube in the liquid ledger (well -> [volume, tube profile]) and return where to aspirate it:
+    immersion_depth below the surface that will be left afterwards (so the tip stays submerged to the end),
+    but no lower than min_clearance.'''
+    ledger[well][0] -= vol
+    return well.bottom(max(min_clearance, tube_height(ledger[well][0], ledger[well][1]) - immersion_depth))
+
+
+def dispense_trips(volumes:list, capacity:float, disposal_vol:float):
+    '''Split a distribute's volumes into the groups it aspirates together (as many as fit with the disposal volume),
+    so that each aspiration can be given its own height. Returns lists of indices into volumes.'''
+    trips = [[]]
+    filled = disposal_vol
+    for i, vol in enumerate(volumes):
+        if trips[-1] and filled + vol > capacity:
+            trips.append([])
+            filled = disposal_vol
+        trips[-1].append(i)
+        filled += vol
+    return trips
+
+
+def choose_tube(vol:float):
+    '''Index (in tube_types) of the smallest tube that holds vol.'''
+    for t in range(len(tube_types)):
+        if vol <= tube_types[t][1]:
+            return t
+    raise ValueError(f'{vol} µL is more than the largest tube holds - reduce the number of plates')
+
+
+def split_sources(vols:list, capacity:float, dead_vol:float):
+    '''Draw a list of volumes from as few source tubes as possible, filling each tube up to capacity
+    (including dead_vol left behind).
+    Volumes that don't fit in what's left of the current tube start a new one; only volumes larger than
+    a whole tube are split. Returns one list of (index into vols, volume) per source tube.'''
+    usable = capacity - dead_vol
+    sources = [[]]
+    remaining = usable
+    for i, vol in enumerate(vols):
+        # start a new tube for a volume that doesn't fit in what's left of the current one
+        if vol > remaining and remaining < usable:
+            sources.append([])
+            remaining = usable
+        while vol > 0:
+            if remaining <= 0:
+                sources.append([])
+                remaining = usable
+            part = min(vol, remaining)
+            sources[-1].append((i, part))
+            remaining -= part
+            vol -= part
+    return sources
+
+
+def plan_tip_reuse(steps:list, tolerance=carryover_tolerance, carryover=tip_carryover):
+    '''For plating steps in order - (concentration, volume), volume being the least liquid that a used tip's
+    leftover mixes into - decide which steps need a fresh tip (True) and which reuse the previous one (False).
+
+    A tip is reused only if the carryover changes the step's concentration by at most tolerance,
+    and never from a liquid with template into a template-free one (concentration 0).'''
+    new_tips = []
+    tip = None    # concentration of the liquid on the tip
+    for conc, vol in steps:
+        mixed = None if tip is None else (vol*conc + carryover*tip)/(vol + carryover)
+        if tip is None or (conc == 0 and tip > 0) or (conc > 0 and abs(mixed - conc) > tolerance*conc):
+            new_tips.append(True)
+            tip = conc
         else:
-            mix_vol = p_max
-
-    return pipette, mix_vol, use_p300_mix
+            new_tips.append(False)
+            tip = mixed
+    return new_tips
+
+
+def check_lineage(steps:list, dests:list, new_tips:list, tolerance=carryover_tolerance, carryover=tip_carryover):
+    '''Replay a tip plan, tracking which liquids (steps) reach each destination well and at what concentration.
+    Raises ValueError if template reaches a template-free well, or a well's concentration is off by more than tolerance.'''
+    reached = {}
+    lineage, tip = set(), 0.0
+    for n, ((conc, vol), wells, new_tip) in enumerate(zip(steps, dests, new_tips)):
+        if new_tip:
+            lineage, tip = set(), 0.0
+        lineage = lineage | {n}
+        tip = conc if new_tip else (vol*conc + carryover*tip)/(vol + carryover)
+        for well in wells:
+            reached.setdefault(well, set()).update(lineage)
+            if conc == 0 and any(steps[k][0] > 0 for k in reached[well]):
+                raise ValueError(f'tip reuse would carry template into negative well {well}')
+            if conc > 0 and abs(tip - conc) > tolerance*conc*(1 + 1e-9):
+                raise ValueError(f'tip reuse would change the concentration in well {well} by {abs(tip - conc)/conc:.1%}')
+    return reached
 
         
-def get_wells():
-    '''For the plate map shown in this protocol, get a list of lists containing indices for wells to plate.'''
-    wells_list = []
-
-    # first 4 points in series
-    for i in range(4):
-        wells = [8*x + math.floor(i/2) for x in range(5,8)]
-        if i % 2 != 0: #i is odd
-            wells = [x+24 for x in wells] #shift over by 3 columns for odd i
-        wells_list.append(wells)
-
-    # next 2 points in series
-    for i in range(2,4):
-        wells = [8*x + i for x in range(5,11)]
-        wells_list.append(wells)
-
-    # final 4 points in series
-    for i in range(4,8):
-        wells = [8*x + i for x in range(4,12)]
-        wells_list.append(wells)
-
-    return wells_list
-
-
 metadata = {
     'apiLevel': '2.22',
     'protocolName': 'Freetown | Standard Curve for Pre-LoD',
@@ -208,11 +398,46 @@ if float(metadata['apiLevel']) >= 2.18:
         parameters.add_int(
             variable_name = "num_plates",
             display_name = "Number of plates to prepare",
+            description = "More than 6 plates uses extra dilution plates; large dilutions move to 5 mL or 25 mL tubes.",
             default = 1,
             minimum = 1,
-            maximum = 4
+            maximum = 24
         )
 
+        parameters.add_str(
+            variable_name = "plating",
+            display_name = "Plating",
+            choices = [
+                {"display_name": "Dilution plate", "value": "dilution_plate"},
+                {"display_name": "Direct to qPCR plates", "value": "direct"}
+            ],
+            description = "Direct: up to 6 MicroAmp EnduraPlates with master mix, in slots 2, 5, 7, 8, 10 and 11.",
+            default = "dilution_plate"
+        )
+
+
+class WellIndex:
+    '''The wells of a loaded labware, looked up once: by index in plate order or by name (index['A1']),
+    by row and column (index.rows[0], index.columns[0]) and by block (index.block('A1', 'H3')).'''
+
+    def __init__(self, labware):
+        self.wells = labware.wells()
+        self.names = labware.wells_by_name()
+        self.rows = labware.rows()
+        self.columns = labware.columns()
+
+    def __getitem__(self, key):
+        return self.names[key] if isinstance(key, str) else self.wells[key]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def block(self, first, last):
+        '''Wells of the rectangle with corners first and last (names), column by column.'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return [self.columns[c][r] for c in range(min(c0, c1), max(c0, c1) + 1)
+                for r in range(min(r0, r1), max(r0, r1) + 1)]
+
 
 def run(protocol: protocol_api.ProtocolContext):
 
@@ -221,25 +446,45 @@ def run(protocol: protocol_api.ProtocolContext):
         num_plates = protocol.params.num_plates
         neg_handling = protocol.params.neg_handling
         robot = protocol.params.robot
+        plating = protocol.params.plating
     else:
         num_plates = 1
         neg_handling = 'kit'
         robot = '7B10'
-    
-    if num_plates == 1:
+        plating = 'dilution_plate'
+    direct = plating == 'direct'
+
+    if direct and num_plates > len(qpcr_plate_slots):
+        raise ValueError(f'Direct plating takes at most {len(qpcr_plate_slots)} qPCR plates (slots '
+                         f'{", ".join(str(slot) for slot in qpcr_plate_slots)}) - for {num_plates} plates, '
+                         f'plate into dilution plates, or run {len(qpcr_plate_slots)} plates at a time')
+
+    # excess per well covers splitting a dilution plate by hand - plating directly needs none
+    if num_plates == 1 or direct:
         excess_vol = 0 #µL
     else:
         excess_vol = 5 #µL
 
     vols = get_volumes(vol_per_well, copies_per_well, wells_per_dilution, num_plates=num_plates, excess_vol=excess_vol)
 
+    if direct:
+        via_plate = get_volumes(vol_per_well, copies_per_well, wells_per_dilution, num_plates=num_plates,
+                                excess_vol=0 if num_plates == 1 else 5)
+        columns = len({well[1:] for names in plate_map.values() for well in names})
+        # with no excess either way (one plate), the RNA stock is the same
+        stock = (f'{vols["rna"][0] + 20} µL of RNA stock instead of {via_plate["rna"][0] + 20} µL through a dilution plate, and '
+                 if via_plate['rna'][0] != vols['rna'][0] else '')
+        protocol.comment(
+            f'Plating directly into {num_plates} qPCR plate(s): {stock}no dilution plate to split by hand '
+            f'({num_plates*columns} multichannel transfers, about {num_plates*columns*manual_column_time/60:.0f} min).'
+        )
+
     ###
     ### Deck setup
     ###
 
     tubes = protocol.load_labware('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', 4)
     diluent = protocol.load_labware('usascientific_15_tuberack_5000ul', 1)
-    plate = protocol.load_labware('abs_96well_100ul', 2)
 
     p300_tips = protocol.load_labware('opentrons_96_filtertiprack_200ul', 3)
     p300 = protocol.load_instrument('p300_single_gen2', 'right', tip_racks=[p300_tips])
@@ -253,6 +498,65 @@ def run(protocol: protocol_api.ProtocolContext):
         left_pipette = protocol.load_instrument('p1000_single_gen2', 'left', tip_racks=[left_tips])
         left_pipette_range = {'pipette': left_pipette, 'min': 200.0, 'max': 1000.0}
 
+    # plates the dilutions go to - the qPCR plates themselves, one share each, or dilution plates,
+    # each well holding per_plate_vol for as many plates as fit
+    per_plate_vol = vol_per_well + excess_vol
+    if direct:
+        dil_plates = [protocol.load_labware('microamp_endura_96well_with_rack_0.1ml', slot, 'qPCR Plate ' + str(k + 1))
+                      for k, slot in enumerate(qpcr_plate_slots[:num_plates])]
+        plate_shares = [1]*num_plates
+    else:
+        plate = protocol.load_labware('abs_96well_100ul', 2)
+        plates_per_dil_plate = int(plate.wells()[0].max_volume // per_plate_vol)
+        plate_shares = [min(plates_per_dil_plate, num_plates - k) for k in range(0, num_plates, plates_per_dil_plate)]
+        dil_plates = [plate] + [protocol.load_labware('abs_96well_100ul', slot) for slot in extra_plate_slots[:len(plate_shares) - 1]]
+
+    # diluent, split across as many 5 mL tubes as needed (starting at dil_loc) - the last entry is diluent used as negative
+    dil_demands = list(vols['dil'])
+    if neg_handling == 'diluent':
+        dil_demands.append(len(plate_map[neg_label])*per_plate_vol*num_plates)
+    dil_sources = split_sources(dil_demands, tube_types[1][1], diluent_dead_vol)
+    first_dil_tube = diluent.wells().index(diluent[dil_loc])
+    dil_tubes = diluent.wells()[first_dil_tube:first_dil_tube + len(dil_sources)]
+
+    # dilution tubes - 1.5 mL tubes in series order, as before; dilutions too large for 1.5 mL
+    # go to the next free 5 mL tube position after the diluent, or to the 25 mL rack
+    next_5ml = first_dil_tube + len(dil_sources)
+    large_rack = None
+    tube_locs = []
+    tube_profiles = []
+    for i in range(len(vols['rna'])):
+        t = choose_tube(vols['rna'][i] + vols['dil'][i] + (20 if i == 0 else 0))
+        if t == 0:
+            tube_locs.append(tubes.wells()[i])
+        elif t == 1:
+            tube_locs.append(diluent.wells()[next_5ml])
+            next_5ml += 1
+        else:
+            if large_rack is None:
+                large_rack = protocol.load_labware(tube_types[2][0], large_tube_slot)
+            tube_locs.append(large_rack.wells()[sum(1 for loc in tube_locs if loc.parent is large_rack)])
+        tube_profiles.append(tube_types[t][2])
+
+    # mixing plan for every dilution, at RNA rates - the dilutions pipette mixing can't bring to target_cv
+    # (the largest tubes, at high plate counts) are mixed by hand: the run pauses after each of them
+    set_liquid_class(left_pipette, 'rna')
+    set_liquid_class(p300, 'rna')
+    mixing = [None] + [choose_mixing(vols['rna'][i], vols['dil'][i], p300_range, left_pipette_range, tube_profiles[i])
+                       for i in range(1, len(vols['rna']))]
+    by_hand = [i for i in range(1, len(mixing)) if mixing[i][4] > target_cv]
+    if by_hand:
+        protocol.comment(f'Mix by hand (pipette mixing cannot reach a CV of {target_cv} at {num_plates} plates) - '
+                         f'the run pauses after dilution{"s" if len(by_hand) > 1 else ""} {", ".join(str(i) for i in by_hand)}.')
+
+    # liquid ledger - volume and profile of every tube, starting from the volumes declared for the deck map below
+    ledger = {tube: [diluent_dead_vol + ceil_10(sum(vol for _, vol in source)), tube_types[1][2]]
+              for source, tube in zip(dil_sources, dil_tubes)}
+    for i, loc in enumerate(tube_locs):
+        ledger[loc] = [vols['rna'][0] + 20 if i == 0 else 0, tube_profiles[i]]
+    if neg_handling == 'kit':
+        ledger[tubes[neg_loc]] = [len(plate_map[neg_label]) * per_plate_vol * num_plates + 20, tube_types[0][2]]
+
     
     ### Visualization of deck layout - API 2.14 and above only!
     def visualize_deck():
@@ -280,18 +584,19 @@ def run(protocol: protocol_api.ProtocolContext):
             '#777'
         )
 
-        diluent[dil_loc].load_liquid(
-            diluent_viz,
-            200 + ceil_10(sum(vols['dil']))
-        )
+        for source, tube in zip(dil_sources, dil_tubes):
+            tube.load_liquid(
+                diluent_viz,
+                diluent_dead_vol + ceil_10(sum(vol for _, vol in source))
+            )
 
-        tubes['A1'].load_liquid(
+        tube_locs[0].load_liquid(
             RNA_viz,
             vols['rna'][0] + 20
         )
 
         for i in range(1, len(vols['rna'])):
-            tubes.wells()[i].load_liquid(
+            tube_locs[i].load_liquid(
                 empty_viz,
                 0
             )
@@ -299,7 +604,7 @@ def run(protocol: protocol_api.ProtocolContext):
         if neg_handling == 'kit':
             tubes[neg_loc].load_liquid(
                 neg_viz,
-                4 * (vol_per_well + excess_vol) + 20
+                len(plate_map[neg_label]) * per_plate_vol * num_plates + 20
             )
     
     if float(metadata['apiLevel']) >= 2.14:
@@ -311,16 +616,24 @@ def run(protocol: protocol_api.ProtocolContext):
     ###
 
     pipette = choose_pipette(max(vols['dil']), p300_range, left_pipette_range)[0]
+    liquid = set_liquid_class(pipette, 'aqueous')
 
     pipette.pick_up_tip()
-    pipette.transfer(
-        vols['dil'],
-        diluent[dil_loc],
-        [tubes.wells()[i] for i in range(len(vols['dil']))],
-        blow_out = True,
-        blowout_location = 'source well',
-        new_tip = 'Never'
-    )
+    for source, tube in zip(dil_sources, dil_tubes):
+        parts = [(i, vol) for i, vol in source if i < len(vols['dil'])]    # negatives are plated in step 3
+        if not parts:
+            continue
+        for i, vol in parts:
+            pipette.transfer(
+                vol,
+                aspirate_location(ledger, tube, vol),
+                tube_locs[i],
+                air_gap = liquid['air_gap'],
+                blow_out = True,
+                blowout_location = liquid['blowout'],
+                new_tip = 'Never'
+            )
+            ledger[tube_locs[i]][0] += vol
     pipette.drop_tip()
 
 
@@ -328,55 +641,101 @@ def run(protocol: protocol_api.ProtocolContext):
     ### 2. Perform dilutions
     ###
 
+    # both pipettes at RNA rates - the mixing plan was worked out from them
+    set_liquid_class(left_pipette, 'rna')
+    liquid = set_liquid_class(p300, 'rna')
+
     for i in range(1, len(vols['rna'])):
 
-        pipette, mix_vol, use_p300_mix = choose_mixing(vols['rna'][i], vols['dil'][i],
-                                                       p300_range, left_pipette_range)
+        pipette, mix_pipette, cycles, mix_vol, cv = mixing[i]
 
-        if not use_p300_mix:
-            pipette.transfer(
-                vols['rna'][i],
-                tubes.wells()[i-1],
-                tubes.wells()[i],
-                mix_after = (5, mix_vol)
-            )
-        
-        else:
-            pipette.transfer(
-                vols['rna'][i],
-                tubes.wells()[i-1],
-                tubes.wells()[i]
-            )
-            p300.pick_up_tip()
-            p300.mix(5, mix_vol, tubes.wells()[i])
-            p300.drop_tip()
+        pipette.pick_up_tip()
+        pipette.transfer(
+            vols['rna'][i],
+            aspirate_location(ledger, tube_locs[i-1], vols['rna'][i]),
+            tube_locs[i],
+            air_gap = liquid['air_gap'],
+            new_tip = 'never'
+        )
+        ledger[tube_locs[i]][0] += vols['rna'][i]
+
+        # mixing with the other pipette takes a fresh tip
+        if mix_pipette is not pipette:
+            pipette.drop_tip()
+            mix_pipette.pick_up_tip()
+
+        mix_pipette.mix(cycles, mix_vol, tube_locs[i])
+        mix_pipette.drop_tip()
+        if cv > target_cv:
+            protocol.pause(f'Dilution {i} ({tube_locs[i]}): mixing is predicted to leave a CV of {cv:.2f} '
+                           f'(target {target_cv}) - cap the tube, mix it by inversion, uncap it and put it back, then resume.')
 
 
     ###
     ### 3. Plate dilutions
     ###
 
-    wells = get_wells()
+    wells = [plate_map[label] for label in plate_map_labels]
+    dil_plate_wells = [WellIndex(dil_plate) for dil_plate in dil_plates]
+    tip_capacity = p300_tips.wells()[0].max_volume
 
+    # plating steps: source, volumes, destination wells, copies per well (0 for negatives),
+    # and the least liquid a used tip's leftover mixes into (the tube's contents, or the first aspiration if smaller)
+    plating = []
     for i in range(len(vols['rna'])):
-        p300.distribute(
-            (vol_per_well+excess_vol)*num_plates,
-            tubes.wells()[i],
-            [plate.wells()[x] for x in wells[i]],
-            disposal_volume = 10
-        )
+        volumes = [per_plate_vol*share for share in plate_shares for x in wells[i]]
+        tube_vol = vols['rna'][i] + vols['dil'][i] + (20 if i == 0 else 0) - (vols['rna'][i+1] if i+1 < len(vols['rna']) else 0)
+        plating.append((
+            tube_locs[i],
+            volumes,
+            [dil_plate[x] for dil_plate in dil_plate_wells for x in wells[i]],
+            copies_per_well[i],
+            min(tube_vol, tip_capacity, sum(volumes) + 10)
+        ))
 
     if neg_handling != 'manual':
         if neg_handling == 'kit':
             loc = tubes[neg_loc]
         else:
-            loc = diluent[dil_loc]
-
-        p300.distribute(
-            (vol_per_well+excess_vol)*num_plates,
+            # the diluent tube that the negative volume was set aside in
+            loc = next(tube for source, tube in zip(dil_sources, dil_tubes)
+                       if any(i == len(vols['dil']) for i, _ in source))
+        volumes = [per_plate_vol*share for share in plate_shares for x in plate_map[neg_label]]
+        plating.append((
             loc,
-            [plate.wells()[x] for x in [88, 89, 90, 91]],
-            disposal_volume = 10
-        )
+            volumes,
+            [dil_plate[x] for dil_plate in dil_plate_wells for x in plate_map[neg_label]],
+            0,
+            min(tip_capacity, sum(volumes) + 10)
+        ))
+
+    # negatives first, then lowest to highest concentration, reusing a tip while the carryover stays within tolerance
+    plating.sort(key=lambda step: step[3])
+    steps = [(conc, vol) for _, _, _, conc, vol in plating]
+    new_tips = plan_tip_reuse(steps)
+    check_lineage(steps, [dests for _, _, dests, _, _ in plating], new_tips)
+
+    # one distribute per aspiration, each just below the surface; disposal volume goes back to the tube -
+    # into qPCR plates, each dispense is made above the master mix and touched off on the well wall
+    for (source, volumes, dests, copies, _), new_tip in zip(plating, new_tips):
+        if new_tip:
+            if p300.has_tip:
+                p300.drop_tip()
+            p300.pick_up_tip()
+        liquid = set_liquid_class(p300, 'rna' if copies > 0 else 'aqueous')
+        for trip in dispense_trips(volumes, tip_capacity, 10):
+            p300.distribute(
+                [volumes[k] for k in trip],
+                aspirate_location(ledger, source, sum(volumes[k] for k in trip) + 10),
+                [dests[k].top(-qpcr_dispense_depth) if direct else dests[k] for k in trip],
+                disposal_volume = 10,
+                air_gap = liquid['air_gap'],
+                touch_tip = direct,
+                blow_out = True,
+                blowout_location = liquid['blowout'],
+                new_tip = 'never'
+            )
+            ledger[source][0] += 10
+    p300.drop_tip()
 
     protocol.home()
\ No newline at end of file
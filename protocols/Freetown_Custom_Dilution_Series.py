@@ -15,11 +15,15 @@ either as a pasted list of values, or as an imported csv file "Dilution Series.c
    Then, drag the file onto the "Upload CSV to Opentrons" widget to securely copy the file to Opentrons via SSH.
 2. If needed, you can also change the position of the tube of diluent - "diluent_location" variable.
 
+The protocol keeps track of the liquid in every tube and aspirates just below the surface rather than at the bottom,
+so the diluent and stock volumes shown in the deck map must be what is actually in the tubes.
+
 '''
 
 from datetime import datetime
 import csv
 import io
+import math
 from opentrons import protocol_api
 
 # To paste a list below (edit default volumes):
@@ -28,6 +32,150 @@ from opentrons import protocol_api
 # then export this sheet as a csv. Open the csv with Notepad and paste contents in the "csv_raw" variable below.
 # Ensure that column headers and stock/source tube information ("dilution 0") are EXCLUDED.
 
+# mixing model for the dilution tubes (see dev/planning/mixing.py)
+target_cv = 0.02                  # coefficient of variation of concentration within a tube after mixing
+tube_cone = (3.0, 8.6, 17.56)     # 1.5 mL tube, conical part: bottom diameter, top diameter, height (mm)
+tube_diameter = 8.9               # mm, above the conical part
+min_mix_cycles = 5                # the validated mix, kept as a floor: at least 5 cycles at the default flow rate...
+mix_fraction = 0.8                # ...of 80% of the tube volume (capped at the pipette's maximum)
+water_viscosity = 1.0             # mm²/s
+
+# aspiration height (see dev/planning/liquid_height.py)
+immersion_depth = 2.0             # mm below the liquid surface left after an aspiration
+min_clearance = 1.0               # mm from the tube bottom - the default aspiration height
+
+# liquid classes (see dev/planning/liquid_classes.py): flow rates (µL/s) by pipette model - aspirate, dispense,
+# blow out - then delays after aspirating and dispensing (s), air gap (µL) and where the disposal volume goes
+# diluent and RNA both run at the default rates, which the pipettes' accuracy specifications are measured at -
+# the diluent volume sets the dilution factor, so it only speeds up once gravimetric.py has fitted a faster rate
+liquid_classes = {
+    'aqueous': {'rates': {'p20_single_gen2': (7.56, 7.56, 7.56), 'p300_single_gen2': (92.86, 92.86, 92.86),
+                          'p1000_single_gen2': (274.7, 274.7, 274.7)},
+                'aspirate_delay': 0.0, 'dispense_delay': 0.0, 'air_gap': 0.0, 'blowout': 'source well'},
+    'rna': {'rates': {'p20_single_gen2': (7.56, 7.56, 7.56), 'p300_single_gen2': (92.86, 92.86, 92.86),
+                      'p1000_single_gen2': (274.7, 274.7, 274.7)},
+            'aspirate_delay': 0.0, 'dispense_delay': 0.0, 'air_gap': 0.0, 'blowout': 'source well'}
+}
+
+
+def tube_volume(height:float):
+    '''Approximate volume (µL) of liquid filled to a height (mm above the bottom) in a 1.5 mL tube.'''
+    d1, d2, h = tube_cone
+    if height >= h:
+        return math.pi*h/12*(d1**2 + d1*d2 + d2**2) + (height - h)*math.pi*tube_diameter**2/4
+    d = d1 + (d2 - d1)*height/h
+    return math.pi*height/12*(d1**2 + d1*d + d**2)
+
+
+def tube_height(vol:float):
+    '''Approximate liquid height (mm above the bottom) of a volume (µL) in a 1.5 mL tube.'''
+    low, high = 0.0, 40.0
+    for _ in range(30):
+        mid = (low + high)/2
+        if tube_volume(mid) < vol:
+            low = mid
+        else:
+            high = mid
+    return (low + high)/2
+
+
+def set_liquid_class(pipette, name:str):
+    '''Set a pipette's flow rates (aspirate, dispense, blow out) for a liquid class, and return the class.'''
+    liquid = liquid_classes[name]
+    pipette.flow_rate.aspirate, pipette.flow_rate.dispense, pipette.flow_rate.blow_out = liquid['rates'][pipette.name]
+    return liquid
+
+
+def cylinder_height(well):
+    '''Liquid height function for a tube of unknown shape: a cylinder of the tube's diameter -
+    lower than the real surface in a tube with a conical bottom, never higher.'''
+    return lambda vol: vol/(math.pi*(well.diameter/2)**2)
+
+
+def aspirate_location(ledger:dict, well, vol:float):
+    '''Take vol out of a tube in the liquid ledger (well -> [volume, height function]) and return where to aspirate it:
+    immersion_depth below the surface that will be left afterwards (so the tip stays submerged to the end),
+    but no lower than min_clearance.'''
+    ledger[well][0] -= vol
+    return well.bottom(max(min_clearance, ledger[well][1](max(0, ledger[well][0])) - immersion_depth))
+
+
+def plan_mixing(rna_vol:float, dil_vol:float, pipette, ranges:list):
+    '''After transferring rna_vol into dil_vol with pipette, choose the pipette, number of cycles
+    and volume for mixing the tube.
+
+    Every option keeps the validated mix - at least min_mix_cycles at mix_fraction of the tube volume
+    (capped at the pipette's maximum), at the default flow rate - and adds cycles only where the model
+    (see dev/planning/mixing.py) predicts the tube stays short of the target homogeneity: each cycle mixes
+    the volume it moves, but only as far up the liquid column as the dispense jet reaches.
+    Returns (mixing pipette, cycles, volume, predicted CV). If no option reaches target_cv in
+    20 cycles, the one getting closest is returned, and its CV shows by how much it falls short.'''
+    total_vol = rna_vol + dil_vol
+    start_cv = math.sqrt(dil_vol/rna_vol)    # concentration CV right after the transfer, before mixing
+
+    best = None
+    for r in ranges:
+        mix_pipette = r['pipette']
+        mix_vol = round(min(mix_fraction*total_vol, r['max']), 1)
+        if mix_vol < r['min']:
+            continue
+        aspirate, dispense = mix_pipette.flow_rate.aspirate, mix_pipette.flow_rate.dispense
+        tip_time = 0 if mix_pipette is pipette else 11    # s, picking up and dropping another tip
+        column = tube_height(total_vol - mix_vol) - 1    # liquid above the tip at the end of an aspiration
+        reach = 0.4*dispense/(math.pi*water_viscosity)   # mm, jet penetration (0.1 tip diameters per unit Re)
+        efficiency = min(1.0, reach/column)*(1 - tube_volume(1)/total_vol)
+        per_cycle = 1 - efficiency*mix_vol/total_vol
+        cycles = min_mix_cycles
+        if start_cv*per_cycle**cycles > target_cv:
+            cycles = min(20, max(cycles, math.ceil(math.log(target_cv/start_cv)/math.log(per_cycle))))
+        cv = start_cv*per_cycle**cycles
+        time = tip_time + cycles*(mix_vol/aspirate + mix_vol/dispense + 0.5)
+        # fastest option reaching the target; if none does in 20 cycles, the one getting closest
+        key = (max(0.0, cv - target_cv), time)
+        if best is None or key < best[0]:
+            best = (key, mix_pipette, cycles, mix_vol, cv)
+
+    return best[1:]
+
+
+def build_plan(dataset:list, smaller_pipette, larger_pipette, smaller_max_vol:float, mixing_ranges:list):
+    '''From the CSV rows, work out everything the run needs - volumes, tubes, pipettes and mixing -
+    as a dictionary (pipettes are referred to by mount).'''
+    plan = {
+        'diluent_vols': [float(row[2]) for row in dataset],
+        'tubes_to_fill': [int(row[0]) for row in dataset],
+        'rna': []
+    }
+    plan['total_diluent_vol'] = 200 + sum(plan['diluent_vols'])
+    plan['stock_vol'] = float(dataset[0][1]) + 20
+
+    # one pipette for all diluent: the larger pipette if any volume is greater than the smaller pipette's max
+    if max(plan['diluent_vols']) > float(smaller_max_vol):
+        plan['diluent_mount'] = larger_pipette.mount
+    else:
+        plan['diluent_mount'] = smaller_pipette.mount
+
+    for row in dataset:
+        if float(row[1]) > float(smaller_max_vol):
+            pipette = larger_pipette
+        else:
+            pipette = smaller_pipette
+
+        # choose mixing pipette, cycles and volume for this tube
+        mix_pipette, cycles, mix_vol, cv = plan_mixing(float(row[1]), float(row[2]), pipette, mixing_ranges)
+
+        plan['rna'].append({
+            'tube': int(row[0]),
+            'vol': float(row[1]),
+            'mount': pipette.mount,
+            'mix_mount': mix_pipette.mount,
+            'mix_cycles': cycles,
+            'mix_vol': mix_vol,
+            'mix_cv': cv
+        })
+
+    return plan
+
 
 metadata = {
     'apiLevel': '2.18',
@@ -175,15 +323,28 @@ def run(protocol: protocol_api.ProtocolContext):
 
     if left_max_vol > right_max_vol:
         larger_pipette = left_pipette
-        larger_max_vol = left_max_vol
         smaller_pipette = right_pipette
         smaller_max_vol = right_max_vol
     else:
         larger_pipette = right_pipette
-        larger_max_vol = right_max_vol
         smaller_pipette = left_pipette
         smaller_max_vol = left_max_vol
 
+    pipettes = {'left': left_pipette, 'right': right_pipette}
+
+    # pipette ranges available for mixing
+    mixing_ranges = [
+        {'pipette': left_pipette, 'min': left_pipette.min_volume, 'max': float(left_max_vol)},
+        {'pipette': right_pipette, 'min': right_pipette.min_volume, 'max': float(right_max_vol)}
+    ]
+
+
+    ###
+    ### Transfer plan
+    ###
+
+    plan = build_plan(dataset, smaller_pipette, larger_pipette, smaller_max_vol, mixing_ranges)
+
     
     ### Visualization of deck layout - API 2.14 and above only!
     ### To use protocol simulator, downgrade this protocol to 2.13 and comment out this section
@@ -208,66 +369,56 @@ def run(protocol: protocol_api.ProtocolContext):
         '#777'
     )
 
-    total_diluent_vol = 200
-    for row in dataset:
-        total_diluent_vol = total_diluent_vol + float(row[2])
-
     diluent[diluent_location].load_liquid(
         diluent_viz,
-        total_diluent_vol
+        plan['total_diluent_vol']
     )
 
     tubes['A1'].load_liquid(
         RNA_viz,
-        float(dataset[0][1]) + 20
+        plan['stock_vol']
     )
 
-    for row in dataset:
-        tubes.wells()[int(row[0])].load_liquid(
+    for index in plan['tubes_to_fill']:
+        tubes.wells()[index].load_liquid(
             empty_viz,
             0
         )
     # ************************************
+
+    # liquid ledger - volume and height function of every tube, starting from the volumes declared for the deck map
+    ledger = {diluent[diluent_location]: [plan['total_diluent_vol'], cylinder_height(diluent[diluent_location])],
+              tubes['A1']: [plan['stock_vol'], tube_height]}
+    for index in plan['tubes_to_fill']:
+        ledger[tubes.wells()[index]] = [0, tube_height]
     
 
     ###
     ### 1. Transfer diluent
     ###
 
-    counter = []
-    diluent_vols = []
-    tubes_to_fill = []
+    diluent_vols = plan['diluent_vols']
+    tubes_to_fill = plan['tubes_to_fill']
 
-    for row in dataset:
-
-        # ensure that row data is wrapped in int() - needs to be number type, not string
-        diluent_vols.append(float(row[2]))
-        tubes_to_fill.append(int(row[0]))
-
-        # Choose pipette to use: first, create list: any time a volume greater than smaller max vol is detected, a "1" gets added to the list
-        if float(row[2]) > float(smaller_max_vol):
-            counter.append(1)
-        else:
-            counter.append(0)
-        
     protocol.comment(f"Diluent volumes: {diluent_vols}")
     protocol.comment(f"Tubes being filled: {tubes_to_fill}")
-    
-    # Choosing pipette: check: are there any "1"s in the list? if so, a volume greater than smaller max vol is present, and we will need the larger pipette
-    if sum(counter) > 0:
-        pipette = larger_pipette
-    else:
-        pipette = smaller_pipette
 
+    pipette = pipettes[plan['diluent_mount']]
+    liquid = set_liquid_class(pipette, 'aqueous')
+
+    # one transfer per tube, each aspirated just below the surface
     pipette.pick_up_tip()
-    pipette.transfer(
-        diluent_vols,
-        diluent[diluent_location],
-        [tubes.wells()[index] for index in tubes_to_fill],
-        blow_out = True,
-        blowout_location = "source well",
-        new_tip = "Never"
-    )
+    for vol, index in zip(diluent_vols, tubes_to_fill):
+        pipette.transfer(
+            vol,
+            aspirate_location(ledger, diluent[diluent_location], vol),
+            tubes.wells()[index],
+            air_gap = liquid['air_gap'],
+            blow_out = True,
+            blowout_location = liquid['blowout'],
+            new_tip = "Never"
+        )
+        ledger[tubes.wells()[index]][0] += vol
     pipette.drop_tip()
     
 
@@ -275,30 +426,35 @@ def run(protocol: protocol_api.ProtocolContext):
     ### 2. Transfer RNA
     ###
 
-    for row in dataset:
+    # both pipettes at RNA rates - the mixing plan was worked out from them
+    set_liquid_class(left_pipette, 'rna')
+    liquid = set_liquid_class(right_pipette, 'rna')
 
-        # choose pipette
-        if float(row[1]) > float(smaller_max_vol):
-            pipette = larger_pipette
-            pipette_max_vol = larger_max_vol
-        else:
-            pipette = smaller_pipette
-            pipette_max_vol = smaller_max_vol
+    for step in plan['rna']:
 
-        # set mixing volume - must be less than max pipette volume
-        if (float(row[1]) + float(row[2]))*0.8 < pipette_max_vol:
-            mix_vol = (float(row[1]) + float(row[2]))*0.8
-        else:
-            mix_vol = float(pipette_max_vol)
-        
+        pipette = pipettes[step['mount']]
+        mix_pipette = pipettes[step['mix_mount']]
+
+        pipette.pick_up_tip()
         pipette.transfer(
-            float(row[1]),
-            [tubes.wells()[int(row[0]) - 1]],
-            [tubes.wells()[int(row[0])]],
-            mix_after = (
-                5,
-                mix_vol
-            )
+            step['vol'],
+            aspirate_location(ledger, tubes.wells()[step['tube'] - 1], step['vol']),
+            tubes.wells()[step['tube']],
+            air_gap = liquid['air_gap'],
+            new_tip = 'never'
         )
+        ledger[tubes.wells()[step['tube']]][0] += step['vol']
+
+        # mixing with the other pipette takes a fresh tip
+        if mix_pipette is not pipette:
+            pipette.drop_tip()
+            mix_pipette.pick_up_tip()
+
+        mix_pipette.mix(step['mix_cycles'], step['mix_vol'], tubes.wells()[step['tube']])
+        mix_pipette.drop_tip()
+        if step['mix_cv'] > target_cv:
+            protocol.pause(f"Tube {tubes.wells()[step['tube']].well_name}: mixing is predicted to leave a CV of "
+                           f"{step['mix_cv']:.2f} (target {target_cv}) - cap the tube, mix it by inversion, uncap it "
+                           f"and put it back, then resume.")
 
     protocol.home()
\ No newline at end of file
@@ -33,6 +33,10 @@ This protocol aliquots RNA dilutions into a 96-well plate, matching the plate la
 RNA from these aliquots can then be "stamped" into each qPCR plate [i.e., 10µL from column 1 of the aliquot plate can be added
 to column 1 of the qPCR plate, and so on]. This minimizes user time/effort, especially if a multichannel multipipette is not available.
 
+The robot can also do the stamping: set stamp_plates (user-defined variables) to the number of qPCR plates, already
+plated with master mix, and after aliquoting it transfers whole columns of the aliquot plate into them with an 8-channel
+pipette (p20 multi on the left mount; p300 multi for volumes over 20µL) - 12 transfers per plate instead of 96.
+
 Plate Map
 
      1    2    3    4    5    6    7    8    9    10   11   12 
@@ -57,11 +61,14 @@ Plate Map
 Tube Setup
 
 Empty 96-well plate
+If stamping on the robot: qPCR plates with master mix in slots 4-7 [up to 4 plates; MicroAmp EnduraPlates,
+labware_definitions/microamp_endura_96well_with_rack_0.1ml], multichannel filter tips in slots 8-11 [one rack per plate]
 RNA dilutions [12]: columns 1-3 of 24-ct 1.5mL rack
 
 '''
 
 from opentrons import protocol_api
+import math
 
 metadata = {
     'apiLevel': '2.14',
@@ -71,6 +78,93 @@ metadata = {
                     '''
 }
 
+tip_capacity = 200      # µL, p300 with 200 µL filter tips
+disposal_vol = 20       # µL, distribute's default disposal volume for the p300 (its minimum volume)
+stamp_dead_vol = 5      # µL left in each aliquot well after stamping - the multichannel can't take the last of it
+
+# deck slots for stamping on the robot: qPCR plates, and one rack of multichannel tips per plate
+stamp_plate_slots = [4, 5, 6, 7]
+stamp_tip_slots = [8, 9, 10, 11]
+
+# wells to fill for each dilution and the negative, compiled from the plate map above (dev/planning/plate_map.py) -
+# to change the layout, redraw the map and run `python -m planning.plate_map --update` on this file
+plate_map = {
+    '1': ['A1', 'A2', 'A3', 'A4'],
+    '2': ['A5', 'A6', 'A7', 'A8'],
+    '3': ['A9', 'A10', 'A11', 'A12'],
+    '4': ['B1', 'B2', 'B3', 'B4'],
+    '5': ['B5', 'B6', 'B7', 'B8'],
+    '6': ['B9', 'B10', 'B11', 'B12'],
+    '7': ['C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'C7', 'C8'],
+    'Negative': ['C9', 'C10', 'C11', 'C12', 'D12', 'D11', 'D10', 'D9'],
+    '8': ['D1', 'D2', 'D3', 'D4', 'D5', 'D6', 'D7', 'D8'],
+    '9': ['E1', 'E2', 'E3', 'E4', 'E5', 'E6', 'E7', 'E8', 'E9', 'E10', 'E11', 'E12'],
+    '10': ['F1', 'F2', 'F3', 'F4', 'F5', 'F6', 'F7', 'F8', 'F9', 'F10', 'F11', 'F12'],
+    '11': ['G1', 'G2', 'G3', 'G4', 'G5', 'G6', 'G7', 'G8', 'G9', 'G10', 'G11', 'G12'],
+    '12': ['H1', 'H2', 'H3', 'H4', 'H5', 'H6', 'H7', 'H8', 'H9', 'H10', 'H11', 'H12'],
+}
+
+# aspiration height (see dev/planning/liquid_height.py)
+immersion_depth = 2.0   # mm below the liquid surface left after an aspiration
+min_clearance = 1.0     # mm from the tube bottom - the default aspiration height
+
+
+def aspirate_location(ledger:dict, well, vol:float):
+  '''Take vol out of a tube in the liquid ledger (well -> volume) and return where to aspirate it: immersion_depth
+  below the surface that will be left afterwards, but no lower than min_clearance. The liquid height is that of a
+  cylinder of the tube's diameter - lower than the real surface in a tube with a conical bottom, never higher.'''
+  ledger[well] -= vol
+  height = max(0, ledger[well]) / (math.pi * (well.diameter/2)**2)
+  return well.bottom(max(min_clearance, height - immersion_depth))
+
+
+def aliquot(pipette, vol:float, source, dests:list, ledger:dict):
+  '''Distribute vol from source to each of dests with one tip, disposal volume blown back into the source -
+  one distribute per aspiration, so each aspiration is made just below the liquid surface. A tube filled with
+  just its aliquots has no disposal volume left for the last trip: that trip takes only what the tube still holds.'''
+  if vol*len(dests) > ledger[source] + 1e-9:
+    raise ValueError(f'{source} holds {ledger[source]} µL - not enough for {len(dests)} aliquots of {vol} µL')
+  per_trip = int((tip_capacity - disposal_vol) // vol)
+  pipette.pick_up_tip()
+  for start in range(0, len(dests), per_trip):
+    trip = dests[start:start + per_trip]
+    disposal = max(0, min(disposal_vol, ledger[source] - vol*len(trip)))
+    pipette.distribute(
+        vol,
+        aspirate_location(ledger, source, vol*len(trip) + disposal),
+        trip,
+        disposal_volume = disposal,
+        blow_out = True,
+        blowout_location = 'source well',
+        new_tip = 'never'
+      )
+    ledger[source] += disposal
+  pipette.drop_tip()
+
+
+class WellIndex:
+    '''The wells of a loaded labware, looked up once: by index in plate order or by name (index['A1']),
+    by row and column (index.rows[0], index.columns[0]) and by block (index.block('A1', 'H3')).'''
+
+    def __init__(self, labware):
+        self.wells = labware.wells()
+        self.names = labware.wells_by_name()
+        self.rows = labware.rows()
+        self.columns = labware.columns()
+
+    def __getitem__(self, key):
+        return self.names[key] if isinstance(key, str) else self.wells[key]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def block(self, first, last):
+        '''Wells of the rectangle with corners first and last (names), column by column.'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return [self.columns[c][r] for c in range(min(c0, c1), max(c0, c1) + 1)
+                for r in range(min(r0, r1), max(r0, r1) + 1)]
+
+
 def run(protocol: protocol_api.ProtocolContext):
 
   protocol.home()
@@ -80,10 +174,14 @@ def run(protocol: protocol_api.ProtocolContext):
   ###
 
   aliquot_vol = 45            # volume of RNA to be aliquoted into each plate well
+  tube_vol = 540              # volume of RNA dilution (and negative) in each tube
 
   negatives_tube = True       # if false, negatives will not be plated/aliquoted
   negatives_location = 'A5'   # location within 24-ct 1.5mL tube rack
 
+  stamp_plates = 0            # qPCR plates to stamp from the aliquot plate on the robot [0-4]; 0 = stamp by hand
+  stamp_vol = 10              # volume of RNA stamped into each qPCR plate well
+
 
 
   ###
@@ -93,10 +191,27 @@ def run(protocol: protocol_api.ProtocolContext):
   p300tips = protocol.load_labware('opentrons_96_filtertiprack_200ul', 3)
   tubes = protocol.load_labware('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', 2)
   plate = protocol.load_labware('armadillo_96_wellplate_200ul_pcr_full_skirt', 1)
+  plate_wells = WellIndex(plate)
+  tube_wells = WellIndex(tubes)
 
   # pipette initialization
   p300 = protocol.load_instrument('p300_single_gen2', 'right', tip_racks=[p300tips])
 
+  # stamping - columns of the aliquot plate that hold RNA, one fresh set of 8 tips per column per plate
+  if stamp_plates > len(stamp_plate_slots):
+    raise ValueError(f'{stamp_plates} qPCR plates do not fit on the deck - stamp at most {len(stamp_plate_slots)} on the robot')
+  if stamp_plates*stamp_vol + stamp_dead_vol > aliquot_vol:
+    raise ValueError(f'{stamp_plates} x {stamp_vol} µL is more than the {aliquot_vol} µL aliquots hold')
+  stamp_columns = sorted({int(well[1:]) - 1 for wells in plate_map.values() for well in wells})
+  if stamp_plates > 0:
+    small = stamp_vol <= 20
+    tip_racks = math.ceil(len(stamp_columns)*stamp_plates / 12)
+    multitips = [protocol.load_labware('opentrons_96_filtertiprack_20ul' if small else 'opentrons_96_filtertiprack_200ul', slot)
+                 for slot in stamp_tip_slots[:tip_racks]]
+    qpcr_plates = [WellIndex(protocol.load_labware('microamp_endura_96well_with_rack_0.1ml', slot, 'qPCR Plate ' + str(i + 1)))
+                   for i, slot in enumerate(stamp_plate_slots[:stamp_plates])]
+    multi = protocol.load_instrument('p20_multi_gen2' if small else 'p300_multi_gen2', 'left', tip_racks=multitips)
+
 
   ###
   ### Visualization of deck layout - API 2.14 and above only!
@@ -117,134 +232,73 @@ def run(protocol: protocol_api.ProtocolContext):
     )
 
   for i in range(12):
-      tubes.wells()[i].load_liquid(
+      tube_wells[i].load_liquid(
           RNA_viz,
-          540
+          tube_vol
       )
 
   if negatives_tube == True:
       tubes[negatives_location].load_liquid(
           neg_viz,
-          540
+          tube_vol
       )
   # ************************************
 
-
-
-  ###
-  ### 1. Aliquot dilutions to plate - 4 replicates (dilutions 1-6)
-  ###
-
-  for dil in range(6):  # dilutions with indices 0-5
-     
-     # create list containing wells to fill
-     wells_to_fill = []
-    
-     if dil > 2:
-        row = 1 # row B
-     else:
-        row = 0 # row A
-        
-     col_group = dil % 3  # columns 1-4, 5-8, or 9-12
-
-     for col in range(4): # 4 replicates per row - 4 columns
-        wells_to_fill.append(
-            32*col_group +
-            8*col +
-            row
-        )
-
-     # fill wells
-     p300.distribute(
-         aliquot_vol,
-         [tubes.wells()[dil]],
-         [plate.wells()[well] for well in wells_to_fill],
-         blow_out = True,
-         blowout_location = 'source well'
-      )
+  # liquid ledger - volume left in each tube, for aspirating just below the surface
+  ledger = {tube: tube_vol for tube in tube_wells[:12]}
+  if negatives_tube == True:
+      ledger[tubes[negatives_location]] = tube_vol
 
 
 
   ###
-  ### 2. Aliquot dilutions to plate - 8 replicates (dilutions 7-8)
+  ### 1. Aliquot dilutions to plate - 4 to 12 replicates each, as drawn in the plate map
   ###
 
-  for dil in range(6,8):  # dilutions with indices 6-7
-     
-     # create list containing wells to fill
-     wells_to_fill = []
-
-     row = dil - 4   # convert dilution index (ex. "6") to row index (ex. "2" - row C)
-
-     for col in range(8): # 8 replicates per row
-        wells_to_fill.append(
-            8*col +
-            row
-        )
+  for dil in range(12):  # dilutions with indices 0-11
 
      # fill wells
-     p300.distribute(
+     aliquot(
+         p300,
          aliquot_vol,
-         [tubes.wells()[dil]],
-         [plate.wells()[well] for well in wells_to_fill],
-         blow_out = True,
-         blowout_location = 'source well'
-      )        
-     
+         tube_wells[dil],
+         [plate_wells[well] for well in plate_map[str(dil + 1)]],
+         ledger
+      )
 
 
   ###
-  ### 3. Aliquot dilutions to plate - 12 replicates (dilutions 9-12)
+  ### 2. Aliquot negative control, if included
   ###
 
-  for dil in range(8, 12):  # dilutions with indices 8-11
-     
-     # create list containing wells to fill
-     wells_to_fill = []
-
-     row = dil - 4   # convert dilution index (ex. "8") to row index (ex. "4" - row E)
-
-     for col in range(12): # 12 replicates per row
-        wells_to_fill.append(
-            8*col +
-            row
-        )
+  if negatives_tube == True:
 
-     # fill wells
-     p300.distribute(
-         aliquot_vol,
-         [tubes.wells()[dil]],
-         [plate.wells()[well] for well in wells_to_fill],
-         blow_out = True,
-         blowout_location = 'source well'
+    # fill wells - rows C and D, columns 9-12
+    aliquot(
+        p300,
+        aliquot_vol,
+        tubes[negatives_location],
+        [plate_wells[well] for well in plate_map['Negative']],
+        ledger
       )
 
 
   ###
-  ### 4. Aliquot negative control, if included
+  ### 3. Stamp the aliquot plate into the qPCR plates, if stamping on the robot
   ###
 
-  if negatives_tube == True:
-      
-    # create list containing wells to fill
-    wells_to_fill = []
-
-
-    for row in range(2,4):  # 2 rows: C ("2") and D ("3")
-      for col in range(8,12): # 4 replicates per row, in columns with indices 8-11
-        wells_to_fill.append(
-            8*col +
-            row
-        )
-
-    # fill wells
-    p300.distribute(
-        aliquot_vol,
-        tubes[negatives_location],
-        [plate.wells()[well] for well in wells_to_fill],
-        blow_out = True,
-        blowout_location = 'source well'
-      )
+  if stamp_plates > 0:
+
+    # column by column with the multichannel, plate by plate; fresh tips for each transfer,
+    # so no master mix is carried back into the aliquots
+    for qpcr_wells in qpcr_plates:
+      for column in stamp_columns:
+        multi.transfer(
+            stamp_vol,
+            plate_wells.columns[column][0],
+            qpcr_wells.columns[column][0],
+            new_tip = 'always'
+          )
     
   protocol.home()
       
@@ -28,6 +28,9 @@
 #       - tubes D1-6: 10X probes
 #  - 2: Applied Biosystems 384-well MicroAmp plate
 #  - 3: 96-count 20µL tip rack (protocol uses 10 tips)
+# 
+# Each primer mix fills its three rows in one continuous multi-dispense (`multi_dispense`): aspirations are
+# packed to the tip's capacity, and the disposal volume is blown out once, after the last well.
 
 
 from opentrons import protocol_api
@@ -42,6 +45,86 @@ metadata = {
                    D1-6 = 10X probes.'''
 }
 
+
+def plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume=0):
+    '''Pack dispenses (µL per destination, in order) into as few aspirations as possible.
+
+    The disposal volume is aspirated once, stays in the tip for the whole run and is blown out at the end;
+    each aspiration also draws conditioning_volume, which goes straight back into the source.
+    Returns a list of trips, each a list of indices into volumes.'''
+    room = capacity - disposal_volume - conditioning_volume
+    if max(volumes) > room:
+        raise ValueError(f'a {max(volumes)} µL dispense does not fit in {capacity} µL with '
+                         f'{disposal_volume} µL disposal and {conditioning_volume} µL conditioning volume')
+    trips = [[]]
+    filled = 0
+    for i, vol in enumerate(volumes):
+        if filled + vol > room + 1e-9:
+            trips.append([])
+            filled = 0
+        trips[-1].append(i)
+        filled += vol
+    return trips
+
+
+def trash_location(protocol):
+    '''The fixed trash as a blowout location: its well up to API 2.15, the trash bin from 2.16.'''
+    trash = protocol.fixed_trash
+    return trash['A1'] if hasattr(trash, 'wells') else trash
+
+
+def multi_dispense(pipette, volume, source, dests, capacity, disposal_volume, blowout_location,
+                   conditioning_volume=0, touch_tip=False, liquid=None, protocol=None):
+    '''Dispense volume (µL, or a list with one volume per destination) from source into each of dests,
+    as planned by plan_dispenses, then blow out the disposal volume at blowout_location.
+    The disposal volume is cut to what fits beside the largest dispense (none for a full tip), so
+    large volumes go one per aspiration instead of failing.
+    liquid: a liquid class (from set_liquid_class), whose delays are made with protocol after each
+    aspiration and each dispense. The pipette must already have a tip.'''
+    volumes = volume if isinstance(volume, list) else [volume] * len(dests)
+    disposal_volume = max(0, min(disposal_volume, capacity - conditioning_volume - max(volumes)))
+    aspirate_delay = liquid['aspirate_delay'] if liquid else 0
+    dispense_delay = liquid['dispense_delay'] if liquid else 0
+    for n, trip in enumerate(plan_dispenses(volumes, capacity, disposal_volume, conditioning_volume)):
+        pipette.aspirate(sum(volumes[i] for i in trip) + conditioning_volume + (disposal_volume if n == 0 else 0), source)
+        if aspirate_delay:
+            protocol.delay(seconds = aspirate_delay)
+        if touch_tip:
+            pipette.touch_tip(source)
+        if conditioning_volume:
+            pipette.dispense(conditioning_volume, source)
+        for i in trip:
+            pipette.dispense(volumes[i], dests[i])
+            if dispense_delay:
+                protocol.delay(seconds = dispense_delay)
+            if touch_tip:
+                pipette.touch_tip(dests[i])
+    pipette.blow_out(blowout_location)
+
+
+class WellIndex:
+    '''The wells of a loaded labware, looked up once: by index in plate order or by name (index['A1']),
+    by row and column (index.rows[0], index.columns[0]) and by block (index.block('A1', 'H3')).'''
+
+    def __init__(self, labware):
+        self.wells = labware.wells()
+        self.names = labware.wells_by_name()
+        self.rows = labware.rows()
+        self.columns = labware.columns()
+
+    def __getitem__(self, key):
+        return self.names[key] if isinstance(key, str) else self.wells[key]
+
+    def __len__(self):
+        return len(self.wells)
+
+    def block(self, first, last):
+        '''Wells of the rectangle with corners first and last (names), column by column.'''
+        (r0, c0), (r1, c1) = [(ord(name[0]) - ord('A'), int(name[1:]) - 1) for name in (first, last)]
+        return [self.columns[c][r] for c in range(min(c0, c1), max(c0, c1) + 1)
+                for r in range(min(r0, r1), max(r0, r1) + 1)]
+
+
 def run(protocol: protocol_api.ProtocolContext):
 
     # 0. INITIALIZATION
@@ -59,59 +142,36 @@ def run(protocol: protocol_api.ProtocolContext):
     p20tips = protocol.load_labware('opentrons_96_tiprack_20uL', 3)
     reservoir = protocol.load_labware('opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap', 1)
     plate = protocol.load_labware('appliedbiosystemsmicroamp_384_wellplate_40ul', 2)
+    plate_wells = WellIndex(plate)
 
     # pipette initialization/setup
     p20 = protocol.load_instrument('p20_single_gen2', 'left', tip_racks=[p20tips])
 
+    # multi-dispense: tip capacity, and volume kept in the tip to keep the last dispense of each aspiration accurate
+    tip_capacity = min(p20.max_volume, p20tips.wells()[0].max_volume)
+    disposal_volume = p20.min_volume
+
 
     # 1. PRIMER PAIRS
     # fill rows [x, x+4, x+8] with primer mix (for rows A-L, wells 1-18)
     # ex. F1R1 --> A, E, I
     # use 1 tip per primer pair
 
-    # How the construction of loops works below:
-    # Opentrons' list of wells (when using labware.wells() method)
-    # goes by column. So, well A1 is well 0, but well A2 is well 16 (initializing at zero).
-    # Because of this, we have to create the following list to access A1-A18:
-    # [0, 16, 32, 48... 272]
-    # Therefore, to access A1-A18, we can use a loop:
-    # for k in range(18): list.append(k*16)
-    # For E1-E18, we want the following list:
-    # [4, 20, 36, 52... 276]
-    # We can modify the loop to achieve this:
-    # for k in range(18): list.append((k*16) + 4)
-    # By using "i + 4" where i = 0, we can set ourselves up to iterate with i
-    # such that an increase in i corresponds with a new primer mix
-    # and a new set of rows (ex. i = 1 results in lists for rows B and F).
+    # Wells are taken from the plate's rows (numbered from 0): an increase in i
+    # is a new primer mix and a new set of rows (i = 1 gives rows B, F and J).
+    # All three rows for a primer mix are filled in one continuous multi-dispense, row by row.
 
     for i in range(4):                     # iterate through primer mixes 1-4
-        list = []
-        for k in range(18):                # only use first 18 wells in row
-            list.append((k*16)+i)          # make list: wells A1-A18 when i = 0
+        rows = [well for row in (i, i+4, i+8) for well in plate_wells.rows[row][:18]]   # wells A1-A18, E1-E18, I1-I18 when i = 0
         p20.pick_up_tip()                  # one tip per primer mix
-        p20.distribute(
+        multi_dispense(
+            p20,
             volume,
             reservoir['A'+str(i+1)],       # primer mix 1 when i = 0
-            [plate.wells()[wellIndex] for wellIndex in list],
-            new_tip = 'never'
-        )
-        list = []
-        for k in range(18):
-            list.append((k*16)+(i+4))      # make list: wells E1-E18 when i = 0
-        p20.distribute(
-            volume,
-            reservoir['A'+str(i+1)],
-            [plate.wells()[wellIndex] for wellIndex in list],
-            new_tip = 'never'
-        )
-        list = []
-        for k in range(18):
-            list.append((k*16)+(i+8))      # make list: wells I1-I18 when i = 0
-        p20.distribute(
-            volume,
-            reservoir['A'+str(i+1)],
-            [plate.wells()[wellIndex] for wellIndex in list],
-            new_tip = 'never'
+            rows,
+            tip_capacity,
+            disposal_volume,
+            trash_location(protocol)
         )
         p20.drop_tip()                     # drop tip after all 3 rows filled with primer mix
 
@@ -123,22 +183,15 @@ def run(protocol: protocol_api.ProtocolContext):
     # first, adjust dispense height (in mm) - don't touch primers in wells
     p20.well_bottom_clearance.dispense = probeTipHeight
 
-    # loop logic below:
-    # k allows us to add the wells in rows A through L to the list for each column
-    # j allows us to add those 12 wells for all 3 columns that get the probe
-    # (i*48) modifier means that with each increase in i (each new probe), we're moving over by 3 columns
-    # so, when i = 0, first probe will go in columns 1-3;
+    # each new probe moves over by 3 columns: when i = 0, first probe will go in columns 1-3;
     # when i = 1, second probe will go in columns 4-6
 
     for i in range(6):                            # 6 probes
-        list = []
-        for j in range(3):                        # 3 columns to fill (0-3 when i = 0)
-            for k in range(12):
-                list.append(k+(16*j)+(i*48))      # create list of first 12 wells in all 3 columns
+        columns = [well for column in plate_wells.columns[i*3:i*3 + 3] for well in column[:12]]   # rows A-L of the probe's 3 columns
         p20.distribute(
             volume,
             reservoir['D'+str(i+1)],
-            [plate.wells()[wellIndex] for wellIndex in list],
+            columns,
             touch_tip = True
         )
 